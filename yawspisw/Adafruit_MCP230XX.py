@@ -20,8 +20,11 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from Adafruit_I2C import Adafruit_I2C
-import smbus
+try:
+    from Adafruit_I2C import Adafruit_I2C
+except ImportError:
+    # no smbus (not running on RPi), only emulated bus can be used:
+    Adafruit_I2C = None
 import time
 
 MCP23017_IODIRA = 0x00
@@ -40,24 +43,41 @@ class Adafruit_MCP230XX(object):
     OUTPUT = 0
     INPUT = 1
 
-    def __init__(self, address, num_gpios):
+    def __init__(self, address, num_gpios, i2c=None):
         assert num_gpios >= 0 and num_gpios <= 16, "Number of GPIOs must be between 0 and 16"
-        self.i2c = Adafruit_I2C(address=address)
+        if i2c is None:
+            i2c = Adafruit_I2C(address=address)
+        self.i2c = i2c
         self.address = address
         self.num_gpios = num_gpios
+        # set when a write to the chip failed, shadow registers could differ
+        # from the chip, resync() is called on the next change of pins:
+        self.buserror = False
 
-        # set defaults
+        # registers (port A, port B) of direction, pullups and output latches:
         if num_gpios <= 8:
-            self.i2c.write8(MCP23017_IODIRA, 0xFF)  # all inputs on port A
-            self.direction = self.i2c.readU8(MCP23017_IODIRA)
-            self.i2c.write8(MCP23008_GPPUA, 0x00)
-        elif num_gpios > 8 and num_gpios <= 16:
-            self.i2c.write8(MCP23017_IODIRA, 0xFF)  # all inputs on port A
-            self.i2c.write8(MCP23017_IODIRB, 0xFF)  # all inputs on port B
-            self.direction = self.i2c.readU8(MCP23017_IODIRA)
-            self.direction |= self.i2c.readU8(MCP23017_IODIRB) << 8
-            self.i2c.write8(MCP23017_GPPUA, 0x00)
-            self.i2c.write8(MCP23017_GPPUB, 0x00)
+            self._reg_iodir = (MCP23017_IODIRA,)
+            self._reg_gppu = (MCP23008_GPPUA,)
+            self._reg_olat = (MCP23008_OLATA,)
+        else:
+            self._reg_iodir = (MCP23017_IODIRA, MCP23017_IODIRB)
+            self._reg_gppu = (MCP23017_GPPUA, MCP23017_GPPUB)
+            self._reg_olat = (MCP23017_OLATA, MCP23017_OLATB)
+
+        # set defaults: all pins inputs, no pullups
+        for reg in self._reg_iodir:
+            self._write(reg, 0xFF)
+        for reg in self._reg_gppu:
+            self._write(reg, 0x00)
+        # shadow registers, bit n is pin n. chip is written only if a bit
+        # really changes, so no read-modify-write of the chip is needed:
+        self.direction = (1 << (8 * len(self._reg_iodir))) - 1
+        self.pullups = 0
+        self.outputvalue = self._readreg(self._reg_olat)
+        # deferred writes (see defer() and flush()): nesting level and values
+        # of changed registers as they are in the chip:
+        self._deferred = 0
+        self._chipvalues = {}
 
     def _changebit(self, bitmap, bit, value):
         assert value == 1 or value == 0, "Value is %s must be 1 or 0" % value
@@ -66,93 +86,234 @@ class Adafruit_MCP230XX(object):
         elif value == 1:
             return bitmap | (1 << bit)
 
-    def _readandchangepin(self, port, pin, value, currvalue = None):
+    def _write(self, reg, value):
+        # Adafruit_I2C returns -1 on IOError:
+        if self.i2c.write8(reg, value) == -1:
+            self.buserror = True
+
+    def _writereg(self, regs, value):
+        # write register of all ports in one transaction:
+        if len(regs) == 2:
+            # port B register follows port A register (IOCON.BANK = 0):
+            if self.i2c.write16(regs[0], value & 0xFFFF) == -1:
+                self.buserror = True
+        else:
+            self._write(regs[0], value & 0xFF)
+
+    def _readreg(self, regs):
+        # read register of all ports into one bitmap:
+        value = 0
+        for i in range(len(regs)):
+            tmp = self.i2c.readU8(regs[i])
+            if tmp == -1:
+                raise IOError('Error reading register 0x%02X of MCP230XX '
+                              '0x%02X' % (regs[i], self.address))
+            value |= tmp << (8 * i)
+        return value
+
+    def _checkbus(self):
+        # after a failed write shadow registers are read again from the chip,
+        # so changes are computed against real registers. not while
+        # deferred, changes collected in shadow registers would be lost:
+        if self.buserror and not self._deferred:
+            self.resync()
+
+    def _changepin(self, regs, shadow, pin, value):
+        # change bit in shadow register, write the port only if changed
         assert pin >= 0 and pin < self.num_gpios, "Pin number %s is invalid, only 0-%s are valid" % (pin, self.num_gpios)
-        #assert self.direction & (1 << pin) == 0, "Pin %s not set to output" % pin
-        if not currvalue:
-             currvalue = self.i2c.readU8(port)
-        newvalue = self._changebit(currvalue, pin, value)
-        self.i2c.write8(port, newvalue)
+        newvalue = self._changebit(shadow, pin, value)
+        if self._deferred:
+            # only remember value in the chip, written by flush():
+            if newvalue != shadow and regs not in self._chipvalues:
+                self._chipvalues[regs] = shadow
+        elif newvalue != shadow:
+            port = pin // 8
+            self._write(regs[port], (newvalue >> (8 * port)) & 0xFF)
         return newvalue
 
+    def defer(self):
+        """ Start collecting pin changes. Changes of direction, pullups and
+        outputs are done only in shadow registers till flush() is called.
+        Calls can be nested.
+        """
+        self._checkbus()
+        self._deferred += 1
+
+    def flush(self):
+        """ End collecting pin changes started by defer(). If it is the
+        outermost call, every changed register is written in one transaction
+        for both ports.
+        """
+        assert self._deferred > 0, "flush() called without defer()"
+        self._deferred -= 1
+        if self._deferred:
+            return
+        shadows = {
+            self._reg_iodir: self.direction,
+            self._reg_gppu: self.pullups,
+            self._reg_olat: self.outputvalue,
+        }
+        # latches before IODIR, so new outputs are driven with new values:
+        for regs in (self._reg_olat, self._reg_gppu, self._reg_iodir):
+            if regs in self._chipvalues and \
+                    self._chipvalues[regs] != shadows[regs]:
+                self._writereg(regs, shadows[regs])
+        self._chipvalues = {}
+
+    def resync(self):
+        """ Re-read direction, pullups and output latches from the chip into
+        shadow registers, e.g. after a bus error or a reset of the chip.
+        """
+        self.direction = self._readreg(self._reg_iodir)
+        self.pullups = self._readreg(self._reg_gppu)
+        self.outputvalue = self._readreg(self._reg_olat)
+        self.buserror = False
 
     def pullup(self, pin, value):
-        if self.num_gpios <= 8:
-            return self._readandchangepin(MCP23008_GPPUA, pin, value)
-        if self.num_gpios <= 16:
-            lvalue = self._readandchangepin(MCP23017_GPPUA, pin, value)
-            if (pin < 8):
-                return
-            else:
-                return self._readandchangepin(MCP23017_GPPUB, pin-8, value) << 8
+        self._checkbus()
+        self.pullups = self._changepin(self._reg_gppu, self.pullups, pin, value)
+        return self.pullups
 
     # Set pin to either input or output mode
     def config(self, pin, mode):
-        if self.num_gpios <= 8:
-            self.direction = self._readandchangepin(MCP23017_IODIRA, pin, mode)
-        if self.num_gpios <= 16:
-            if (pin < 8):
-                self.direction |= self._readandchangepin(MCP23017_IODIRA, pin, mode)
-            else:
-                self.direction |= self._readandchangepin(MCP23017_IODIRB, pin-8, mode) << 8
-
+        self._checkbus()
+        self.direction = self._changepin(self._reg_iodir, self.direction, pin, mode)
         return self.direction
 
     def output(self, pin, value):
         # assert self.direction & (1 << pin) == 0, "Pin %s not set to output" % pin
-        if self.num_gpios <= 8:
-            self.outputvalue = self._readandchangepin(MCP23008_GPIOA, pin, value, self.i2c.readU8(MCP23008_OLATA))
-        if self.num_gpios <= 16:
-            if (pin < 8):
-                self.outputvalue = self._readandchangepin(MCP23017_GPIOA, pin, value, self.i2c.readU8(MCP23017_OLATA))
-            else:
-                self.outputvalue = self._readandchangepin(MCP23017_GPIOB, pin-8, value, self.i2c.readU8(MCP23017_OLATB)) << 8
-
+        self._checkbus()
+        self.outputvalue = self._changepin(self._reg_olat, self.outputvalue, pin, value)
         return self.outputvalue
 
+    def input_all(self):
+        """ Read levels of all pins in one bulk read.
 
-        self.outputvalue = self._readandchangepin(MCP23017_IODIRA, pin, value, self.outputvalue)
-        return self.outputvalue
+        \return integer bitmap, bit n is level of pin n
+        """
+        if self.num_gpios <= 8:
+            value = self.i2c.readU8(MCP23008_GPIOA)
+        else:
+            # GPIOB register follows GPIOA register (IOCON.BANK = 0):
+            value = self.i2c.readU16(MCP23017_GPIOA)
+        if value == -1:
+            raise IOError('Error reading inputs of MCP230XX 0x%02X'
+                          % self.address)
+        return value
 
     def input(self, pin):
         assert pin >= 0 and pin < self.num_gpios, "Pin number %s is invalid, only 0-%s are valid" % (pin, self.num_gpios)
         assert self.direction & (1 << pin) != 0, "Pin %s not set to input" % pin
-        if self.num_gpios <= 8:
-            value = self.i2c.readU8(MCP23008_GPIOA)
-        elif self.num_gpios > 8 and self.num_gpios <= 16:
-            value = self.i2c.readU8(MCP23017_GPIOA)
-            value |= self.i2c.readU8(MCP23017_GPIOB) << 8
-        return value & (1 << pin)
+        return self.input_all() & (1 << pin)
 
     def readU8(self):
-        result = self.i2c.readU8(MCP23008_OLATA)
-        return(result)
+        return self.outputvalue & 0xFF
 
     def readS8(self):
-        result = self.i2c.readU8(MCP23008_OLATA)
+        result = self.outputvalue & 0xFF
         if (result > 127): result -= 256
         return result
 
     def readU16(self):
         assert self.num_gpios >= 16, "16bits required"
-        lo = self.i2c.readU8(MCP23017_OLATA)
-        hi = self.i2c.readU8(MCP23017_OLATB)
-        return((hi << 8) | lo)
+        return self.outputvalue
 
     def readS16(self):
         assert self.num_gpios >= 16, "16bits required"
-        lo = self.i2c.readU8(MCP23017_OLATA)
-        hi = self.i2c.readU8(MCP23017_OLATB)
+        lo = self.outputvalue & 0xFF
+        hi = self.outputvalue >> 8
         if (hi > 127): hi -= 256
         return((hi << 8) | lo)
 
     def write8(self, value):
-        self.i2c.write8(MCP23008_OLATA, value)
+        self._checkbus()
+        # output latch of port A (OLATA of MCP23017 differs from MCP23008):
+        self._write(self._reg_olat[0], value & 0xFF)
+        # keep port B, so _changepin and flush do not undo this write:
+        self.outputvalue = (self.outputvalue & 0xFF00) | (value & 0xFF)
+        if self._reg_olat in self._chipvalues:
+            # port A in the chip is already written:
+            self._chipvalues[self._reg_olat] = \
+                (self._chipvalues[self._reg_olat] & 0xFF00) | (value & 0xFF)
 
     def write16(self, value):
         assert self.num_gpios >= 16, "16bits required"
-        self.i2c.write8(MCP23017_OLATA, value & 0xFF)
-        self.i2c.write8(MCP23017_OLATB, (value >> 8) & 0xFF)
+        self._checkbus()
+        # both output latches in one transaction:
+        self._writereg(self._reg_olat, value)
+        self.outputvalue = value & 0xFFFF
+        if self._reg_olat in self._chipvalues:
+            # the chip is already written:
+            self._chipvalues[self._reg_olat] = self.outputvalue
+
+
+class MCP230XX_I2CEmulator(object):
+    """ Emulated I2C bus with one MCP23017/MCP23008 chip for testing without
+    hardware. Implements methods of Adafruit_I2C used by Adafruit_MCP230XX and
+    counts bus transactions in .transactions. Next .failwrites writes fail
+    (return -1 as Adafruit_I2C on IOError) without changing registers.
+    """
+    def __init__(self, address=0x20):
+        self.address = address
+        self.transactions = 0
+        # register file, IODIR registers are all ones after reset:
+        self.regs = [0] * 0x16
+        self.regs[MCP23017_IODIRA] = 0xFF
+        self.regs[MCP23017_IODIRB] = 0xFF
+        # levels of input pins driven from outside, bit n is pin n:
+        self.pins = 0
+        self.failwrites = 0
+
+    def _failed(self):
+        # simulate error of a write transaction
+        if self.failwrites:
+            self.failwrites -= 1
+            return True
+        return False
+
+    def _gpio(self, reg):
+        # read of GPIO: inputs show pins, outputs show latches
+        if reg in (MCP23017_GPIOA, MCP23017_GPIOB):
+            port = reg - MCP23017_GPIOA
+            iodir = self.regs[MCP23017_IODIRA + port]
+            olat = self.regs[MCP23017_OLATA + port]
+            return ((self.pins >> (8 * port)) & iodir | olat & ~iodir) & 0xFF
+        return self.regs[reg]
+
+    def write8(self, reg, value):
+        self.transactions += 1
+        if self._failed():
+            return -1
+        if reg in (MCP23017_GPIOA, MCP23017_GPIOB):
+            # write to GPIO writes output latch:
+            reg = reg + MCP23017_OLATA - MCP23017_GPIOA
+        self.regs[reg] = value & 0xFF
+
+    def readU8(self, reg):
+        self.transactions += 1
+        return self._gpio(reg)
+
+    def write16(self, reg, value):
+        self.transactions += 1
+        if self._failed():
+            return -1
+        self.regs[reg] = value & 0xFF
+        self.regs[reg + 1] = (value >> 8) & 0xFF
+
+    def readU16(self, reg):
+        self.transactions += 1
+        return self._gpio(reg) | (self._gpio(reg + 1) << 8)
+
+    def writeList(self, reg, list):
+        self.transactions += 1
+        if self._failed():
+            return -1
+        for i in range(len(list)):
+            self.regs[reg + i] = list[i] & 0xFF
+
+    def readList(self, reg, length):
+        self.transactions += 1
+        return [self._gpio(reg + i) for i in range(length)]
 
 # RPi.GPIO compatible interface for MCP23017 and MCP23008
 
@@ -203,6 +364,27 @@ if __name__ == '__main__':
     ##   mcp.output(0, 0)  # Pin 0 Low
     ##   time.sleep(1);
 
+    if Adafruit_I2C is None:
+        # no bus available, count bus transactions of emulated chip for
+        # configuration of all pins and switching of all outputs off (the
+        # same as done by YawspiHW during initialization):
+        for deferred in (False, True):
+            bus = MCP230XX_I2CEmulator()
+            mcp = Adafruit_MCP230XX(address = 0x27, num_gpios = 16, i2c = bus)
+            if deferred:
+                mcp.defer()
+            for i in range(16):
+                mcp.config(i, 1)
+            for i in range(8):
+                mcp.config(i, 0)
+            for i in range(8):
+                mcp.output(i, 0)
+            if deferred:
+                mcp.flush()
+            print 'emulated bus transactions, deferred ' + str(deferred) + \
+                ': ' + str(bus.transactions)
+        exit(0)
+
     mcp = Adafruit_MCP230XX(address = 0x27, num_gpios = 16)  # MCP23017
     print 'all setting to input'
     for i in range(16):
@@ -0,0 +1,79 @@
+"""
+YawsPi cache of rendered history charts. Rendering of a chart reads data and
+generates svg, which is slow on Raspberry Pi, so rendered charts are kept in
+memory till data of the series change. Least recently used charts are removed
+when the cache is bigger than given number of bytes.
+"""
+
+# imports:
+import threading
+import hashlib
+from collections import OrderedDict
+
+# default maximal size of cached charts in bytes:
+MAXBYTES = 8 * 1024 * 1024
+
+
+def etag(key):  # return entity tag of a chart
+    """ Return entity tag (for http ETag header) of a chart.
+
+    \param key tuple of strings and numbers describing the chart
+    \return string
+    """
+    return hashlib.sha1(repr(key)).hexdigest()
+
+
+class ChartCache:
+    """ Cache of rendered charts with least recently used eviction.
+
+    Key of a chart is a tuple describing everything the chart depends on
+    (series, time range, last write position of the series etc.), so outdated
+    charts are never returned, only evicted when not used.
+    """
+    def __init__(self, maxbytes=MAXBYTES):
+        """ Initialize class.
+
+        \param maxbytes int, maximal size of all cached charts in bytes
+        \return Nothing
+        """
+        self.maxbytes = maxbytes
+        self._lock = threading.Lock()
+        self._charts = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key):  # return cached chart
+        """ Return cached chart and mark it as recently used.
+
+        \param key tuple describing the chart
+        \return string rendered chart, None if not in cache
+        """
+        with self._lock:
+            chart = self._charts.pop(key, None)
+            if chart is not None:
+                self._charts[key] = chart
+            return chart
+
+    def put(self, key, chart):  # add chart to cache
+        """ Add rendered chart to cache, remove least recently used charts if
+        cache is too big. Chart bigger than the whole cache is not stored.
+
+        \param key tuple describing the chart
+        \param chart string, rendered chart
+        \return Nothing
+        """
+        with self._lock:
+            if key in self._charts:
+                self._bytes -= len(self._charts.pop(key))
+            if len(chart) > self.maxbytes:
+                return
+            self._charts[key] = chart
+            self._bytes += len(chart)
+            while self._bytes > self.maxbytes:
+                self._bytes -= len(self._charts.popitem(last=False)[1])
+
+    def clear(self):  # remove all charts
+        with self._lock:
+            self._charts = OrderedDict()
+            self._bytes = 0
+
+# vim modeline: vim: shiftwidth=4 tabstop=4
@@ -0,0 +1,68 @@
+"""
+YawsPi command bus. Web thread posts commands for main loop into a queue and
+wakes the main loop at once, so commands are not delayed by waiting for next
+main loop iteration.
+"""
+
+# imports:
+import threading
+import Queue
+from time import time
+
+
+class CommandBus:
+    """ Thread safe queue of commands with wakeup event.
+
+    Every command is a dictionary:
+    1. Kind: string, type of command, e.g. break or run
+    2. Posted: float, time of posting of the command
+    3. any other keys given to post(), e.g. Index of station
+    """
+    def __init__(self):
+        """ Initialize class.
+
+        \param Nothing
+        \return Nothing
+        """
+        self._queue = Queue.Queue()
+        self._wakeup = threading.Event()
+        # latency of last taken command and maximal latency (s):
+        self.LastLatency = 0.0
+        self.MaxLatency = 0.0
+
+    def post(self, kind, **args):  # add command and wake up main loop
+        """ Add command to the queue and wake up waiting thread.
+
+        \param kind string, type of command
+        \param args other values of the command
+        \return Nothing
+        """
+        cmd = dict(args)
+        cmd['Kind'] = kind
+        cmd['Posted'] = time()
+        self._queue.put(cmd)
+        self._wakeup.set()
+
+    def wait(self, timeout):  # wait for commands
+        """ Wait till some command is posted or timeout elapsed and return all
+        posted commands.
+
+        \param timeout float, maximal time to wait in seconds
+        \return list of command dictionaries in order of posting
+        """
+        if timeout > 0:
+            self._wakeup.wait(timeout)
+        self._wakeup.clear()
+        cmds = []
+        while True:
+            try:
+                cmd = self._queue.get_nowait()
+            except Queue.Empty:
+                break
+            latency = time() - cmd['Posted']
+            self.LastLatency = latency
+            self.MaxLatency = max(self.MaxLatency, latency)
+            cmds.append(cmd)
+        return cmds
+
+# vim modeline: vim: shiftwidth=4 tabstop=4
@@ -0,0 +1,51 @@
+"""
+YawsPi downsampling of time series for charts. Reduces number of points to
+about the number of pixels of a chart, so the chart shows the same shape but
+is generated and transferred much faster.
+"""
+
+# imports:
+import numpy as np
+
+
+def lttb(t, v, count):  # Largest-Triangle-Three-Buckets downsampling
+    """ Return indexes of points selected by Largest-Triangle-Three-Buckets
+    algorithm. First and last points are always selected, other points are
+    split into count - 2 buckets and from every bucket the point forming the
+    largest triangle with point selected in previous bucket and average of
+    next bucket is selected.
+
+    \param t numpy array of times (x values), sorted
+    \param v numpy array of values (y values)
+    \param count int, number of points to select
+    \return numpy array of indexes of selected points, sorted
+    """
+    n = len(t)
+    if count >= n or count < 3:
+        return np.arange(n)
+    t = np.asarray(t, dtype=float)
+    v = np.asarray(v, dtype=float)
+    # bucket edges of points between first and last:
+    edges = (1 + np.arange(count - 1) * (n - 2) / float(count - 2)).astype(int)
+    edges[-1] = n - 1
+    selected = np.zeros(count, dtype=int)
+    a = 0
+    for i in range(count - 2):
+        start, end = edges[i], edges[i + 1]
+        # average of next bucket (last point for the last bucket):
+        if i < count - 3:
+            nstart, nend = edges[i + 1], edges[i + 2]
+            ct = t[nstart:nend].mean()
+            cv = v[nstart:nend].mean()
+        else:
+            ct = t[-1]
+            cv = v[-1]
+        # double area of triangles with previous selected point and average:
+        area = np.abs((t[a] - ct) * (v[start:end] - v[a]) -
+                      (t[a] - t[start:end]) * (cv - v[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    selected[-1] = n - 1
+    return selected
+
+# vim modeline: vim: shiftwidth=4 tabstop=4
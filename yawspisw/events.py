@@ -0,0 +1,233 @@
+"""
+YawsPi structured event log. Important events (fillings, starts of programs,
+errors) are appended as JSON lines into events file, so they can be queried
+by their fields. For fast queries, offsets of events are written also into
+index files: one for all events, one for every kind of event, every station
+and every program. Query reads only index of the most selective filter and
+then only matching lines of events file.
+
+Event is a dictionary:
+1. t: float, time in seconds since epoch
+2. kind: string, kind of event, e.g. fill, program, system
+3. sev: string, severity, one of SEVERITIES
+4. prg: int, index of program, None if event is not related to a program
+5. st: int or list of ints, index(es) of station(s), None if not related
+6. text: string, description for user (plain text)
+7. any other values given to add(), e.g. volume, reason
+"""
+
+# imports:
+import os
+import json
+import threading
+from time import time
+import numpy as np
+
+# severities of events from the lowest:
+SEVERITIES = ('info', 'warning', 'error')
+# name of events file:
+EVENTSFILE = 'events.jsonl'
+# suffix of index files:
+INDEXSUFFIX = '.idx'
+# index record: integer time and offset of event in events file:
+IDXDTYPE = np.dtype([('t', '<i8'), ('o', '<u8')])
+
+
+class EventLog:
+    """ Append-only log of events with offset indexes. """
+    def __init__(self, folder):
+        """ Initialize class.
+
+        \param folder string, directory of events file and index files
+        \return Nothing
+        """
+        self.folder = folder
+        self._lock = threading.Lock()
+        # indexes are checked against events file once after start:
+        self._checked = False
+
+    def add(self, kind, text, severity='info', program=None, station=None,
+            **values):  # append event
+        """ Append event to events file and to index files.
+
+        \param kind string, kind of event
+        \param text string, description for user
+        \param severity string, one of SEVERITIES
+        \param program int, index of program or None
+        \param station int or list of ints, index(es) of station(s) or None
+        \param values other values of event
+        \return dictionary of event
+        """
+        if severity not in SEVERITIES:
+            raise NameError('unknown severity of event: ' + str(severity))
+        event = dict(values)
+        event.update({
+            't': time(),
+            'kind': kind,
+            'sev': severity,
+            'prg': program,
+            'st': station,
+            'text': text,
+        })
+        line = json.dumps(event, sort_keys=True) + '\n'
+        with self._lock:
+            self._check()
+            path = self._path(EVENTSFILE)
+            offset = 0
+            if os.path.isfile(path):
+                offset = os.path.getsize(path)
+            with open(path, 'ab') as f:
+                f.write(line)
+            # index is written after event, so index is never ahead:
+            self._index(event, offset)
+        return event
+
+    def query(self, kind=None, station=None, program=None, tmin=None,
+              tmax=None, severity=None, where=None, limit=None):
+        """ Return events matching all given filters from the newest.
+
+        \param kind string, kind of events or None for all
+        \param station int, index of station or None for all
+        \param program int, index of program or None for all
+        \param tmin float, time in seconds since epoch, events from this time
+        or None for all
+        \param tmax float, time in seconds since epoch, events till this time
+        or None for all
+        \param severity string, minimal severity of events or None for all
+        \param where dictionary, values of events which must be equal, e.g.
+        {'reason': 'time'}, or None
+        \param limit int, maximal number of events or None for all
+        \return list of dictionaries of events
+        """
+        names = []
+        if kind is not None:
+            names.append('kind-' + kind)
+        if station is not None:
+            names.append('station-' + str(station))
+        if program is not None:
+            names.append('program-' + str(program))
+        with self._lock:
+            self._check()
+            # the smallest index is the most selective:
+            sizes = [(self._size(x + INDEXSUFFIX), x) for x in names]
+            name = min(sizes)[1] if sizes else 'all'
+            idx = self._read_index(name)
+        # index is small, select by time at once:
+        sel = np.ones(len(idx), dtype=bool)
+        if tmin is not None:
+            sel &= idx['t'] >= int(tmin)
+        if tmax is not None:
+            sel &= idx['t'] <= int(tmax)
+        res = []
+        path = self._path(EVENTSFILE)
+        if not os.path.isfile(path):
+            return res
+        with open(path, 'rb') as f:
+            for offset in idx['o'][sel][::-1]:
+                f.seek(int(offset))
+                event = json.loads(f.readline())
+                if not self._match(event, kind, station, program, tmin, tmax,
+                                   severity, where):
+                    continue
+                res.append(event)
+                if limit is not None and len(res) >= limit:
+                    break
+        return res
+
+    def _match(self, event, kind, station, program, tmin, tmax, severity,
+               where):  # check all filters
+        if kind is not None and event['kind'] != kind:
+            return False
+        if station is not None and station != event['st'] and \
+                not (isinstance(event['st'], list) and station in event['st']):
+            return False
+        if program is not None and event['prg'] != program:
+            return False
+        if tmin is not None and event['t'] < tmin:
+            return False
+        if tmax is not None and event['t'] > tmax:
+            return False
+        if severity is not None and \
+                SEVERITIES.index(event['sev']) < SEVERITIES.index(severity):
+            return False
+        for k, v in (where or {}).items():
+            if event.get(k) != v:
+                return False
+        return True
+
+    def _path(self, name):  # return path of file in folder
+        return os.path.join(self.folder, name)
+
+    def _size(self, name):  # return size of file, 0 if missing
+        path = self._path(name)
+        if os.path.isfile(path):
+            return os.path.getsize(path)
+        return 0
+
+    def _read_index(self, name):  # return records of index file
+        path = self._path(name + INDEXSUFFIX)
+        if not os.path.isfile(path):
+            return np.zeros(0, dtype=IDXDTYPE)
+        count = os.path.getsize(path) // IDXDTYPE.itemsize
+        return np.fromfile(path, dtype=IDXDTYPE, count=count)
+
+    def _index(self, event, offset):  # add event to index files
+        names = ['kind-' + event['kind']]
+        st = event['st']
+        if st is not None:
+            if not isinstance(st, list):
+                st = [st]
+            names.extend(['station-' + str(x) for x in st])
+        if event['prg'] is not None:
+            names.append('program-' + str(event['prg']))
+        # index of all events is written last, _check repairs indexes of
+        # events after the last one in it, so all indexes get repaired:
+        names.append('all')
+        record = np.array([(int(event['t']), offset)], dtype=IDXDTYPE)
+        for name in names:
+            tmp = self._read_last(name)
+            # event can be already indexed (index was repaired):
+            if tmp is None or tmp < offset:
+                with open(self._path(name + INDEXSUFFIX), 'ab') as f:
+                    f.write(record.tobytes())
+
+    def _read_last(self, name):  # return last offset in index, None if empty
+        path = self._path(name + INDEXSUFFIX)
+        size = self._size(name + INDEXSUFFIX)
+        if size < IDXDTYPE.itemsize:
+            return None
+        with open(path, 'rb') as f:
+            f.seek((size // IDXDTYPE.itemsize - 1) * IDXDTYPE.itemsize)
+            return int(np.frombuffer(f.read(IDXDTYPE.itemsize),
+                                     dtype=IDXDTYPE)['o'][0])
+
+    def _check(self):  # repair indexes after interrupted write
+        if self._checked:
+            return
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+        path = self._path(EVENTSFILE)
+        if os.path.isfile(path):
+            last = self._read_last('all')
+            with open(path, 'rb+') as f:
+                if last is not None:
+                    # skip the last indexed event:
+                    f.seek(last)
+                    f.readline()
+                while True:
+                    offset = f.tell()
+                    line = f.readline()
+                    if not line:
+                        break
+                    try:
+                        if not line.endswith('\n'):
+                            raise ValueError('incomplete line')
+                        event = json.loads(line)
+                    except ValueError:
+                        # interrupted write of the last event:
+                        f.truncate(offset)
+                        break
+                    self._index(event, offset)
+        self._checked = True
+
+# vim modeline: vim: shiftwidth=4 tabstop=4
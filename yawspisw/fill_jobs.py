@@ -0,0 +1,170 @@
+"""
+YawsPi filling jobs executor. Runs fillings of stations one after another in
+a separate thread, so main loop is not blocked while water flows.
+"""
+
+# imports:
+import threading
+import Queue
+from time import time
+
+# number of finished jobs kept for web page:
+KEEPFINISHED = 10
+
+
+class FillExecutor:
+    """ Queue of filling jobs executed by a worker thread.
+
+    Every job is a dictionary:
+    1. Id: integer, job identification
+    2. Name: string, description for user
+    3. Status: string, one of queued, running, done, cancelled, timeout, error
+    4. Expected: float, expected duration of the job in seconds
+    5. Timeout: float, hard limit of duration of the job in seconds
+    6. Submitted, Start, End: float, times of submission, start and end
+    7. Cancel: threading.Event, set if job should stop as soon as possible
+    8. Error: string, description of error if job failed
+    """
+    def __init__(self):
+        """ Initialize class and start worker thread.
+
+        \param Nothing
+        \return Nothing
+        """
+        self._queue = Queue.Queue()
+        self._lock = threading.Lock()
+        self._lastid = 0
+        # all jobs by id:
+        self.jobs = {}
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, name, target, expected, timeout):  # add job to queue
+        """ Add a job to the queue.
+
+        \param name string, description of the job
+        \param target function called with job dictionary as parameter, it
+        should end soon after job['Cancel'] event is set
+        \param expected float, expected duration of the job in seconds
+        \param timeout float, after timeout seconds of run job is cancelled
+        \return integer id of the job
+        """
+        with self._lock:
+            self._lastid += 1
+            job = {
+                'Id': self._lastid,
+                'Name': name,
+                'Status': 'queued',
+                'Expected': expected,
+                'Timeout': timeout,
+                'Submitted': time(),
+                'Start': None,
+                'End': None,
+                'Cancel': threading.Event(),
+                'Error': '',
+                'Target': target,
+            }
+            self.jobs[job['Id']] = job
+        self._queue.put(job)
+        return job['Id']
+
+    def cancel(self, jobid=None):  # cancel job(s)
+        """ Cancel a queued or running job.
+
+        \param jobid integer id of job, if None all jobs are cancelled
+        \return Nothing
+        """
+        with self._lock:
+            for job in self.jobs.values():
+                if jobid is None or job['Id'] == jobid:
+                    job['Cancel'].set()
+
+    def pending(self, name):  # is job with the name queued or running?
+        """ Return True if job with the name is queued or running.
+
+        \param name string, description of the job
+        \return bool
+        """
+        return name in [x['Name'] for x in self.active()]
+
+    def active(self):  # return queued and running jobs
+        """ Return list of queued and running jobs sorted by id.
+
+        \param Nothing
+        \return list of job dictionaries
+        """
+        with self._lock:
+            tmp = [x for x in self.jobs.values()
+                   if x['Status'] in ('queued', 'running')]
+        return sorted(tmp, key=lambda x: x['Id'])
+
+    def busy(self):  # is any job queued or running?
+        return len(self.active()) > 0
+
+    def progress(self, jobid):  # return progress of a job
+        """ Return progress of a job estimated from expected duration.
+
+        \param jobid integer id of job
+        \return float progress in range 0 - 1
+        """
+        job = self.jobs[jobid]
+        if job['Status'] == 'queued':
+            return 0.0
+        if job['Status'] != 'running':
+            return 1.0
+        if job['Expected'] <= 0:
+            return 0.0
+        return min(1.0, (time() - job['Start']) / job['Expected'])
+
+    def stop(self, timeout=None):  # cancel all jobs and wait for worker
+        """ Cancel all jobs and wait till running job ends.
+
+        \param timeout float, maximal time to wait in seconds
+        \return Nothing
+        """
+        self.cancel()
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _expire(self, job):  # called by timer if job runs too long
+        if job['Status'] == 'running':
+            job['Status'] = 'timeout'
+            job['Cancel'].set()
+
+    def _run(self):  # worker thread
+        while True:
+            job = self._queue.get()
+            if job is None:
+                # stop() was called:
+                return
+            if job['Cancel'].is_set():
+                job['Status'] = 'cancelled'
+            else:
+                job['Status'] = 'running'
+                job['Start'] = time()
+                timer = threading.Timer(job['Timeout'], self._expire, (job,))
+                timer.daemon = True
+                timer.start()
+                try:
+                    job['Target'](job)
+                    if job['Status'] == 'running':
+                        if job['Cancel'].is_set():
+                            job['Status'] = 'cancelled'
+                        else:
+                            job['Status'] = 'done'
+                except Exception, err:
+                    job['Status'] = 'error'
+                    job['Error'] = str(err)
+                timer.cancel()
+            job['End'] = time()
+            self._prune()
+
+    def _prune(self):  # forget old finished jobs
+        with self._lock:
+            done = sorted([x['Id'] for x in self.jobs.values()
+                           if x['Status'] not in ('queued', 'running')])
+            for jobid in done[:-KEEPFINISHED]:
+                del self.jobs[jobid]
+
+# vim modeline: vim: shiftwidth=4 tabstop=4
@@ -0,0 +1,123 @@
+"""
+YawsPi forecast of water demand. From expanded timeline of calendar programs
+estimates liters drawn from source per day, time when the source gets empty
+and waterings delayed because other program still uses the pump.
+
+Timeline is expanded again only if programs, water demands or day changed,
+otherwise only current water in the source is taken into account, so forecast
+can be updated after every measuring of sensors.
+"""
+
+# imports:
+import hashlib
+import pickle
+import numpy as np
+import prg_occurrences
+from plan_cache import plan_key
+
+# maximal number of reported overlaps:
+MAXOVERLAPS = 10
+
+
+class WaterForecast:
+    """ Forecast of water demand of calendar programs.
+
+    Result of forecast (attribute Result) is a dictionary:
+    1. Daily: list of tuples (int, float), wall time of day start and liters
+    drawn from the source during the day
+    2. Total: float, liters drawn from now till end of horizon
+    3. Empty: int, epoch time when the source gets empty, None if the source
+    is not empty during horizon or is unlimited
+    4. Overlaps: list of tuples (int, int, float), epoch time of watering,
+    index of program and delay of watering in seconds because pump is used by
+    previous waterings
+    5. OverlapsNo: int, number of all delayed waterings from now
+    """
+    def __init__(self):
+        """ Initialize class.
+
+        \param Nothing
+        \return Nothing
+        """
+        self._key = None
+        # epoch times, program indexes, liters and durations of waterings:
+        self._times = np.zeros(0, dtype=np.int64)
+        self._indexes = np.zeros(0, dtype=int)
+        self._volumes = np.zeros(0)
+        self._delays = np.zeros(0)
+        self._daily = []
+        self.Result = {
+            'Daily': [],
+            'Total': 0.0,
+            'Empty': None,
+            'Overlaps': [],
+            'OverlapsNo': 0,
+        }
+
+    def update(self, prgs, demands, now, days, sovolume):  # update forecast
+        """ Update forecast, expand timeline again only if needed.
+
+        \param prgs list of dictionaries of programs
+        \param demands list of tuples (float, float), liters and seconds
+        needed by one watering of every program
+        \param now arrow, current time
+        \param days int, horizon of the forecast in days
+        \param sovolume float, liters in the source, -1 if unlimited
+        \return dictionary Result
+        """
+        daystart = now.floor('day')
+        key = hashlib.sha1(pickle.dumps((
+            [plan_key(x) for x in prgs], demands, daystart.isoformat(), days
+        ))).hexdigest()
+        if key != self._key:
+            self._expand(prgs, demands, daystart, days)
+            self._key = key
+        # waterings still in future:
+        first = np.searchsorted(self._times, now.timestamp)
+        volumes = self._volumes[first:]
+        empty = None
+        if sovolume >= 0 and len(volumes):
+            drawn = np.cumsum(volumes)
+            tmp = np.searchsorted(drawn, sovolume, side='right')
+            if tmp < len(drawn):
+                empty = int(self._times[first + tmp])
+        delayed = first + np.nonzero(self._delays[first:] > 0)[0]
+        self.Result = {
+            'Daily': self._daily,
+            'Total': float(np.sum(volumes)),
+            'Empty': empty,
+            'Overlaps': [(int(self._times[i]), int(self._indexes[i]),
+                          float(self._delays[i]))
+                         for i in delayed[:MAXOVERLAPS]],
+            'OverlapsNo': len(delayed),
+        }
+        return self.Result
+
+    def _expand(self, prgs, demands, daystart, days):  # expand timeline
+        start = prg_occurrences.to_wall(daystart.naive)
+        end = start + days * prg_occurrences.DAY
+        wall, indexes = prg_occurrences.timeline(prgs, start, end)
+        times = prg_occurrences.to_epoch(wall, daystart.tzinfo)
+        # order can change during daylight saving time change:
+        order = np.argsort(times, kind='mergesort')
+        wall = wall[order]
+        times = times[order]
+        indexes = indexes[order]
+        volumes = np.array([x[0] for x in demands] + [0.0])[indexes]
+        durations = np.array([x[1] for x in demands] + [0.0])[indexes]
+        # liters per day:
+        tmp = np.bincount((wall - start) // prg_occurrences.DAY,
+                          weights=volumes, minlength=days)
+        self._daily = [(start + i * prg_occurrences.DAY, float(tmp[i]))
+                       for i in range(days)]
+        # pump serializes waterings, watering ends at:
+        # end[i] = max(times[i], end[i - 1]) + durations[i], that is
+        # end[i] = cum[i] + max(times[j] - cum[j - 1]) for j <= i:
+        cum = np.cumsum(durations)
+        ends = cum + np.maximum.accumulate(times - (cum - durations))
+        self._delays = ends - durations - times
+        self._times = times
+        self._indexes = indexes
+        self._volumes = volumes
+
+# vim modeline: vim: shiftwidth=4 tabstop=4
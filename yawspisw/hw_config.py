@@ -60,6 +60,11 @@ def hw_config():
     # (offset, rate1)
     # (offset, rate1, rate2)
     # SettleT is time source needs to stop the water flow after switching off
+    # MaxParallel is maximal number of stations filled at once (valves opened
+    # at the same time), if not present, stations are filled one by one
+    # FlowSplit are factors of total flow rate of the source if 1, 2, 3 ...
+    # valves are opened, total flow is split equally between opened valves. If
+    # not present, total flow rate does not depend on number of opened valves
     # 'FlowRate': (0.047501, 0.027133),
     # 'FlowRateRev': (-1.7126, 36.7918),
     # 'FLowRate': (6.0297e-03, 3.2421e-02, -1.2655e-04),
@@ -70,6 +75,8 @@ def hw_config():
         'FlowRate': (6.0297e-03, 3.2421e-02, -1.2655e-04),
         'FlowRateRev': (0.061503, 29.188514, 6.336059),
         'SettleT': 0.1,
+        'MaxParallel': 1,
+        'FlowSplit': (1,),
     }
 
     # ------------------- Stations:
@@ -45,11 +45,18 @@ def hw_config():
     # equation: volume = offset + rate * time
     # (offset, rate)
     # SettleT is time source needs to stop the water flow after switching off
+    # MaxParallel is maximal number of stations filled at once (valves opened
+    # at the same time), if not present, stations are filled one by one
+    # FlowSplit are factors of total flow rate of the source if 1, 2, 3 ...
+    # valves are opened, total flow is split equally between opened valves. If
+    # not present, total flow rate does not depend on number of opened valves
     tmp['So'] = {
         'Cap': 10,
         'Pin': (1, 7),
         'FlowRate': (0, 1),
         'SettleT': 0.1,
+        'MaxParallel': 1,
+        'FlowSplit': (1,),
     }
 
     # ------------------- Stations:
@@ -9,6 +9,8 @@ For variables which can be accessed outside this class: see _init_vars()
 # timing for filling
 from time import sleep
 from time import time
+from contextlib import contextmanager
+import threading
 import arrow
 # hw configuration:
 # AND in check_gpio is import RPi.GPIO
@@ -78,6 +80,23 @@ class YawspiHW:
         self.SoStatus = 0
         # installed ambient sensors:
         self.Sensors = []
+        # port expanders (filled in _init_hw if running with hardware):
+        self.pe = []
+        # time in seconds of last reading of ambient sensors:
+        self.SeLatency = {}
+        # locks of buses shared by ambient sensors read in separate threads:
+        # i2c bus with pressure and illuminance sensor:
+        self.i2clock = threading.Lock()
+        # ad converters (bit banged SPI on shared GPIO pins):
+        self.adclock = threading.Lock()
+        # threads reading ambient sensors, by sensor name:
+        self._se_workers = {}
+        # lock of port expanders, filling and main thread use them:
+        self.pelock = threading.RLock()
+        # water level sensors kept switched on by filling:
+        self.SeWLHeld = []
+        # result of last filling of a station, see st_fill:
+        self.LastFill = {}
 
     def _check_config(self):  # checks hw config
         """ Checks hardware configuration loaded from configuration file.
@@ -284,7 +303,6 @@ class YawspiHW:
             # import port expanders and ad converters libraries:
             # port expanders:
             from Adafruit_MCP230XX import Adafruit_MCP230XX
-            self.pe = []
             for id in self.hwc['PeAddresses']:
                 self.pe.append(Adafruit_MCP230XX(address=id, num_gpios=16))
             # ad converter:
@@ -294,22 +312,56 @@ class YawspiHW:
             for id in self.hwc['AdcPins']:
                 self.adc.append(MCP3008(id[0], id[1], id[2], id[3]))
 
-            # setup port expanders:
-            # first set all as inputs
-            for p in range(1, len(self.pe) + 1):
-                for n in range(16):
-                    self._pin_config((p, n), 1)
-            # set water source port as output:
-            self._pin_config(self.hwc['So']['Pin'], 0)
-            # set valve ports as output:
-            for x in self.hwc['St']:
-                self._pin_config(x['Pin'], 0)
-            # set pins on 'grad' sensors to output:
-            for x in self.hwc['SeWL']:
-                if x['Type'] == 'grad':
-                    self._pin_config(x['OnOffPin'], 0)
-            # and switch all off:
-            self.so_switch(0)                   # switch off pump
+            # setup port expanders, all in one write per register:
+            with self.pe_transaction():
+                # first set all as inputs
+                for p in range(1, len(self.pe) + 1):
+                    for n in range(16):
+                        self._pin_config((p, n), 1)
+                # set water source port as output:
+                self._pin_config(self.hwc['So']['Pin'], 0)
+                # set valve ports as output:
+                for x in self.hwc['St']:
+                    self._pin_config(x['Pin'], 0)
+                # set pins on 'grad' sensors to output:
+                for x in self.hwc['SeWL']:
+                    if x['Type'] == 'grad':
+                        self._pin_config(x['OnOffPin'], 0)
+                # and switch all off:
+                self.all_off()
+
+    @contextmanager
+    def pe_transaction(self):  # collect pin changes on port expanders
+        """ Context manager collecting pin changes on all port expanders.
+
+        Changes of direction, pullups and outputs made by _pin_config,
+        _pin_pullup and _pin_set inside the with block are written at the end
+        of the block, one write per register of a port expander. Can be
+        nested. Other threads cannot access port expanders meanwhile.
+
+        \param Nothing
+        \return Nothing
+        """
+        with self.pelock:
+            for p in self.pe:
+                p.defer()
+            try:
+                yield
+            finally:
+                for p in self.pe:
+                    p.flush()
+
+    def all_off(self):  # switch off source, valves and sensors
+        """ Switch off water source first, then all station valves and all
+        water level sensors in one port expanders transaction.
+
+        \param Nothing
+        \return Nothing
+        """
+        # pump is stopped before valves close, port expanders of valves can
+        # be written sooner than port expander of source in a transaction:
+        self.so_switch(0)                   # switch off pump
+        with self.pe_transaction():
             for x in range(len(self.hwc['St'])):  # switch off valves
                 self.st_switch(x, 0)
             for x in range(len(self.hwc['SeWL'])):  # switch off all sensors
@@ -334,7 +386,8 @@ class YawspiHW:
                 tmp = self.pe[pin[0] - 1].INPUT
             else:
                 tmp = self.pe[pin[0] - 1].OUTPUT
-            self.pe[pin[0] - 1].config(pin[1], tmp)
+            with self.pelock:
+                self.pe[pin[0] - 1].config(pin[1], tmp)
         else:
             # ad converters: no action:
             pass
@@ -352,10 +405,11 @@ class YawspiHW:
             pass
         elif pin[0] > 0:
             # port expanders:
-            if value:
-                self.pe[pin[0] - 1].pullup(pin[1], 1)
-            else:
-                self.pe[pin[0] - 1].pullup(pin[1], 0)
+            with self.pelock:
+                if value:
+                    self.pe[pin[0] - 1].pullup(pin[1], 1)
+                else:
+                    self.pe[pin[0] - 1].pullup(pin[1], 0)
         else:
             # ad converters: no action:
             pass
@@ -374,15 +428,18 @@ class YawspiHW:
             pass
         elif pin[0] > 0:
             # port expanders:
-            self.pe[pin[0] - 1].output(pin[1],  value)
+            with self.pelock:
+                self.pe[pin[0] - 1].output(pin[1],  value)
         else:
             # ad converters: no action:
             pass
 
-    def _pin_get(self, pin):  # returns value of a pin
+    def _pin_get(self, pin, snapshot=None):  # returns value of a pin
         """ Get value of an input pin.
 
         \param pin pin tuple to get value of.
+        \param snapshot list of port expanders input bitmaps returned by
+        _pe_snapshot, if None, port expander is read.
         \return Nothing
         \todo{get value of gpio pin}
         """
@@ -392,10 +449,24 @@ class YawspiHW:
             pass
         elif pin[0] > 0:
             # port expanders:
-            return self.pe[pin[0] - 1].input(pin[1])
+            if snapshot is None:
+                with self.pelock:
+                    return self.pe[pin[0] - 1].input(pin[1])
+            return snapshot[pin[0] - 1] & (1 << pin[1])
         else:
             # ad converters:
-            return self.adc[-1 * pin[0] - 1].readadcv(pin[1], 5) / 5
+            with self.adclock:
+                return self.adc[-1 * pin[0] - 1].readadcv(pin[1], 5) / 5
+
+    def _pe_snapshot(self):  # read inputs of all port expanders
+        """ Read inputs of all port expanders, one bulk read per port
+        expander.
+
+        \param Nothing
+        \return list of integers, bitmaps of pin levels of port expanders
+        """
+        with self.pelock:
+            return [p.input_all() for p in self.pe]
 
     def _se_switch(self, index, value):  # switch sensor on or off
         """ Switch power of water level sensor on or off
@@ -436,14 +507,15 @@ class YawspiHW:
                 # set pullup for both pins:
                 pin1 = self.hwc['SeWL'][index]['MinPin']
                 pin2 = self.hwc['SeWL'][index]['MaxPin']
-                if value:
-                    self.SeWLStatus[index] = 1
-                    self._pin_pullup(pin1, 1)
-                    self._pin_pullup(pin2, 1)
-                else:
-                    self.SeWLStatus[index] = 0
-                    self._pin_pullup(pin1, 0)
-                    self._pin_pullup(pin2, 0)
+                with self.pe_transaction():
+                    if value:
+                        self.SeWLStatus[index] = 1
+                        self._pin_pullup(pin1, 1)
+                        self._pin_pullup(pin2, 1)
+                    else:
+                        self.SeWLStatus[index] = 0
+                        self._pin_pullup(pin1, 0)
+                        self._pin_pullup(pin2, 0)
             elif self.hwc['SeWL'][index]['Type'] == 'grad':
                 if value:
                     self._pin_set(self.hwc['SeWL'][index]['OnOffPin'], 1)
@@ -566,58 +638,135 @@ class YawspiHW:
         if index < 0 or index > len(self.hwc['SeWL']) - 1:
             raise NameError('incorrect sensor index: ' + str(index))
         if self.WithHW:
-            # first switch sensor on:
-            self._se_switch(index, 1)
+            # port expanders are locked only while sensors are switched or
+            # read, filling samples its sensors during settling:
+            with self.pelock:
+                if index in self.SeWLHeld:
+                    # sensor is kept switched on by filling, just read it:
+                    return self._se_read(index)
+                # first switch sensor on:
+                self._se_switch(index, 1)
             # let voltages stabilize:
             sleep(0.1)
-            # second get sensor value
-            if self.hwc['SeWL'][index]['Type'] == 'none':
-                # if no sensor consider station always empty:
-                val = 0
-            elif self.hwc['SeWL'][index]['Type'] == 'min':
-                val = self._pin_get(self.hwc['SeWL'][index]['Pin'])
-                if val:  # because PE driver returns various values
-                    val = 0.5
-                else:
-                    val = 0
-            elif self.hwc['SeWL'][index]['Type'] == 'max':
-                val = self._pin_get(self.hwc['SeWL'][index]['Pin'])
-                if val:  # because PE driver returns various values
-                    val = 1
-                else:
-                    val = 0.5
-            elif self.hwc['SeWL'][index]['Type'] == 'minmax':
-                #read both sensors
-                x = self._pin_get(self.hwc['SeWL'][index]['MinPin'])
-                y = self._pin_get(self.hwc['SeWL'][index]['MaxPin'])
-                # decide station status:
-                if x != 0:     # because PE driver returns various values
-                    # min sensor is switched, station is empty
-                    val = 0
-                elif y == 0:  # because PE driver returns various values
-                    # max sensor is switched, station is full
-                    val = 1
-                else:
-                    # else station is half empty
-                    val = 0.5
-            elif self.hwc['SeWL'][index]['Type'] == 'grad':
+            if self.hwc['SeWL'][index]['Type'] == 'grad':
                 sleep(0.1)
-                # first reading throw away, than read three times and return
-                # average:
-                val = self._pin_get(self.hwc['SeWL'][index]['ValuePin'])
-                val = self._pin_get(self.hwc['SeWL'][index]['ValuePin'])
-                val = val + self._pin_get(self.hwc['SeWL'][index]['ValuePin'])
-                val = val + self._pin_get(self.hwc['SeWL'][index]['ValuePin'])
-                val = val / 3
-            else:
-                raise NameError('unknown Water Level Sensor Type!')
-            # third switch sensor off:
-            self._se_switch(index, 0)
+            with self.pelock:
+                if not self.SeWLStatus[index]:
+                    # switched off by filling meanwhile, measure again:
+                    return self.se_level(index)
+                # second get sensor value
+                val = self._se_read(index)
+                # third switch sensor off, if not taken by filling meanwhile:
+                if index not in self.SeWLHeld:
+                    self._se_switch(index, 0)
             # fourth return value:
             return val
         else:
             return 0.05
 
+    def se_level_all(self):  # returns water levels of all sensors
+        """ Return water levels indicated by all sensors
+
+        Switch power of all sensors on at once, wait one settle time, get
+        values of all sensors from one snapshot of port expanders, switch all
+        sensors off and return floats in the range from 0 (empty) to 1 (full).
+        Sensors kept switched on by filling are only read. Port expanders are
+        not locked during settle time, so filling can take or release sensors
+        meanwhile: sensors taken by filling are left switched on, sensors
+        switched off by filling are measured again. Last value is water level
+        of water source (the same as returned by so_level).
+        \param Nothing
+        \return list of floats water levels in range 0 - 1
+        """
+        n = len(self.hwc['SeWL'])
+        if self.WithHW:
+            with self.pelock:
+                # sensors not used by filling:
+                free = [i for i in range(n) if i not in self.SeWLHeld]
+                # first switch all sensors on:
+                with self.pe_transaction():
+                    for i in free:
+                        self._se_switch(i, 1)
+            # let voltages stabilize, filling samples its sensors meanwhile:
+            sleep(0.1)
+            if 'grad' in [x['Type'] for x in self.hwc['SeWL']]:
+                sleep(0.1)
+            with self.pelock:
+                # second get all sensors values:
+                snapshot = self._pe_snapshot()
+                val = [self._se_read(i, snapshot) for i in range(n)]
+                # sensors switched off by filling meanwhile:
+                again = [i for i in range(n) if not self.SeWLStatus[i]]
+                # third switch all sensors off, except taken by filling:
+                with self.pe_transaction():
+                    for i in free:
+                        if i not in self.SeWLHeld:
+                            self._se_switch(i, 0)
+            for i in again:
+                val[i] = self.se_level(i)
+        else:
+            val = [0.05] * n
+        # barrel sensor is the last one:
+        if self.hwc['So']['Cap'] == -1:
+            val[-1] = 1
+        return val
+
+    def _se_read(self, index, snapshot=None, fast=False):  # value of sensor
+        """ Return water level indicated by a sensor already switched on
+
+        \param index integer, index of a sensor
+        \param snapshot list of port expanders input bitmaps returned by
+        _pe_snapshot, if None, port expanders are read once.
+        \param fast if True, analog sensor is read only once instead of
+        averaging
+        \return float water level in range 0 - 1
+        """
+        sensor = self.hwc['SeWL'][index]
+        if snapshot is None and sensor['Type'] in ('min', 'max', 'minmax'):
+            snapshot = self._pe_snapshot()
+        if sensor['Type'] == 'none':
+            # if no sensor consider station always empty:
+            val = 0
+        elif sensor['Type'] == 'min':
+            val = self._pin_get(sensor['Pin'], snapshot)
+            if val:  # because PE driver returns various values
+                val = 0.5
+            else:
+                val = 0
+        elif sensor['Type'] == 'max':
+            val = self._pin_get(sensor['Pin'], snapshot)
+            if val:  # because PE driver returns various values
+                val = 1
+            else:
+                val = 0.5
+        elif sensor['Type'] == 'minmax':
+            #read both sensors
+            x = self._pin_get(sensor['MinPin'], snapshot)
+            y = self._pin_get(sensor['MaxPin'], snapshot)
+            # decide station status:
+            if x != 0:     # because PE driver returns various values
+                # min sensor is switched, station is empty
+                val = 0
+            elif y == 0:  # because PE driver returns various values
+                # max sensor is switched, station is full
+                val = 1
+            else:
+                # else station is half empty
+                val = 0.5
+        elif sensor['Type'] == 'grad' and fast:
+            val = self._pin_get(sensor['ValuePin'])
+        elif sensor['Type'] == 'grad':
+            # first reading throw away, than read three times and return
+            # average:
+            val = self._pin_get(sensor['ValuePin'])
+            val = self._pin_get(sensor['ValuePin'])
+            val = val + self._pin_get(sensor['ValuePin'])
+            val = val + self._pin_get(sensor['ValuePin'])
+            val = val / 3
+        else:
+            raise NameError('unknown Water Level Sensor Type!')
+        return val
+
     def se_description(self, index):  # return sensor description
         """ Return sensor description according hardware configuration
 
@@ -676,19 +825,32 @@ class YawspiHW:
         R2 = self.hwc['So']['FlowRate'][2]  # rate2
         return O + R1 * filltime + R2 * filltime * filltime
 
-    def st_fill(self, index, upthreshold):  # fill water into one station
+    def st_fill(self, index, upthreshold, period=0.02, soperiod=1,
+                cancel=None):  # fill water into one station
         """ Fill water into the station.
 
-        1. starts water pump
-        2. checks water level by sensor reaches upper threshold or bcalculated
-        filling time occurs. if actual filling time is by 10% greater than
-        calculated, filling stops independently on water level.
-        3. stops water pump
+        1. switches sensors of station and source on for the whole filling
+        2. starts water pump
+        3. every period seconds checks water level by sensor reaches upper
+        threshold, every soperiod seconds checks water source is not empty, or
+        calculated filling time occurs. if actual filling time is by 10%
+        greater than calculated, filling stops independently on water level.
+        4. stops water pump and switches sensors off
+
+        Filling stops also if cancel event is set. Result is stored in
+        .LastFill dictionary: Index of station, FillTime, Reason of stop
+        ('full', 'source empty', 'time', 'cancelled') and Latency - time from
+        last sample not showing full station to stop of the pump.
 
         \param index index of station to fill
         \param upthreshold float, upper threshold 0 - 1
+        \param period float, sampling period of station sensor in seconds
+        \param soperiod float, sampling period of source sensor in seconds
+        \param cancel threading.Event, if set, filling stops
         \return float filling time in seconds
         """
+        if cancel is None:
+            cancel = threading.Event()
         if self.WithHW:
             # index is index of station, upthreshold is value if reached,
             # station is considered filled.
@@ -696,42 +858,252 @@ class YawspiHW:
             filltime = self.fill_time(index)
             # type of sensor
             sensortype = self.hwc['SeWL'][index]['Type']
+            # source sensor is the last one, checked only if it can say
+            # anything:
+            soindex = len(self.hwc['SeWL']) - 1
+            socheck = self.hwc['So']['Cap'] != -1 and \
+                self.hwc['SeWL'][soindex]['Type'] != 'none'
             stsettlet = self.hwc['St'][index]['SettleT']
             sosettlet = self.hwc['So']['SettleT']
+            # switch sensors on and keep them powered during filling, held
+            # sensors are changed only with port expanders locked:
+            with self.pe_transaction():
+                self.SeWLHeld = [index, soindex]
+                self._se_switch(index, 1)
+                self._se_switch(soindex, 1)
             self.st_switch(index, 1)  # switch valve on
-            sleep(stsettlet)  # wait to valve settle
+            # wait to valve settle and sensors voltages stabilize:
+            sleep(max(stsettlet, 0.2))
             self.so_switch(1)  # set pump on
             tmp = time()
+            reason = 'time'
+            # time of last sample not showing full station:
+            last = tmp
             if (sensortype == 'none') | (sensortype == 'min'):
                 # if no sensor, or sensor detects only bottom of station, just
                 # wait filltime:
-                sleep(filltime)
+                if cancel.wait(filltime):
+                    reason = 'cancelled'
             else:
                 # if sensor, wait for sensor showing full or if time is 1.1
                 # times greater than filltime
-                endtime = time() + filltime * 1.1
+                endtime = tmp + filltime * 1.1
+                sotime = tmp
                 while time() < endtime:
-                    # periodically detect wl of station:
-                    if self.se_level(index) > upthreshold:
+                    now = time()
+                    # detect wl of station:
+                    if self._se_read(index, fast=True) > upthreshold:
+                        reason = 'full'
                         break
-                    # periodically detect wl of source:
-                    if self.so_level == 0:
+                    # detect wl of source with its own period:
+                    if socheck and now >= sotime:
+                        if self._se_read(soindex, fast=True) == 0:
+                            reason = 'source empty'
+                            break
+                        sotime = now + soperiod
+                    last = now
+                    if cancel.wait(period):
+                        reason = 'cancelled'
                         break
-                    else:
-                        # check sensor every 0.05 second:
-                        # XXX wait time could be changed?
-                        sleep(0.05)
             self.so_switch(0)            # set pump off
-            realfilltime = time() - tmp
+            offtime = time()
+            realfilltime = offtime - tmp
+            with self.pe_transaction():
+                self._se_switch(index, 0)
+                self._se_switch(soindex, 0)
+                self.SeWLHeld = []
             sleep(sosettlet)                # wait to stop the water flow
             self.st_switch(index, 0)        # switch valve off
             sleep(stsettlet)                # wait to valve settle
-            return realfilltime
+            latency = 0
+            if reason == 'full':
+                latency = offtime - last
         else:
             # if no hardware, return ideal filling time:
-            t = self.fill_time(index)
-            sleep(t)
-            return t
+            tmp = time()
+            reason = 'time'
+            if cancel.wait(self.fill_time(index)):
+                reason = 'cancelled'
+            realfilltime = time() - tmp
+            latency = 0
+        self.LastFill = {
+            'Index': index,
+            'FillTime': realfilltime,
+            'Reason': reason,
+            'Latency': latency,
+        }
+        return realfilltime
+
+    def flow_rate(self, pumptime, nopen):  # return flow rate into a station
+        """ Return flow rate into one of opened stations
+
+        Flow rate of the source is derivative of the filled volume calculated
+        by filled_volume. If more valves are open, flow rate of the source is
+        multiplied by a factor in FlowSplit of the source (by default 1) and
+        split equally between open valves.
+        \param pumptime float time from start of the pump in seconds
+        \param nopen int number of open valves
+        \return float flow rate in liters per second
+        """
+        R1 = self.hwc['So']['FlowRate'][1]  # rate1
+        R2 = 0
+        if len(self.hwc['So']['FlowRate']) > 2:
+            R2 = self.hwc['So']['FlowRate'][2]  # rate2
+        q = max(0, R1 + 2 * R2 * pumptime)
+        split = self.hwc['So'].get('FlowSplit', ())
+        if nopen > 1 and len(split) >= nopen:
+            q = q * split[nopen - 1]
+        return q / nopen
+
+    def st_fill_multi(self, indexes, upthresholds, period=0.02, soperiod=1,
+                      cancel=None):  # fill water into more stations at once
+        """ Fill water into several stations at once.
+
+        Stations are filled in groups of at most MaxParallel of the source
+        (by default 1). For every group:
+        1. opens valves of all stations and switches their sensors on
+        2. starts water pump
+        3. every period seconds checks water levels of all stations, every
+        soperiod seconds checks water source is not empty. Volume filled into
+        every station is estimated by flow_rate. Valve of a station is closed
+        if its sensor shows it is full, or if estimated volume is greater by
+        10% than capacity of station (stations without sensor or with sensor
+        at bottom are closed when volume equal to capacity is filled).
+        4. stops the pump when last station is closed or if the source is
+        empty or cancel event is set.
+
+        \param indexes list of indexes of stations to fill
+        \param upthresholds list of upper thresholds 0 - 1 of stations
+        \param period float, sampling period of station sensors in seconds
+        \param soperiod float, sampling period of source sensor in seconds
+        \param cancel threading.Event, if set, filling stops
+        \return list of dictionaries like .LastFill, with added Volume -
+        estimated filled volume in liters
+        """
+        if cancel is None:
+            cancel = threading.Event()
+        maxparallel = max(1, self.hwc['So'].get('MaxParallel', 1))
+        res = []
+        for i in range(0, len(indexes), maxparallel):
+            res.extend(self._st_fill_group(indexes[i:i + maxparallel],
+                                           upthresholds[i:i + maxparallel],
+                                           period, soperiod, cancel))
+        if res:
+            self.LastFill = res[-1]
+        return res
+
+    def _st_fill_group(self, indexes, upthresholds, period, soperiod,
+                       cancel):  # fill water into group of stations at once
+        """ Fill water into group of stations at once, see st_fill_multi. """
+        res = {}
+        for index in indexes:
+            res[index] = {
+                'Index': index,
+                'FillTime': 0,
+                'Reason': 'cancelled',
+                'Latency': 0,
+                'Volume': 0,
+            }
+        if cancel.is_set():
+            return [res[x] for x in indexes]
+        # volume limits and whether sensor can detect full station:
+        limit = {}
+        sensor = {}
+        for index in indexes:
+            sensor[index] = self.hwc['SeWL'][index]['Type'] not in \
+                ('none', 'min')
+            if sensor[index]:
+                limit[index] = self.hwc['St'][index]['Cap'] * 1.1
+            else:
+                limit[index] = self.hwc['St'][index]['Cap']
+        thr = dict(zip(indexes, upthresholds))
+        soindex = len(self.hwc['SeWL']) - 1
+        socheck = self.WithHW and self.hwc['So']['Cap'] != -1 and \
+            self.hwc['SeWL'][soindex]['Type'] != 'none'
+        stsettlet = max([self.hwc['St'][x]['SettleT'] for x in indexes])
+        sosettlet = self.hwc['So']['SettleT']
+        # open valves and switch sensors on for the whole filling:
+        with self.pe_transaction():
+            if self.WithHW:
+                self.SeWLHeld = indexes + [soindex]
+            for index in indexes:
+                self._se_switch(index, 1)
+                self.st_switch(index, 1)
+            self._se_switch(soindex, 1)
+        # wait to valves settle and sensors voltages stabilize:
+        sleep(max(stsettlet, 0.2))
+        opened = list(indexes)
+        # time of last sample with station not full, for stations detected
+        # full by sensor:
+        detected = {}
+        self.so_switch(1)  # set pump on
+        tmp = time()
+        last = tmp
+        sotime = tmp
+        reason = ''
+        while opened:
+            if cancel.wait(period):
+                reason = 'cancelled'
+                break
+            now = time()
+            # estimate filled volumes:
+            q = self.flow_rate(last - tmp, len(opened))
+            for index in opened:
+                res[index]['Volume'] += q * (now - last)
+            # detect wl of stations:
+            if self.WithHW:
+                snapshot = self._pe_snapshot()
+            full = []
+            for index in opened:
+                if res[index]['Volume'] >= limit[index]:
+                    res[index]['Reason'] = 'time'
+                    full.append(index)
+                elif self.WithHW and sensor[index] and \
+                        self._se_read(index, snapshot, True) > thr[index]:
+                    res[index]['Reason'] = 'full'
+                    detected[index] = last
+                    full.append(index)
+            if len(full) == len(opened):
+                # last stations full, stop pump before closing valves:
+                break
+            # full stations are closed before source check, so they keep
+            # their reason if the source is empty in the same sample:
+            if full:
+                with self.pe_transaction():
+                    for index in full:
+                        self.st_switch(index, 0)
+                closetime = time()
+                for index in full:
+                    res[index]['FillTime'] = closetime - tmp
+                    if index in detected:
+                        res[index]['Latency'] = closetime - detected[index]
+                    opened.remove(index)
+            # detect wl of source with its own period:
+            if socheck and now >= sotime:
+                if self._se_read(soindex, snapshot, True) == 0:
+                    reason = 'source empty'
+                    break
+                sotime = now + soperiod
+            last = now
+        self.so_switch(0)            # set pump off
+        offtime = time()
+        for index in opened:
+            res[index]['FillTime'] = offtime - tmp
+            if reason:
+                res[index]['Reason'] = reason
+            if index in detected:
+                res[index]['Latency'] = offtime - detected[index]
+        with self.pe_transaction():
+            for index in indexes:
+                self._se_switch(index, 0)
+            self._se_switch(soindex, 0)
+            self.SeWLHeld = []
+        sleep(sosettlet)                # wait to stop the water flow
+        with self.pe_transaction():
+            for index in opened:
+                self.st_switch(index, 0)        # switch valves off
+        sleep(stsettlet)                # wait to valves settle
+        return [res[x] for x in indexes]
 
     def se_temp(self):  # return temperature
         """ Measure ambient temperature by weather sensor
@@ -745,7 +1117,8 @@ class YawspiHW:
             if self.hwc['SeTempSource'] == 'humid':
                 return self.humid.meas()[1]
             if self.hwc['SeTempSource'] == 'press':
-                return self.press.meas_temp()
+                with self.i2clock:
+                    return self.press.meas_temp()
         return -300
 
     def se_rain(self):  # return rain status
@@ -783,8 +1156,9 @@ class YawspiHW:
         \return float pressure in pascals
         """
         if self.WithHW and self.hwc['SePress']:
-            self.press.meas_temp()
-            return self.press.meas_press()
+            with self.i2clock:
+                self.press.meas_temp()
+                return self.press.meas_press()
         return -300
 
     def se_illum(self):  # return illuminance
@@ -796,9 +1170,88 @@ class YawspiHW:
         \return float illuminance in lux
         """
         if self.WithHW and self.hwc['SeIllum']:
-            return self.illum.meas()
+            with self.i2clock:
+                return self.illum.meas()
         return -300
 
+    def se_ambient_all(self, budget=2.0):  # return all ambient sensors
+        """ Measure all ambient sensors concurrently
+
+        Humidity sensor is read first on the calling thread alone, because it
+        is read by polling of a GPIO pin in python loop and switching to other
+        threads would distort its timing. Then every other sensor is read in
+        its own thread, sensors on the i2c bus and on the ad converters wait
+        for a lock of the bus. Humidity sensor returns also temperature and
+        pressure sensor measures temperature before pressure, so temperature
+        is taken from the sensor set by SeTempSource without additional
+        measurement. Sensors not finished in budget seconds return -300, and
+        the sensor is not read again till its thread finishes. Reading times
+        are stored in .SeLatency.
+        \param budget float maximal time for reading of sensors in threads in
+        seconds
+        \return dict with keys temp, humid, press, rain, illum, values as
+        returned by se_temp, se_humid etc.
+        """
+        res = {'temp': -300, 'humid': -300, 'press': -300, 'rain': -300,
+               'illum': -300}
+        if not self.WithHW:
+            return res
+        results = {}
+        if self.hwc['SeHumid']:
+            # no other sensor thread runs during reading of humidity:
+            self._se_worker('humid', self._se_humid_task, results)
+        tasks = {}
+        if self.hwc['SePress']:
+            tasks['press'] = self._se_press_task
+        if self.hwc['SeRain']:
+            tasks['rain'] = lambda: {'rain': self.se_rain()}
+        if self.hwc['SeIllum']:
+            tasks['illum'] = lambda: {'illum': self.se_illum()}
+        for name in tasks:
+            if name in self._se_workers and self._se_workers[name].is_alive():
+                # still reading from last time, skip it:
+                continue
+            t = threading.Thread(target=self._se_worker,
+                                 args=(name, tasks[name], results))
+            t.daemon = True
+            t.start()
+            self._se_workers[name] = t
+        endtime = time() + budget
+        for name in tasks:
+            self._se_workers[name].join(max(0, endtime - time()))
+        # threads not finished in budget can still add results:
+        for name in results.keys():
+            res.update(results[name])
+        return res
+
+    def _se_worker(self, name, task, results):  # reads one ambient sensor
+        """ Thread body reading one ambient sensor and measuring its latency
+
+        \param name string name of sensor
+        \param task function returning dict with values of sensor
+        \param results dict to store values into under name of sensor
+        \return Nothing
+        """
+        tmp = time()
+        val = task()
+        self.SeLatency[name] = time() - tmp
+        results[name] = val
+
+    def _se_humid_task(self):  # reads humidity (and temperature) sensor
+        r = self.humid.meas()
+        val = {'humid': r[0]}
+        if self.hwc['SeTemp'] and self.hwc['SeTempSource'] == 'humid':
+            val['temp'] = r[1]
+        return val
+
+    def _se_press_task(self):  # reads pressure (and temperature) sensor
+        with self.i2clock:
+            t = self.press.meas_temp()
+            val = {'press': self.press.meas_press()}
+        if self.hwc['SeTemp'] and self.hwc['SeTempSource'] == 'press':
+            val['temp'] = t
+        return val
+
     def clean_up(self):  # cleans GPIO
         """ cleans GPIO
 
@@ -0,0 +1,84 @@
+"""
+YawsPi log buffer. Lines of log are added by all threads and written to the
+log file by main thread. Adding a line only stores time and text into a
+bounded deque (appending is atomic in CPython, no lock is needed), time is
+formatted only when lines are written or shown.
+"""
+
+# imports:
+from collections import deque
+from time import time
+import arrow
+
+# maximal number of lines in buffer, oldest lines are dropped:
+MAXLINES = 10000
+
+
+def format_line(t, line):  # return log line as written to log file
+    """ Return formatted line of log.
+
+    \param t float, time of the line in seconds since epoch
+    \param line string, text of the line
+    \return string
+    """
+    return '<br>' + arrow.Arrow.fromtimestamp(t).isoformat() + '; ' + \
+        line + '\n'
+
+
+class LogBuffer:
+    """ Bounded buffer of log lines, items are tuples (time, line). """
+    def __init__(self, maxlines=MAXLINES):
+        """ Initialize class.
+
+        \param maxlines int, maximal number of lines in buffer
+        \return Nothing
+        """
+        self._lines = deque(maxlen=maxlines)
+        # number of lines dropped because buffer was full:
+        self.Dropped = 0
+
+    def __len__(self):
+        return len(self._lines)
+
+    def add(self, line):  # add line to buffer
+        if len(self._lines) == self._lines.maxlen:
+            self.Dropped += 1
+        self._lines.append((time(), line))
+
+    def drain(self):  # remove and return all lines
+        """ Remove all lines from buffer and return them formatted. Lines
+        added by other threads meanwhile are kept for next drain.
+
+        \param Nothing
+        \return list of strings
+        """
+        res = []
+        if self.Dropped:
+            tmp = self.Dropped
+            self.Dropped = 0
+            res.append(format_line(time(), str(tmp) + ' log lines dropped, ' +
+                                   'log buffer was full'))
+        while True:
+            try:
+                t, line = self._lines.popleft()
+            except IndexError:
+                break
+            res.append(format_line(t, line))
+        return res
+
+    def lines(self):  # return all lines without removing them
+        """ Return all lines in buffer formatted, lines are not removed.
+
+        \param Nothing
+        \return list of strings
+        """
+        while True:
+            try:
+                tmp = list(self._lines)
+                break
+            except RuntimeError:
+                # deque changed by other thread during copying, try again:
+                pass
+        return [format_line(t, line) for t, line in tmp]
+
+# vim modeline: vim: shiftwidth=4 tabstop=4
@@ -0,0 +1,252 @@
+"""
+YawsPi rotating log file. Log is written into current file (e.g. log.txt),
+full file is renamed to a rotated file with sequence number (log.txt.1,
+log.txt.2, ...) and the oldest rotated files are deleted, so the log never
+has more lines than the limit. Number of lines of current file is counted
+while lines are written, lines of rotated files are counted once. Files are
+rewritten only if the limit was lowered or the current file was written
+without limit: oversized current file is split into files of normal size and
+the oldest rotated file is cut to fit the limit.
+
+Log is read from the newest lines by blocks from the end of files. Position
+in log is a cursor (sequence number of file, byte offset in file), current
+file has sequence number it gets when rotated, so cursors stay valid.
+"""
+
+# imports:
+import os
+
+# number of files (current and rotated) the limit of lines is split into:
+SEGMENTS = 4
+# size of blocks read from the end of file:
+BLOCKSIZE = 8192
+# maximal number of bytes read by one call of tail:
+MAXSCAN = 1024 * 1024
+# number of attempts to read log rotated by other thread meanwhile:
+ATTEMPTS = 3
+
+
+def reverse_lines(path, end):  # yield lines of file from the end
+    """ Yield lines of file from the last one, file is read by blocks from
+    the end.
+
+    \param path string, path of file
+    \param end int, offset in file, lines before it are yielded
+    \return generator of tuples (string, int), line and its offset in file
+    """
+    with open(path, 'rb') as f:
+        pos = end
+        buf = ''
+        while pos > 0:
+            size = min(BLOCKSIZE, pos)
+            pos -= size
+            f.seek(pos)
+            # buf starts at offset pos:
+            buf = f.read(size) + buf
+            stop = len(buf)
+            i = buf.rfind('\n', 0, stop - 1)
+            while i >= 0:
+                yield (buf[i + 1:stop], pos + i + 1)
+                stop = i + 1
+                i = buf.rfind('\n', 0, stop - 1)
+            # first line in buf can continue in previous block:
+            buf = buf[:stop]
+        if buf:
+            yield (buf, 0)
+
+
+class RotatingLog:
+    """ Log file rotated by number of lines. """
+    def __init__(self, path, segments=SEGMENTS):
+        """ Initialize class.
+
+        \param path string, path of current log file
+        \param segments int, number of files the limit is split into
+        \return Nothing
+        """
+        self.path = path
+        self.segments = segments
+        # number of lines in current file, None if not counted yet:
+        self._count = None
+        # numbers of lines of rotated files by path:
+        self._lines = {}
+
+    def write(self, lines, limit):  # write lines, rotate if needed
+        """ Append lines to current file, rotate files if current file has
+        limit / segments lines.
+
+        \param lines list of strings, every string ends by new line
+        \param limit int, maximal number of lines of whole log, 0 means no
+        limit
+        \return Nothing
+        """
+        if self._count is None:
+            self._count = 0
+            if os.path.isfile(self.path):
+                # count lines once, then counted while writing:
+                with open(self.path, 'r') as f:
+                    for line in f:
+                        self._count += 1
+        # lines of one file:
+        perfile = max(1, limit // self.segments)
+        f = open(self.path, 'a')
+        for line in lines:
+            if limit > 0 and self._count >= perfile:
+                f.close()
+                self._rotate(limit)
+                f = open(self.path, 'a')
+            f.write(line)
+            self._count += line.count('\n')
+        f.close()
+
+    def files(self):  # return rotated and current files
+        """ Return all files of log from the oldest.
+
+        \param Nothing
+        \return list of tuples (int, string), sequence number and path of
+        file, current file has the highest sequence number
+        """
+        res = self._rotated()
+        seq = 0
+        if res:
+            seq = res[-1][0]
+        if os.path.isfile(self.path):
+            res.append((seq + 1, self.path))
+        return res
+
+    def read(self):  # return all lines of log
+        """ Return all lines of log from the oldest.
+
+        \param Nothing
+        \return list of strings
+        """
+        res = []
+        for seq, path in self.files():
+            with open(path, 'r') as f:
+                res.extend(f.readlines())
+        return res
+
+    def tail(self, count, cursor=None, match=None):  # return newest lines
+        """ Return newest lines of log older than cursor. At most MAXSCAN
+        bytes are read, so less than count lines can be returned if match is
+        given, cursor of older lines is returned anyway.
+
+        \param count int, maximal number of returned lines
+        \param cursor tuple (int, int), sequence number of file and offset
+        in it, None for the end of log
+        \param match function returning True for lines to return, None to
+        return all lines
+        \return tuple (list of strings, cursor), lines from the newest and
+        cursor of older lines, None if there are no older lines
+        """
+        for i in range(ATTEMPTS - 1):
+            try:
+                return self._tail(count, cursor, match)
+            except (IOError, OSError):
+                # file rotated by writing thread meanwhile, read again:
+                pass
+        return self._tail(count, cursor, match)
+
+    def end(self):  # return cursor of the end of log
+        """ Return cursor of the end of log, older lines are all lines of
+        log.
+
+        \param Nothing
+        \return tuple (int, int) cursor, None if log is empty
+        """
+        for i in range(ATTEMPTS):
+            files = self.files()
+            if not files:
+                return None
+            try:
+                return (files[-1][0], os.path.getsize(files[-1][1]))
+            except OSError:
+                # file rotated by writing thread meanwhile:
+                pass
+        return None
+
+    def _tail(self, count, cursor, match):  # return newest lines, see tail
+        res = []
+        scanned = 0
+        for seq, path in reversed(self.files()):
+            if cursor is not None and seq > cursor[0]:
+                continue
+            end = os.path.getsize(path)
+            if cursor is not None and seq == cursor[0]:
+                end = cursor[1]
+            for line, start in reverse_lines(path, end):
+                scanned += len(line)
+                if match is None or match(line):
+                    res.append(line)
+                if len(res) >= count or scanned >= MAXSCAN:
+                    return (res, (seq, start))
+        return (res, None)
+
+    def _rotated(self):  # return rotated files sorted by sequence
+        folder = os.path.dirname(self.path) or '.'
+        prefix = os.path.basename(self.path) + '.'
+        res = []
+        for x in os.listdir(folder):
+            if x.startswith(prefix) and x[len(prefix):].isdigit():
+                res.append((int(x[len(prefix):]), os.path.join(folder, x)))
+        return sorted(res)
+
+    def _rotate(self, limit):  # rotate current file, remove lines over limit
+        perfile = max(1, limit // self.segments)
+        # lines of rotated files, current file gets perfile lines:
+        budget = max(0, limit - perfile)
+        rotated = self._rotated()
+        seq = 1
+        if rotated:
+            seq = rotated[-1][0] + 1
+        if self._count > perfile:
+            # written without limit or with higher limit, split into files of
+            # perfile lines, the newest file is full:
+            with open(self.path, 'r') as f:
+                tmp = f.readlines()
+            tmp = tmp[max(0, len(tmp) - budget):]
+            ends = range(len(tmp), 0, -perfile)[::-1]
+            for start, end in zip([0] + ends[:-1], ends):
+                path = self.path + '.' + str(seq)
+                self._write_lines(path, tmp[start:end])
+                rotated.append((seq, path))
+                seq += 1
+            os.remove(self.path)
+        else:
+            path = self.path + '.' + str(seq)
+            os.rename(self.path, path)
+            self._lines[path] = self._count
+            rotated.append((seq, path))
+        # remove the oldest lines over budget:
+        total = 0
+        for i in reversed(range(len(rotated))):
+            path = rotated[i][1]
+            count = self._count_lines(path)
+            if total + count <= budget:
+                total += count
+                continue
+            if budget > total:
+                # keep the newest lines of the file:
+                with open(path, 'r') as f:
+                    tmp = f.readlines()
+                self._write_lines(path, tmp[len(tmp) - (budget - total):])
+                i -= 1
+            for x in rotated[:i + 1]:
+                os.remove(x[1])
+                self._lines.pop(x[1], None)
+            break
+        self._count = 0
+
+    def _count_lines(self, path):  # return number of lines of rotated file
+        if path not in self._lines:
+            with open(path, 'r') as f:
+                self._lines[path] = sum(1 for line in f)
+        return self._lines[path]
+
+    def _write_lines(self, path, lines):  # atomically write rotated file
+        with open(path + '.tmp', 'w') as f:
+            f.writelines(lines)
+        os.rename(path + '.tmp', path)
+        self._lines[path] = len(lines)
+
+# vim modeline: vim: shiftwidth=4 tabstop=4
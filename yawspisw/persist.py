@@ -0,0 +1,169 @@
+"""
+YawsPi persistence of settings. Pickled settings are written atomically:
+into temporary file, synced to disk and renamed, previous file is kept as
+backup (last known good copy), so power cut during writing never leaves
+corrupted settings. Saves requested by web pages are only remembered and
+written by background thread after a short delay, so burst of saves is
+written once and web pages do not wait for SD card.
+"""
+
+# imports:
+import os
+import pickle
+import threading
+from time import time
+
+# seconds from the last save request till writing:
+DELAY = 2.0
+# suffix of backup files:
+BACKUPSUFFIX = '.bak'
+# suffix of temporary files:
+TMPSUFFIX = '.tmp'
+
+
+def write_atomic(path, data):  # write file atomically, keep backup
+    """ Write data into file atomically, previous file is renamed to backup.
+
+    \param path string, path of file
+    \param data string, content of file
+    \return Nothing
+    """
+    folder = os.path.dirname(path) or '.'
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    tmp = path + TMPSUFFIX
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    if os.path.isfile(path):
+        # if power fails before next rename, backup is loaded:
+        os.rename(path, path + BACKUPSUFFIX)
+    os.rename(tmp, path)
+    # make renames durable:
+    fd = os.open(folder, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def load(path):  # load pickled object, use backup if file is broken
+    """ Load pickled object from file, if file is missing or broken, load it
+    from backup.
+
+    \param path string, path of file
+    \return tuple (object, string), loaded object and path of file it was
+    loaded from, (None, None) if neither file nor backup can be loaded
+    """
+    for x in (path, path + BACKUPSUFFIX):
+        if not os.path.isfile(x):
+            continue
+        try:
+            with open(x, 'rb') as f:
+                return (pickle.load(f), x)
+        except Exception:
+            # broken file (interrupted write), try backup:
+            pass
+    return (None, None)
+
+
+class Saver:
+    """ Debounced background writer of pickled objects.
+
+    Attribute Error contains descriptions of failed writes of files not
+    written successfully since, or empty string.
+    """
+    def __init__(self, delay=DELAY):
+        """ Initialize class and start writing thread.
+
+        \param delay float, seconds from the last save request till writing
+        \return Nothing
+        """
+        self.delay = delay
+        self.Error = ''
+        # descriptions of failed writes by path:
+        self._failed = {}
+        self._cond = threading.Condition()
+        # serializes writing by thread and by flush():
+        self._writing = threading.Lock()
+        # tuples (pickled data, list of functions called after writing)
+        # waiting for writing by path:
+        self._pending = {}
+        self._due = 0
+        self._stop = False
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def save(self, path, obj, done=None):  # request saving of object
+        """ Pickle object now (so later changes are not saved) and write it
+        later. Only the last request for a path is written.
+
+        \param path string, path of file
+        \param obj object to pickle
+        \param done function called by writing thread after writing with
+        description of error (empty string if written successfully), None if
+        not needed
+        \return Nothing
+        """
+        data = pickle.dumps(obj)
+        with self._cond:
+            tmp = []
+            if path in self._pending:
+                # all requests are answered by one write:
+                tmp = self._pending[path][1]
+            if done is not None:
+                tmp = tmp + [done]
+            self._pending[path] = (data, tmp)
+            self._due = time() + self.delay
+            self._cond.notify()
+
+    def flush(self):  # write all waiting objects now
+        with self._cond:
+            pending = self._pending
+            self._pending = {}
+        self._write(pending)
+
+    def stop(self, timeout=None):  # write waiting objects, stop thread
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+        self._thread.join(timeout)
+        self.flush()
+
+    def _write(self, pending):  # write pickled data
+        with self._writing:
+            for path, (data, done) in pending.items():
+                error = ''
+                try:
+                    write_atomic(path, data)
+                    self._failed.pop(path, None)
+                except Exception, err:
+                    error = path + ': ' + str(err)
+                    self._failed[path] = error
+                self.Error = '; '.join(sorted(self._failed.values()))
+                for x in done:
+                    try:
+                        x(error)
+                    except Exception:
+                        # e.g. log on the same full disk, keep writing:
+                        pass
+
+    def _run(self):  # writing thread
+        while True:
+            with self._cond:
+                while not self._pending and not self._stop:
+                    self._cond.wait()
+                if self._stop:
+                    return
+                remaining = self._due - time()
+                if remaining > 0:
+                    # wait for more requests:
+                    self._cond.wait(remaining)
+                    continue
+                pending = self._pending
+                self._pending = {}
+            self._write(pending)
+
+# vim modeline: vim: shiftwidth=4 tabstop=4
@@ -0,0 +1,130 @@
+"""
+YawsPi plan cache. Keeps planned watering times of calendar programs, so plan
+is not computed again for every request. Plan of a program is computed again
+only if definition of the program changed, otherwise it is only rolled forward
+as time passes.
+"""
+
+# imports:
+import threading
+import hashlib
+import pickle
+import heapq
+
+# keys of program definition which affects plan of calendar programs:
+PLANKEYS = ('Enabled', 'Mode', 'calwDays', 'calwRepeatH', 'caliIntervalD',
+            'caliRepeatH', 'TimeFromH', 'TimeFromM', 'TimeToH', 'TimeToM')
+
+# maximal number of waterings of one program per day, prevents infinite loop:
+MAXPERDAY = 100
+
+
+def plan_key(prg):  # return hash of program definition
+    """ Return hash of values of program which affects its plan.
+
+    \param prg dictionary of program, see prg_get_new
+    \return string hash
+    """
+    tmp = [prg[k] for k in PLANKEYS]
+    if prg['Mode'] == 'interval':
+        # interval program is planned from its last run:
+        tmp.append(prg['TimeLastRun'].isoformat())
+    return hashlib.sha1(pickle.dumps(tmp)).hexdigest()
+
+
+class PlanCache:
+    """ Cache of planned watering times of calendar programs.
+
+    Plan of every program is a dictionary:
+    1. Key: string, hash of program definition
+    2. Times: list of arrow, planned watering times sorted
+    3. Until: arrow, plan is complete up to this time
+    """
+    def __init__(self, nexttime):
+        """ Initialize class.
+
+        \param nexttime function (index, starttime) returning arrow of next
+        watering of the program not sooner than starttime
+        \return Nothing
+        """
+        self._nexttime = nexttime
+        self._lock = threading.Lock()
+        self._plans = []
+        # merged plan of all programs, list of tuples (arrow, index):
+        self._merged = []
+        self._dirty = True
+
+    def invalidate(self):  # forget all plans
+        with self._lock:
+            self._plans = []
+            self._merged = []
+            self._dirty = True
+
+    def get(self, programs, now, horizon):  # return plan of all programs
+        """ Return plan of all enabled calendar programs from now till
+        horizon, computing only plans which are missing or outdated.
+
+        \param programs list of program dictionaries
+        \param now arrow, start of the plan
+        \param horizon arrow, end of the plan
+        \return list of tuples (arrow, int), time of watering and index of
+        program, sorted by time
+        """
+        with self._lock:
+            # number of programs changed (added or removed):
+            if len(self._plans) != len(programs):
+                self._plans = [None] * len(programs)
+                self._dirty = True
+            for i in range(len(programs)):
+                self._update(i, programs[i], now, horizon)
+            if self._dirty:
+                self._merged = list(heapq.merge(
+                    *[[(t, i) for t in self._plans[i]['Times']]
+                      for i in range(len(self._plans))]))
+                self._dirty = False
+            # drop past waterings from merged plan:
+            start = 0
+            while start < len(self._merged) and self._merged[start][0] < now:
+                start += 1
+            if start:
+                self._merged = self._merged[start:]
+            return [x for x in self._merged if x[0] < horizon]
+
+    def _update(self, index, prg, now, horizon):  # update plan of a program
+        key = plan_key(prg)
+        plan = self._plans[index]
+        if plan is None or plan['Key'] != key:
+            # program changed, compute plan again:
+            plan = {'Key': key, 'Times': [], 'Until': now}
+            self._plans[index] = plan
+            self._dirty = True
+        if not prg['Enabled'] or prg['Mode'] == 'waterlevel':
+            return
+        # roll forward - drop past waterings:
+        start = 0
+        while start < len(plan['Times']) and plan['Times'][start] < now:
+            start += 1
+        if start:
+            plan['Times'] = plan['Times'][start:]
+        if plan['Until'] < now:
+            plan['Until'] = now
+        # extend plan till horizon:
+        if plan['Until'] < horizon:
+            limit = MAXPERDAY * (1 + (horizon - plan['Until']).days)
+            t = plan['Until']
+            while True:
+                limit -= 1
+                if limit < 0:
+                    raise NameError('Too many waterings of a program in a ' +
+                                    'day, probably internal error')
+                t = self._nexttime(index, t)
+                if t >= horizon:
+                    break
+                plan['Times'].append(t)
+                # add second to move in program:
+                t = t.replace(seconds=+1)
+            plan['Until'] = horizon
+            self._dirty = True
+
+
+# vim modeline: vim: shiftwidth=4 tabstop=4
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+"""
+YawsPi program occurrences. Expands calendar programs into arrays of all
+watering times in a time range at once by numpy, usefull for planning over
+long horizons (months), where stepping by prg_times functions is slow.
+
+Times are int64 numpy arrays of seconds. Wall times are seconds since
+1970-01-01 00:00 of local (wall clock) time, epoch times are usual seconds
+since epoch (UTC). Occurrences are the same as found by repeated calls of
+prg_times.weekly_next or prg_times.interval_next from range start, which are
+used by the scheduler. If TimeFrom is later than TimeTo, program waters once
+at TimeFrom of every valid day except the day of range start (prg_times finds
+TimeFrom of that day later than TimeTo).
+"""
+
+# imports:
+import numpy as np
+from datetime import datetime, timedelta
+
+# seconds per day:
+DAY = 86400
+# day of week of 1970-01-01 (Thursday, 0 is Monday):
+EPOCHWEEKDAY = 3
+# start of wall time:
+WALLZERO = datetime(1970, 1, 1)
+
+
+def to_wall(t):  # convert naive datetime to wall time
+    """ Return wall time of naive datetime.
+
+    \param t datetime, naive local time
+    \return int wall time in seconds
+    """
+    d = t - WALLZERO
+    return d.days * DAY + d.seconds
+
+
+def day_times(prg, prefix):  # return times of watering during a valid day
+    """ Return seconds from midnight of waterings during one valid day.
+
+    \param prg dictionary of program, see prg_get_new
+    \param prefix string, 'calw' for weekly mode, 'cali' for interval mode
+    \return int64 numpy array of seconds
+    """
+    if not prg[prefix + 'RepeatH'] > 0:
+        raise NameError('program repeat hour is not greater than zero!')
+    step = int(round(prg[prefix + 'RepeatH'] * 3600))
+    tfrom = prg['TimeFromH'] * 3600 + prg['TimeFromM'] * 60
+    tto = prg['TimeToH'] * 3600 + prg['TimeToM'] * 60
+    # valid day contains at least one watering at TimeFrom:
+    count = max(0, (tto - tfrom) // step) + 1
+    tmp = tfrom + step * np.arange(count, dtype=np.int64)
+    # repeats must stay in the same day:
+    return tmp[tmp < DAY]
+
+
+def weekly(prg, start, end):  # expand weekly program
+    """ Return all waterings of weekly program in time range.
+
+    \param prg dictionary of program, see prg_get_new
+    \param start int wall time, range start (included)
+    \param end int wall time, range end (excluded)
+    \return int64 numpy array of wall times, sorted
+    """
+    mask = 0
+    for d in prg['calwDays']:
+        if 1 <= d <= 7:
+            mask = mask | (1 << (d - 1))
+    if not mask:
+        raise NameError('program does not contain any valid weekdays!')
+    days = np.arange(start // DAY, end // DAY + 1, dtype=np.int64)
+    valid = (mask >> ((days + EPOCHWEEKDAY) % 7)) & 1
+    days = _skip_first(prg, days[valid.astype(bool)], start)
+    return _expand(days, day_times(prg, 'calw'), start, end)
+
+
+def interval(prg, start, end):  # expand interval program
+    """ Return all waterings of interval program in time range. Valid days
+    are day of TimeLastRun and every caliIntervalD days after it.
+
+    \param prg dictionary of program, see prg_get_new
+    \param start int wall time, range start (included)
+    \param end int wall time, range end (excluded)
+    \return int64 numpy array of wall times, sorted
+    """
+    if not prg['caliIntervalD'] > 0:
+        raise NameError('program repeat day is not greater than zero!')
+    first = to_wall(prg['TimeLastRun'].naive) // DAY
+    # first valid day not sooner than start:
+    skip = max(0, start // DAY - first)
+    first = first + prg['caliIntervalD'] * (-(-skip // prg['caliIntervalD']))
+    days = np.arange(first, end // DAY + 1, prg['caliIntervalD'],
+                     dtype=np.int64)
+    days = _skip_first(prg, days, start)
+    return _expand(days, day_times(prg, 'cali'), start, end)
+
+
+def expand(prg, start, end):  # expand any calendar program
+    """ Return all waterings of enabled calendar program in time range.
+    Disabled and water level programs have no waterings.
+
+    \param prg dictionary of program, see prg_get_new
+    \param start int wall time, range start (included)
+    \param end int wall time, range end (excluded)
+    \return int64 numpy array of wall times, sorted
+    """
+    if prg['Enabled']:
+        if prg['Mode'] == 'weekly':
+            return weekly(prg, start, end)
+        if prg['Mode'] == 'interval':
+            return interval(prg, start, end)
+    return np.zeros(0, dtype=np.int64)
+
+
+def timeline(prgs, start, end):  # merge waterings of all programs
+    """ Return all waterings of all programs in time range sorted by time.
+
+    \param prgs list of dictionaries of programs
+    \param start int wall time, range start (included)
+    \param end int wall time, range end (excluded)
+    \return tuple (times, indexes), int64 numpy array of wall times and int
+    numpy array of indexes of programs
+    """
+    times = [expand(prg, start, end) for prg in prgs]
+    indexes = [np.full(len(times[i]), i, dtype=int) for i in range(len(prgs))]
+    if not times:
+        return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=int))
+    times = np.concatenate(times)
+    indexes = np.concatenate(indexes)
+    order = np.argsort(times, kind='mergesort')
+    return (times[order], indexes[order])
+
+
+def to_epoch(wall, tzinfo):  # convert wall times to epoch times
+    """ Convert wall times to epoch times according to time zone, daylight
+    saving time is respected. Offset of time zone is found once for every
+    hour present in wall times.
+
+    \param wall int64 numpy array of wall times
+    \param tzinfo time zone of wall times
+    \return int64 numpy array of epoch times
+    """
+    hours, inverse = np.unique(wall // 3600, return_inverse=True)
+    offsets = np.zeros(len(hours), dtype=np.int64)
+    for i in range(len(hours)):
+        t = WALLZERO + timedelta(seconds=int(hours[i]) * 3600)
+        d = tzinfo.utcoffset(t)
+        offsets[i] = d.days * DAY + d.seconds
+    return wall - offsets[inverse]
+
+
+def _skip_first(prg, days, start):  # remove day of start if needed
+    tfrom = (prg['TimeFromH'], prg['TimeFromM'])
+    if tfrom > (prg['TimeToH'], prg['TimeToM']):
+        # prg_times finds TimeFrom of the day later than TimeTo:
+        return days[days != start // DAY]
+    return days
+
+
+def _expand(days, times, start, end):  # combine valid days and day times
+    tmp = (days[:, np.newaxis] * DAY + times[np.newaxis, :]).ravel()
+    return tmp[(tmp >= start) & (tmp < end)]
+
+
+if __name__ == "__main__":
+    # benchmark: one year of 100 random programs
+    import random
+    import time
+    import arrow
+    random.seed(0)
+    prgs = []
+    for i in range(100):
+        prgs.append({
+            'Enabled': True,
+            'Mode': random.choice(['weekly', 'interval']),
+            'calwDays': random.sample(range(1, 8), random.randint(1, 7)),
+            'calwRepeatH': random.choice([0.5, 1, 2, 3, 5, 12]),
+            'caliIntervalD': random.randint(1, 7),
+            'caliRepeatH': random.choice([0.5, 1, 2, 3, 5, 12]),
+            'TimeFromH': random.randint(0, 12),
+            'TimeFromM': random.randint(0, 59),
+            'TimeToH': random.randint(12, 23),
+            'TimeToM': random.randint(0, 59),
+            'TimeLastRun': arrow.get(2016, 1, 1),
+        })
+    start = to_wall(datetime(2016, 1, 1))
+    end = to_wall(datetime(2017, 1, 1))
+    tmp = time.time()
+    times, indexes = timeline(prgs, start, end)
+    print 'expanded year of 100 programs into ' + str(len(times)) + \
+        ' waterings in ' + '{:.3f}'.format(time.time() - tmp) + ' s'
@@ -0,0 +1,123 @@
+"""
+YawsPi program times. Computes next watering times of calendar programs
+directly by arithmetic on dates and times of day, without stepping day by day
+or repeat by repeat.
+
+All times are naive datetime objects in local (wall clock) time.
+"""
+
+# imports:
+from datetime import datetime, timedelta
+from datetime import time as daytime
+
+
+def weekday_mask(days):  # return bit mask of weekdays
+    """ Return bit mask of weekdays, bit 0 is Monday, bit 6 is Sunday.
+
+    \param days list of integers, days of week (1 - Monday, 7 - Sunday)
+    \return int bit mask
+    """
+    mask = 0
+    for d in days:
+        if 1 <= d <= 7:
+            mask = mask | (1 << (d - 1))
+    return mask
+
+
+def days_to_weekday(isoweekday, mask):  # return days to next valid weekday
+    """ Return number of days from isoweekday to nearest valid weekday (0 if
+    isoweekday is valid).
+
+    \param isoweekday int, day of week (1 - Monday, 7 - Sunday)
+    \param mask int, bit mask of valid weekdays, see weekday_mask
+    \return int number of days 0 - 6
+    """
+    for n in range(7):
+        if mask & (1 << ((isoweekday - 1 + n) % 7)):
+            return n
+    raise NameError('program does not contain any valid weekdays!')
+
+
+def repeats_till(delta, step):  # number of repeats to cover time difference
+    """ Return smallest integer k >= 0 so that k * step >= delta.
+
+    \param delta timedelta, time difference to cover
+    \param step timedelta, repeat period, must be positive
+    \return int k
+    """
+    if delta <= timedelta(0):
+        return 0
+    return -(-_microseconds(delta) // _microseconds(step))
+
+
+def weekly_next(starttime, days, repeath, fromhm, tohm):  # next weekly time
+    """ Return next watering time of program with weekly mode.
+
+    \param starttime datetime, next watering time is not sooner than starttime
+    \param days list of integers, days of week (1 - Monday, 7 - Sunday)
+    \param repeath float, repeat during day every repeath hours
+    \param fromhm tuple (hour, minute), program valid from time of day
+    \param tohm tuple (hour, minute), program valid to time of day
+    \return tuple: (datetime, string), time of next watering, string with
+    description why starttime is not next watering (in the case it is not).
+    """
+    mask = weekday_mask(days)
+    if not mask:
+        raise NameError('program does not contain any valid weekdays!')
+    if not repeath > 0:
+        raise NameError('program repeat hour is not greater than zero!')
+    reason = 'not valid day of week'
+    t = datetime.combine(starttime.date(), daytime(*fromhm))
+    if mask & (1 << (t.isoweekday() - 1)):
+        # starttime is valid week day, first repeat not sooner than starttime:
+        step = timedelta(hours=repeath)
+        ts = t + step * repeats_till(starttime - t, step)
+        pvt = datetime.combine(ts.date(), daytime(*tohm))
+        if ts.date() == t.date() and ts <= pvt:
+            return (ts, 'not valid time of a day')
+        # date overflow, therefore starttime is later than TimeTo:
+        reason = 'later than TimeTo'
+        t = t + timedelta(days=1)
+    # skip to next valid weekday:
+    return (t + timedelta(days=days_to_weekday(t.isoweekday(), mask)), reason)
+
+
+def interval_next(lastrun, starttime, intervald, repeath, fromhm,
+                  tohm):  # next interval time
+    """ Return next watering time of program with interval mode.
+
+    Valid days are day of lastrun and every intervald days after it.
+
+    \param lastrun datetime, time of last run of the program
+    \param starttime datetime, next watering time is not sooner than starttime
+    \param intervald int, repeat every intervald days
+    \param repeath float, repeat during day every repeath hours
+    \param fromhm tuple (hour, minute), program valid from time of day
+    \param tohm tuple (hour, minute), program valid to time of day
+    \return tuple: (datetime, string), time of next watering, string with
+    description why starttime is not next watering (in the case it is not).
+    """
+    if not intervald > 0:
+        raise NameError('program repeat day is not greater than zero!')
+    if not repeath > 0:
+        raise NameError('program repeat hour is not greater than zero!')
+    t = datetime.combine(lastrun.date(), daytime(*fromhm))
+    # first valid day not sooner than day of starttime:
+    days = (starttime.date() - t.date()).days
+    if days > 0:
+        t = t + timedelta(days=intervald * (-(-days // intervald)))
+    if t.date() != starttime.date():
+        return (t, 'not valid day')
+    # starttime is valid day, first repeat not sooner than starttime:
+    step = timedelta(hours=repeath)
+    ts = t + step * repeats_till(starttime - t, step)
+    pvt = datetime.combine(t.date(), daytime(*tohm))
+    if ts > pvt:
+        return (t + timedelta(days=intervald), 'later than TimeTo')
+    return (ts, 'not valid time of a day')
+
+
+def _microseconds(td):  # return timedelta as integer microseconds
+    return (td.days * 86400 + td.seconds) * 1000000 + td.microseconds
+
+# vim modeline: vim: shiftwidth=4 tabstop=4
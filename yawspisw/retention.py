@@ -0,0 +1,96 @@
+"""
+YawsPi retention of measured data. Background thread periodically removes
+records older than retention policy of every series and compresses cold
+segments of time series store. Rollups of series are kept forever, so long
+history can still be shown in charts. Compaction pauses while hardware is
+busy (e.g. station filling), so it does not compete for slow SD card.
+"""
+
+# imports:
+import threading
+from time import time
+
+# seconds per day:
+DAY = 86400
+# segments with records older than this number of days are compressed:
+COLDDAYS = 7
+# seconds between compactions:
+INTERVAL = 3600
+# seconds after start till the first compaction:
+FIRSTDELAY = 300
+# seconds between checks of busy hardware:
+BUSYCHECK = 5
+
+
+class Compactor:
+    """ Background compaction of time series store.
+
+    Attributes with result of the last compaction:
+    1. LastRun: float, time of the last compaction end, None if not run yet
+    2. Removed: dictionary, number of removed records by series name
+    3. Compressed: dictionary, number of compressed segments by series name
+    4. Error: string, description of error of the last compaction or empty
+    """
+    def __init__(self, store, policies, busy):
+        """ Initialize class and start compaction thread.
+
+        \param store TimeSeriesStore
+        \param policies function returning dictionary of number of days of
+        kept records by series name, 0 means records are kept forever
+        \param busy function returning True if compaction should wait
+        \return Nothing
+        """
+        self._store = store
+        self._policies = policies
+        self._busy = busy
+        self._stop = threading.Event()
+        self.LastRun = None
+        self.Removed = {}
+        self.Compressed = {}
+        self.Error = ''
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def compact(self, now=None):  # run compaction of all series
+        """ Remove old records and compress cold segments of all series with
+        policy.
+
+        \param now float, current time in seconds since epoch, None for
+        current time
+        \return Nothing
+        """
+        if now is None:
+            now = time()
+        cold = int(now) - COLDDAYS * DAY
+        for name, days in self._policies().items():
+            if self._stop.is_set():
+                return
+            if days > 0:
+                # whole days are removed, so rollup buckets are complete:
+                before = (int(now) - days * DAY) // DAY * DAY
+                self.Removed[name] = self._store.trim(name, before,
+                                                      self._wait)
+            self.Compressed[name] = self._store.compress(name, cold,
+                                                         self._wait)
+        self.LastRun = time()
+
+    def stop(self, timeout=None):  # stop compaction thread
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def _wait(self):  # wait till hardware is not busy
+        while self._busy() and not self._stop.is_set():
+            self._stop.wait(BUSYCHECK)
+
+    def _run(self):  # compaction thread
+        delay = FIRSTDELAY
+        while not self._stop.wait(delay):
+            delay = INTERVAL
+            try:
+                self.compact()
+                self.Error = ''
+            except Exception, err:
+                self.Error = str(err)
+
+# vim modeline: vim: shiftwidth=4 tabstop=4
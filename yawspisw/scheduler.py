@@ -0,0 +1,98 @@
+"""
+YawsPi scheduler. Keeps next start times of programs in a heap, so main loop
+can sleep till the nearest one and does not need to check all programs
+periodically.
+"""
+
+# imports:
+import heapq
+
+
+class Scheduler:
+    """ Heap of next start times of programs.
+
+    Every program has a version number, which is increased every time the
+    program is scheduled again or cancelled. Heap entries with old version are
+    ignored and dropped lazily, so changing a program does not need to search
+    the heap.
+    """
+    def __init__(self):
+        """ Initialize class.
+
+        \param Nothing
+        \return Nothing
+        """
+        # heap of tuples (time, key, version):
+        self._heap = []
+        # current version of every key:
+        self._version = {}
+        # scheduled time of every key:
+        self._when = {}
+
+    def schedule(self, key, when):  # set next start time of key
+        """ Set next start time of key, previous start time is forgotten.
+
+        \param key hashable, identification of program
+        \param when float, start time in seconds since epoch
+        \return Nothing
+        """
+        self.cancel(key)
+        self._when[key] = when
+        heapq.heappush(self._heap, (when, key, self._version[key]))
+
+    def cancel(self, key):  # forget start time of key
+        """ Forget start time of key.
+
+        \param key hashable, identification of program
+        \return Nothing
+        """
+        self._version[key] = self._version.get(key, 0) + 1
+        self._when.pop(key, None)
+
+    def clear(self):  # forget all start times
+        self._heap = []
+        self._version = {}
+        self._when = {}
+
+    def when(self, key):  # return start time of key
+        """ Return start time of key or None if key is not scheduled.
+
+        \param key hashable, identification of program
+        \return float time in seconds since epoch or None
+        """
+        return self._when.get(key)
+
+    def next_time(self):  # return nearest start time
+        """ Return nearest start time of all keys or None if nothing is
+        scheduled.
+
+        \param Nothing
+        \return float time in seconds since epoch or None
+        """
+        self._drop_old()
+        if self._heap:
+            return self._heap[0][0]
+        return None
+
+    def pop_due(self, now):  # return keys with start time till now
+        """ Remove and return all keys with start time not later than now.
+        Keys are returned in order of start times, every key once.
+
+        \param now float, time in seconds since epoch
+        \return list of keys
+        """
+        due = []
+        self._drop_old()
+        while self._heap and self._heap[0][0] <= now:
+            when, key, version = heapq.heappop(self._heap)
+            self.cancel(key)
+            due.append(key)
+            self._drop_old()
+        return due
+
+    def _drop_old(self):  # remove old versions from top of the heap
+        while self._heap and \
+                self._heap[0][2] != self._version.get(self._heap[0][1]):
+            heapq.heappop(self._heap)
+
+# vim modeline: vim: shiftwidth=4 tabstop=4
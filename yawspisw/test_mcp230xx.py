@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+"""
+Tests of MCP230XX driver on emulated I2C bus. Counts bus transactions of
+shadow registers and deferred (batched) writes and checks registers of the
+emulated chip.
+
+Run by: python -m unittest discover -p 'test_*.py'
+"""
+
+# imports:
+import unittest
+from Adafruit_MCP230XX import Adafruit_MCP230XX, MCP230XX_I2CEmulator
+from Adafruit_MCP230XX import MCP23017_OLATA, MCP23017_OLATB, \
+    MCP23017_IODIRA, MCP23017_IODIRB, MCP23008_OLATA
+
+
+def init_outputs(mcp):  # configuration done by YawspiHW initialization
+    for i in range(16):
+        mcp.config(i, 1)
+    for i in range(8):
+        mcp.config(i, 0)
+    for i in range(8):
+        mcp.output(i, 0)
+
+
+class TestTransactions(unittest.TestCase):
+    def setUp(self):
+        self.bus = MCP230XX_I2CEmulator()
+        self.mcp = Adafruit_MCP230XX(address=0x27, num_gpios=16, i2c=self.bus)
+        # 2 writes of IODIR, 2 writes of GPPU and 2 reads of OLAT:
+        self.assertEqual(self.bus.transactions, 6)
+
+    def test_unbatched(self):
+        init_outputs(self.mcp)
+        # only changed direction bits are written, one write per pin:
+        self.assertEqual(self.bus.transactions, 14)
+        self.assertEqual(self.bus.regs[MCP23017_IODIRA], 0x00)
+        self.assertEqual(self.bus.regs[MCP23017_IODIRB], 0xFF)
+
+    def test_batched(self):
+        self.mcp.defer()
+        init_outputs(self.mcp)
+        self.mcp.flush()
+        # one 16 bit write of IODIR:
+        self.assertEqual(self.bus.transactions, 7)
+        self.assertEqual(self.bus.regs[MCP23017_IODIRA], 0x00)
+        self.assertEqual(self.bus.regs[MCP23017_IODIRB], 0xFF)
+
+    def test_unchanged_pin(self):
+        self.mcp.output(3, 0)
+        self.mcp.pullup(3, 0)
+        self.assertEqual(self.bus.transactions, 6)
+
+    def test_write8_then_output(self):
+        self.mcp.write8(0x5A)
+        self.mcp.output(0, 1)
+        self.mcp.output(9, 1)
+        self.assertEqual(self.bus.transactions, 9)
+        self.assertEqual(self.bus.regs[MCP23017_OLATA], 0x5B)
+        self.assertEqual(self.bus.regs[MCP23017_OLATB], 0x02)
+        self.assertEqual(self.mcp.outputvalue, 0x025B)
+
+    def test_write8_then_batched_output(self):
+        self.mcp.output(8, 1)
+        self.mcp.write8(0x5A)
+        self.mcp.defer()
+        self.mcp.output(9, 1)
+        self.mcp.flush()
+        self.assertEqual(self.bus.transactions, 9)
+        self.assertEqual(self.bus.regs[MCP23017_OLATA], 0x5A)
+        self.assertEqual(self.bus.regs[MCP23017_OLATB], 0x03)
+
+    def test_write8_in_batch(self):
+        self.mcp.defer()
+        self.mcp.output(1, 1)
+        self.mcp.write8(0x02)
+        self.mcp.flush()
+        # latch already equals shadow, nothing more is written:
+        self.assertEqual(self.bus.transactions, 7)
+        self.assertEqual(self.bus.regs[MCP23017_OLATA], 0x02)
+
+    def test_write8_mcp23008(self):
+        bus = MCP230XX_I2CEmulator()
+        mcp = Adafruit_MCP230XX(address=0x20, num_gpios=8, i2c=bus)
+        mcp.write8(0x81)
+        mcp.output(1, 1)
+        self.assertEqual(bus.regs[MCP23008_OLATA], 0x83)
+        self.assertEqual(mcp.outputvalue, 0x83)
+
+    def test_write16(self):
+        self.mcp.write16(0x1234)
+        # both latches in one transaction:
+        self.assertEqual(self.bus.transactions, 7)
+        self.assertEqual(self.bus.regs[MCP23017_OLATA], 0x34)
+        self.assertEqual(self.bus.regs[MCP23017_OLATB], 0x12)
+
+
+class TestBusError(unittest.TestCase):
+    def setUp(self):
+        self.bus = MCP230XX_I2CEmulator()
+        self.mcp = Adafruit_MCP230XX(address=0x27, num_gpios=16, i2c=self.bus)
+        init_outputs(self.mcp)
+
+    def test_resync_on_next_change(self):
+        self.bus.failwrites = 1
+        self.mcp.output(0, 1)
+        self.assertTrue(self.mcp.buserror)
+        self.assertEqual(self.bus.regs[MCP23017_OLATA], 0x00)
+        # shadow is read again from the chip before the next change:
+        self.mcp.output(1, 1)
+        self.assertFalse(self.mcp.buserror)
+        self.assertEqual(self.bus.regs[MCP23017_OLATA], 0x02)
+        self.assertEqual(self.mcp.outputvalue, 0x0002)
+        # failed change is done again, shadow does not hide it:
+        self.mcp.output(0, 1)
+        self.assertEqual(self.bus.regs[MCP23017_OLATA], 0x03)
+
+    def test_resync_on_next_batch(self):
+        self.mcp.defer()
+        self.mcp.output(0, 1)
+        self.mcp.config(8, 0)
+        self.bus.failwrites = 1
+        self.mcp.flush()
+        self.assertTrue(self.mcp.buserror)
+        self.assertEqual(self.bus.regs[MCP23017_OLATA], 0x00)
+        self.mcp.defer()
+        self.assertFalse(self.mcp.buserror)
+        self.assertEqual(self.mcp.outputvalue, 0x0000)
+        self.assertEqual(self.mcp.direction, 0xFE00)
+        self.mcp.output(0, 1)
+        self.mcp.flush()
+        self.assertEqual(self.bus.regs[MCP23017_OLATA], 0x01)
+
+    def test_no_resync_while_deferred(self):
+        self.mcp.defer()
+        self.mcp.output(2, 1)
+        self.bus.failwrites = 1
+        self.mcp.write8(0x04)
+        self.mcp.output(3, 1)
+        self.assertTrue(self.mcp.buserror)
+        # changes collected in shadow registers are kept:
+        self.mcp.flush()
+        self.assertEqual(self.bus.regs[MCP23017_OLATA], 0x0C)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim modeline: vim: shiftwidth=4 tabstop=4
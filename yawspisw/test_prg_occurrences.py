@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""
+Tests of prg_occurrences. Expanded waterings of randomized programs are
+compared with waterings found by repeated calls of prg_times (used by the
+scheduler) from range start, including programs with TimeFrom later than
+TimeTo.
+
+Run by: python -m unittest discover -p 'test_*.py'
+"""
+
+# imports:
+import random
+import unittest
+from datetime import datetime, timedelta
+import arrow
+import prg_times
+import prg_occurrences
+
+# number of randomized programs:
+SAMPLES = 1000
+# days of expanded range:
+RANGEDAYS = 30
+
+
+def stepped(prg, start, end):  # waterings found by prg_times
+    """ Return waterings found by repeated calls of prg_times from start.
+
+    \param prg dictionary of program, see prg_get_new
+    \param start datetime, range start (included)
+    \param end datetime, range end (excluded)
+    \return list of int wall times
+    """
+    res = []
+    t = start
+    while True:
+        if prg['Mode'] == 'weekly':
+            t = prg_times.weekly_next(t, prg['calwDays'], prg['calwRepeatH'],
+                                      (prg['TimeFromH'], prg['TimeFromM']),
+                                      (prg['TimeToH'], prg['TimeToM']))[0]
+        else:
+            t = prg_times.interval_next(prg['TimeLastRun'].naive, t,
+                                        prg['caliIntervalD'],
+                                        prg['caliRepeatH'],
+                                        (prg['TimeFromH'], prg['TimeFromM']),
+                                        (prg['TimeToH'], prg['TimeToM']))[0]
+        if t >= end:
+            return res
+        res.append(prg_occurrences.to_wall(t))
+        # the same as scheduler, next watering is searched one second later:
+        t = t + timedelta(seconds=1)
+
+
+def random_program(rnd):  # return random calendar program
+    repeath = rnd.choice([0.5, 1, 1.5, 2, 3, 5, 7.25, 12, 23.5, 30])
+    return {
+        'Enabled': True,
+        'Mode': rnd.choice(['weekly', 'interval']),
+        'calwDays': rnd.sample(range(1, 8), rnd.randint(1, 7)),
+        'calwRepeatH': repeath,
+        'caliIntervalD': rnd.randint(1, 10),
+        'caliRepeatH': repeath,
+        'TimeFromH': rnd.randint(0, 23),
+        'TimeFromM': rnd.randint(0, 59),
+        'TimeToH': rnd.randint(0, 23),
+        'TimeToM': rnd.randint(0, 59),
+        'TimeLastRun': arrow.get(2026, 1, 1).replace(
+            seconds=+rnd.randint(0, 86400 * 300)),
+    }
+
+
+class TestPrgOccurrences(unittest.TestCase):
+    def test_expand(self):
+        rnd = random.Random(3)
+        for i in range(SAMPLES):
+            prg = random_program(rnd)
+            start = prg['TimeLastRun'].naive + \
+                timedelta(seconds=rnd.randint(-86400 * 3, 86400 * 60))
+            if rnd.random() < 0.3:
+                # range from midnight, as forecast does:
+                start = datetime.combine(start.date(), datetime.min.time())
+            end = start + timedelta(days=RANGEDAYS)
+            ref = stepped(prg, start, end)
+            res = prg_occurrences.expand(prg, prg_occurrences.to_wall(start),
+                                         prg_occurrences.to_wall(end))
+            self.assertEqual(list(res), ref, '%s %s' % (prg, start))
+
+    def test_from_later_than_to(self):
+        prg = random_program(random.Random(4))
+        prg.update({
+            'Mode': 'weekly',
+            'calwDays': range(1, 8),
+            'TimeFromH': 22,
+            'TimeFromM': 0,
+            'TimeToH': 6,
+            'TimeToM': 0,
+        })
+        start = prg_occurrences.to_wall(datetime(2026, 3, 2, 8))
+        res = prg_occurrences.expand(prg, start,
+                                     start + 3 * prg_occurrences.DAY)
+        # day of start is skipped, as by prg_times:
+        self.assertEqual(list(res), [
+            prg_occurrences.to_wall(datetime(2026, 3, 3, 22)),
+            prg_occurrences.to_wall(datetime(2026, 3, 4, 22))])
+
+    def test_disabled(self):
+        prg = random_program(random.Random(5))
+        prg['Enabled'] = False
+        self.assertEqual(len(prg_occurrences.expand(prg, 0, 86400 * 30)), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim modeline: vim: shiftwidth=4 tabstop=4
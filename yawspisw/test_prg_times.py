@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+"""
+Tests of prg_times. Next watering times are compared with the previous
+implementation stepping day by day and repeat by repeat (kept here as
+reference) over randomized programs and start times, in UTC and in a time
+zone with daylight saving time.
+
+Run by: python -m unittest discover -p 'test_*.py'
+"""
+
+# imports:
+import random
+import unittest
+import arrow
+import prg_times
+
+# number of randomized programs per time zone:
+SAMPLES = 2000
+# time zones of tests:
+TIMEZONES = ('UTC', 'Europe/Prague')
+
+
+def ref_weekly_next(starttime, days, repeath, fromhm, tohm):  # reference
+    """ Previous loop implementation of prg_wee_next_water_time.
+
+    \param starttime arrow, next watering time is not sooner than starttime
+    \param days, repeath, fromhm, tohm see prg_times.weekly_next
+    \return tuple: (arrow, string)
+    """
+    reason = 'not valid day of week'
+    t = starttime
+    t = t.replace(hour=fromhm[0], minute=fromhm[1])
+    t = t.floor('minute')
+    if t.isoweekday() in days:
+        ts = t
+        while not ts >= starttime:
+            ts = ts.replace(hours=repeath)
+        if ts.day == t.day:
+            pvt = ts.replace(hour=tohm[0], minute=tohm[1])
+            pvt = pvt.floor('minute')
+            if ts <= pvt:
+                reason = 'not valid time of a day'
+                return (ts, reason)
+        reason = 'later than TimeTo'
+        t = t.replace(days=+1)
+    while not t.isoweekday() in days:
+        t = t.replace(days=+1)
+    return (t, reason)
+
+
+def ref_interval_next(lastrun, starttime, intervald, repeath, fromhm,
+                      tohm):  # reference
+    """ Previous loop implementation of prg_int_next_water_time, with valid
+    to time using TimeToM as minute (it used TimeToH).
+
+    \param lastrun arrow, time of last run of the program
+    \param starttime arrow, next watering time is not sooner than starttime
+    \param intervald, repeath, fromhm, tohm see prg_times.interval_next
+    \return tuple: (arrow, string)
+    """
+    t = lastrun
+    t = t.replace(hour=fromhm[0], minute=fromhm[1])
+    t = t.floor('minute')
+    while t.floor('day') < starttime.floor('day'):
+        t = t.replace(days=intervald)
+    if not t.day == starttime.day:
+        return (t, 'not valid day')
+    ts = t
+    while ts < starttime:
+        ts = ts.replace(hours=repeath)
+    pvt = starttime.replace(hour=tohm[0], minute=tohm[1])
+    pvt = pvt.floor('minute')
+    if ts > pvt:
+        t = t.replace(days=intervald)
+        return(t, 'later than TimeTo')
+    return(ts, 'not valid time of a day')
+
+
+def random_program(rnd):  # return random program parameters
+    p = {
+        'days': rnd.sample(range(1, 8), rnd.randint(1, 7)),
+        'intervald': rnd.randint(1, 10),
+        'repeath': rnd.choice([0.5, 1, 1.5, 2, 3, 5, 7.25, 12, 23.5, 30]),
+        'fromhm': (rnd.randint(0, 23), rnd.randint(0, 59)),
+        'tohm': (rnd.randint(0, 23), rnd.randint(0, 59)),
+    }
+    if rnd.random() < 0.3:
+        # valid to time is one of repeats:
+        tmp = p['fromhm'][0] * 60 + p['fromhm'][1] + \
+            int(p['repeath'] * 60) * rnd.randint(0, 4)
+        if tmp < 24 * 60:
+            p['tohm'] = (tmp // 60, tmp % 60)
+    return p
+
+
+def random_times(rnd, tz, p):  # return random last run and start time
+    # year with both changes of daylight saving time:
+    lastrun = arrow.get(2026, 1, 1).to(tz)
+    lastrun = lastrun.replace(seconds=+rnd.randint(0, 86400 * 300))
+    starttime = lastrun.replace(seconds=+rnd.randint(-86400 * 3,
+                                                     86400 * 100),
+                                microseconds=+rnd.randint(0, 999999))
+    # start also exactly at a minute, at valid from or valid to time:
+    tmp = rnd.random()
+    if tmp < 0.1:
+        starttime = starttime.floor('minute')
+    elif tmp < 0.2:
+        starttime = starttime.replace(hour=p['fromhm'][0],
+                                      minute=p['fromhm'][1]).floor('minute')
+    elif tmp < 0.3:
+        starttime = starttime.replace(hour=p['tohm'][0],
+                                      minute=p['tohm'][1]).floor('minute')
+    return (lastrun, starttime)
+
+
+class TestPrgTimes(unittest.TestCase):
+    def test_weekly_next(self):
+        rnd = random.Random(1)
+        for tz in TIMEZONES:
+            for i in range(SAMPLES):
+                p = random_program(rnd)
+                starttime = random_times(rnd, tz, p)[1]
+                ref = ref_weekly_next(starttime, p['days'], p['repeath'],
+                                      p['fromhm'], p['tohm'])
+                tmp = prg_times.weekly_next(starttime.naive, p['days'],
+                                            p['repeath'], p['fromhm'],
+                                            p['tohm'])
+                res = (arrow.Arrow.fromdatetime(tmp[0], starttime.tzinfo),
+                       tmp[1])
+                self.assertEqual(res, ref, '%s %s %s' % (tz, p, starttime))
+
+    def test_interval_next(self):
+        rnd = random.Random(2)
+        for tz in TIMEZONES:
+            for i in range(SAMPLES):
+                p = random_program(rnd)
+                lastrun, starttime = random_times(rnd, tz, p)
+                ref = ref_interval_next(lastrun, starttime, p['intervald'],
+                                        p['repeath'], p['fromhm'],
+                                        p['tohm'])
+                tmp = prg_times.interval_next(lastrun.naive, starttime.naive,
+                                              p['intervald'], p['repeath'],
+                                              p['fromhm'], p['tohm'])
+                res = (arrow.Arrow.fromdatetime(tmp[0], lastrun.tzinfo),
+                       tmp[1])
+                self.assertEqual(res, ref, '%s %s %s %s' % (tz, p, lastrun,
+                                                            starttime))
+
+    def test_invalid_programs(self):
+        starttime = arrow.get(2026, 3, 29).naive
+        self.assertRaises(NameError, prg_times.weekly_next, starttime, [],
+                          1, (6, 0), (20, 0))
+        self.assertRaises(NameError, prg_times.weekly_next, starttime, [1],
+                          0, (6, 0), (20, 0))
+        self.assertRaises(NameError, prg_times.interval_next, starttime,
+                          starttime, 0, 1, (6, 0), (20, 0))
+        self.assertRaises(NameError, prg_times.interval_next, starttime,
+                          starttime, 1, 0, (6, 0), (20, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim modeline: vim: shiftwidth=4 tabstop=4
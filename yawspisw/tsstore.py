@@ -0,0 +1,578 @@
+"""
+YawsPi time series store. Measured data are saved as fixed width binary
+records into append-only segment files, one directory per series. Records are
+read through mmap as numpy structured arrays, so no parsing of text is needed.
+
+Record is little endian packed '<qdB':
+1. t: int64, time in seconds since epoch
+2. v: float64, value
+3. k: uint8, kind of value, see KIND* constants
+
+For long time ranges every series has rollups, tiers of buckets of fixed
+length (hour, day) with minimum, maximum, sum and count of values and sum and
+count of fills in the bucket. Rollups are updated with every appended record.
+Closed buckets are appended to rollup files (datadir/name/3600.rollup), the
+open (last) bucket is kept in memory only and is computed again from records
+after start. Buckets are aligned to epoch (UTC).
+
+Old records can be removed (trim) and cold segments compressed by gzip
+(compress), rollups are kept. Segment covers at most one day, so both act on
+whole segments and the appended (last) segment is never changed. Files are
+always rewritten atomically (written to temporary file and renamed), so
+interrupted compaction loses no data.
+"""
+
+# imports:
+import os
+import struct
+import threading
+import gzip
+import numpy as np
+import arrow
+
+# kinds of values:
+KINDVALUE = 0   # measured value (water level, sensor value)
+KINDFILL = 1    # filled volume of a station
+# record format:
+RECORD = struct.Struct('<qdB')
+DTYPE = np.dtype([('t', '<i8'), ('v', '<f8'), ('k', 'u1')])
+# maximal number of records in one segment file:
+SEGMENTRECORDS = 65536
+# length of time covered by one segment in seconds (day), segments are
+# aligned to epoch (UTC) like rollups, so retention removes whole segments:
+SEGMENTPERIOD = 86400
+# suffix of segment files:
+SEGMENTSUFFIX = '.seg'
+# suffix of compressed segment files:
+COMPRESSEDSUFFIX = SEGMENTSUFFIX + '.gz'
+# suffix of temporary files:
+TMPSUFFIX = '.tmp'
+# lengths of buckets of rollups in seconds (hour, day):
+ROLLUPS = (3600, 86400)
+# bucket of rollup, min and max are nan if bucket contains only fills:
+ROLLUPDTYPE = np.dtype([('t', '<i8'), ('min', '<f8'), ('max', '<f8'),
+                        ('sum', '<f8'), ('n', '<u4'), ('fill', '<f8'),
+                        ('nf', '<u4')])
+# suffix of rollup files:
+ROLLUPSUFFIX = '.rollup'
+# time after all records:
+MAXTIME = 2 ** 62
+
+
+def rollup(data, period):  # compute buckets of records
+    """ Return buckets of rollup of records.
+
+    \param data numpy structured array with fields t, v, k sorted by time
+    \param period int, length of bucket in seconds
+    \return numpy structured array of ROLLUPDTYPE sorted by time
+    """
+    keys = data['t'] // period * period
+    starts = np.unique(keys)
+    out = np.zeros(len(starts), dtype=ROLLUPDTYPE)
+    if not len(starts):
+        return out
+    out['t'] = starts
+    index = np.searchsorted(starts, keys)
+    value = data['k'] == KINDVALUE
+    fill = data['k'] == KINDFILL
+    tmp = np.full(len(starts), np.inf)
+    np.minimum.at(tmp, index[value], data['v'][value])
+    out['min'] = tmp
+    tmp = np.full(len(starts), -np.inf)
+    np.maximum.at(tmp, index[value], data['v'][value])
+    out['max'] = tmp
+    out['sum'] = np.bincount(index[value], weights=data['v'][value],
+                             minlength=len(starts))
+    out['n'] = np.bincount(index[value], minlength=len(starts))
+    out['fill'] = np.bincount(index[fill], weights=data['v'][fill],
+                              minlength=len(starts))
+    out['nf'] = np.bincount(index[fill], minlength=len(starts))
+    out['min'][out['n'] == 0] = np.nan
+    out['max'][out['n'] == 0] = np.nan
+    return out
+
+
+class TimeSeriesStore:
+    """ Store of time series in binary segment files.
+
+    Every series is a directory datadir/name containing segment files named by
+    sequence number, e.g. 000000.seg, 000001.seg. New records are appended to
+    the last segment, new segment is started when new record belongs to
+    another SEGMENTPERIOD (day) than the last record, when the last segment
+    is full or if time of new record is earlier than time of the last record
+    (e.g. clock was set back), so records in every segment are sorted by
+    time. Range queries use first and last times of segments and binary
+    search inside segments.
+    """
+    def __init__(self, datadir):
+        """ Initialize class.
+
+        \param datadir string, directory with series
+        \return Nothing
+        """
+        self.datadir = datadir
+        # reentrant, rollups read records while locked:
+        self._lock = threading.RLock()
+        # opened last segments of series, tuples (file, number of records,
+        # time of last record):
+        self._files = {}
+        # first and last times of full segments, tuples (first, last) by path:
+        self._bounds = {}
+        # number of trims, changes position of all series:
+        self._trims = 0
+        # state of rollups by (name, period), dictionaries with open bucket
+        # (array of one bucket or None) and flag rollup must be rebuilt:
+        self._rollups = {}
+
+    def append(self, name, t, value, kind=KINDVALUE):  # append a record
+        """ Append a record to the series.
+
+        \param name string, name of series
+        \param t int, time in seconds since epoch
+        \param value float, value
+        \param kind int, kind of value, see KIND* constants
+        \return Nothing
+        """
+        t = int(t)
+        with self._lock:
+            f, count, last = self._open(name)
+            # load rollups before the record is written, so it is not counted
+            # twice:
+            rollups = [self._rollup_state(name, x, False) for x in ROLLUPS]
+            if count and (t < last or t // SEGMENTPERIOD !=
+                          last // SEGMENTPERIOD):
+                # new day, or time goes back (keeps segments sorted), start
+                # new segment:
+                f.close()
+                self._files.pop(name, None)
+                f, count, last = self._open_segment(name,
+                                                    self._last_seq(name) + 1)
+            f.write(RECORD.pack(t, float(value), kind))
+            # flush so readers see the record:
+            f.flush()
+            self._files[name] = (f, count + 1, t)
+            for i in range(len(ROLLUPS)):
+                self._rollup_add(name, ROLLUPS[i], rollups[i], t, value, kind)
+
+    def segments(self, name):  # return segment files of series
+        """ Return paths of segment files (plain or compressed) of series
+        sorted by sequence.
+
+        \param name string, name of series
+        \return list of strings
+        """
+        path = self._path(name)
+        if not os.path.isdir(path):
+            return []
+        return [os.path.join(path, x) for x in sorted(os.listdir(path))
+                if x.endswith(SEGMENTSUFFIX) or x.endswith(COMPRESSEDSUFFIX)]
+
+    def read(self, name):  # return all records of series
+        """ Return all records of series.
+
+        \param name string, name of series
+        \return numpy structured array with fields t, v, k
+        """
+        with self._lock:
+            parts = [self.read_segment(x) for x in self.segments(name)]
+        parts = [x for x in parts if len(x)]
+        if not parts:
+            return np.zeros(0, dtype=DTYPE)
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate(parts)
+
+    def read_range(self, name, tmin, tmax):  # return records in time range
+        """ Return records of series with time from tmin to tmax (both
+        included) sorted by time. Only segments overlapping the range are
+        read and only needed part of them is mapped into memory.
+
+        \param name string, name of series
+        \param tmin int, time in seconds since epoch
+        \param tmax int, time in seconds since epoch
+        \return numpy structured array with fields t, v, k
+        """
+        parts = []
+        with self._lock:
+            segments = self.segments(name)
+            for path in segments:
+                # only the last segment can still change:
+                bounds = self._segment_bounds(path, path != segments[-1])
+                if bounds is None or bounds[1] < tmin or bounds[0] > tmax:
+                    continue
+                data = self.read_segment(path)
+                start = np.searchsorted(data['t'], tmin, side='left')
+                end = np.searchsorted(data['t'], tmax, side='right')
+                if end > start:
+                    parts.append(data[start:end])
+        if not parts:
+            return np.zeros(0, dtype=DTYPE)
+        if len(parts) == 1:
+            return parts[0]
+        data = np.concatenate(parts)
+        # segments overlap in time if clock was set back:
+        if np.any(np.diff(data['t']) < 0):
+            data = data[np.argsort(data['t'], kind='mergesort')]
+        return data
+
+    def read_rollup(self, name, period, tmin, tmax):  # return rollup buckets
+        """ Return buckets of rollup of series overlapping time range from
+        tmin to tmax (both included) sorted by time, including the open
+        bucket.
+
+        \param name string, name of series
+        \param period int, length of bucket in seconds, one of ROLLUPS
+        \param tmin int, time in seconds since epoch
+        \param tmax int, time in seconds since epoch
+        \return numpy structured array of ROLLUPDTYPE
+        """
+        if period not in ROLLUPS:
+            raise NameError('unknown rollup period: ' + str(period))
+        # start of bucket containing tmin:
+        tmin = tmin // period * period
+        with self._lock:
+            state = self._rollup_state(name, period)
+            parts = []
+            data = self._rollup_read(self._rollup_path(name, period))
+            if len(data):
+                start = np.searchsorted(data['t'], tmin, side='left')
+                end = np.searchsorted(data['t'], tmax, side='right')
+                parts.append(np.array(data[start:end]))
+            bucket = state['Open']
+            if bucket is not None and tmin <= bucket['t'][0] <= tmax:
+                parts.append(bucket.copy())
+        if not parts:
+            return np.zeros(0, dtype=ROLLUPDTYPE)
+        return np.concatenate(parts)
+
+    def span(self, name):  # return time of first and last record
+        """ Return times of the first and the last record of series.
+
+        \param name string, name of series
+        \return tuple of ints (first, last), None if series is empty
+        """
+        with self._lock:
+            segments = self.segments(name)
+            bounds = [self._segment_bounds(x, x != segments[-1])
+                      for x in segments]
+        bounds = [x for x in bounds if x is not None]
+        if not bounds:
+            return None
+        return (min([x[0] for x in bounds]), max([x[1] for x in bounds]))
+
+    def position(self, name):  # return last write position of series
+        """ Return position of the last write of series, position changes
+        whenever a record is appended or removed.
+
+        \param name string, name of series
+        \return tuple (number of trims, number of segments, name of last
+        segment, size of last segment)
+        """
+        with self._lock:
+            segments = self.segments(name)
+            if not segments:
+                return (self._trims, 0, '', 0)
+            return (self._trims, len(segments),
+                    os.path.basename(segments[-1]),
+                    os.path.getsize(segments[-1]))
+
+    def trim(self, name, before, wait=None):  # remove old records
+        """ Remove records of series older than before. Rollups are
+        completed first, so they keep history of removed records. The last
+        segment is never changed, it is still appended to.
+
+        \param name string, name of series
+        \param before int, time in seconds since epoch, records with
+        earlier time are removed
+        \param wait function called before every change of a file (e.g. to
+        pause while hardware is busy), None if not needed
+        \return int number of removed records
+        """
+        with self._lock:
+            for period in ROLLUPS:
+                self._rollup_state(name, period)
+            segments = self.segments(name)[:-1]
+        removed = 0
+        for path in segments:
+            with self._lock:
+                bounds = self._segment_bounds(path, True)
+            if bounds is not None and bounds[0] >= before:
+                continue
+            if wait is not None:
+                wait()
+            data = self.read_segment(path)
+            keep = data[data['t'] >= before]
+            with self._lock:
+                if len(keep):
+                    self._write_file(path, keep)
+                else:
+                    os.remove(path)
+                self._bounds.pop(path, None)
+                self._trims += 1
+            removed += len(data) - len(keep)
+        return removed
+
+    def compress(self, name, before, wait=None):  # compress cold segments
+        """ Compress segments of series containing only records older than
+        before. The last segment is never compressed.
+
+        \param name string, name of series
+        \param before int, time in seconds since epoch
+        \param wait function called before every change of a file (e.g. to
+        pause while hardware is busy), None if not needed
+        \return int number of compressed segments
+        """
+        with self._lock:
+            segments = [x for x in self.segments(name)[:-1]
+                        if x.endswith(SEGMENTSUFFIX)]
+        count = 0
+        for path in segments:
+            with self._lock:
+                bounds = self._segment_bounds(path, True)
+            if bounds is not None and bounds[1] >= before:
+                continue
+            if wait is not None:
+                wait()
+            data = self.read_segment(path)
+            with self._lock:
+                self._write_file(path[:-len(SEGMENTSUFFIX)] +
+                                    COMPRESSEDSUFFIX, data)
+                os.remove(path)
+                self._bounds.pop(path, None)
+            count += 1
+        return count
+
+    def usage(self, name):  # return disk usage of series
+        """ Return disk usage of series.
+
+        \param name string, name of series
+        \return dictionary with keys Segments (int number of segment files),
+        Compressed (int number of compressed segment files), Records (int
+        number of records in not compressed segments), Bytes (int size of
+        segment files), Rollups (int size of rollup files)
+        """
+        res = {'Segments': 0, 'Compressed': 0, 'Records': 0, 'Bytes': 0,
+               'Rollups': 0}
+        with self._lock:
+            for path in self.segments(name):
+                size = os.path.getsize(path)
+                res['Segments'] += 1
+                res['Bytes'] += size
+                if path.endswith(COMPRESSEDSUFFIX):
+                    res['Compressed'] += 1
+                else:
+                    res['Records'] += size // DTYPE.itemsize
+            for period in ROLLUPS:
+                path = self._rollup_path(name, period)
+                if os.path.isfile(path):
+                    res['Rollups'] += os.path.getsize(path)
+        return res
+
+    def read_segment(self, path):  # return records of a segment file
+        """ Return records of a segment file mapped into memory, compressed
+        segment is read into memory. Incomplete record at the end of file
+        (interrupted write) is ignored.
+
+        \param path string, path of segment file
+        \return numpy structured array with fields t, v, k
+        """
+        if path.endswith(COMPRESSEDSUFFIX):
+            with gzip.open(path, 'rb') as f:
+                tmp = f.read()
+            count = len(tmp) // DTYPE.itemsize
+            return np.frombuffer(tmp, dtype=DTYPE, count=count)
+        count = os.path.getsize(path) // DTYPE.itemsize
+        if count == 0:
+            return np.zeros(0, dtype=DTYPE)
+        return np.memmap(path, dtype=DTYPE, mode='r', shape=(count,))
+
+    def close(self):  # close all opened files
+        with self._lock:
+            for f, count, last in self._files.values():
+                f.close()
+            self._files = {}
+
+    def migrate_csv(self, name, csvpath):  # convert old csv file to series
+        """ Convert csv data file (lines 'isotime; value' or 'isotime; value;
+        description') to series, only if series does not exist yet. Converted
+        csv file is renamed with suffix .migrated.
+
+        \param name string, name of series
+        \param csvpath string, path of csv file
+        \return int number of converted records
+        """
+        if not os.path.isfile(csvpath) or self.segments(name):
+            return 0
+        # parse whole file first, so broken file does not create series:
+        records = []
+        with open(csvpath) as f:
+            for line in f:
+                line = line.split(';')
+                if len(line) < 2:
+                    continue
+                kind = KINDVALUE
+                if len(line) > 2 and line[2].find('fill') > -1:
+                    kind = KINDFILL
+                records.append((arrow.get(line[0].strip()).timestamp,
+                                float(line[1]), kind))
+        # sort by time (stable), so only one segment is started per day:
+        records.sort(key=lambda x: x[0])
+        for record in records:
+            self.append(name, *record)
+        with self._lock:
+            if name in self._files:
+                self._files.pop(name)[0].close()
+        os.rename(csvpath, csvpath + '.migrated')
+        return len(records)
+
+    def _path(self, name):  # return directory of series
+        return os.path.join(self.datadir, name)
+
+    def _open(self, name):  # return opened last segment of series
+        if name in self._files:
+            f, count, last = self._files[name]
+            if count < SEGMENTRECORDS:
+                return (f, count, last)
+            # segment is full, start new one:
+            f.close()
+            del self._files[name]
+            return self._open_segment(name, self._last_seq(name) + 1)
+        path = self._path(name)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        return self._open_segment(name, max(0, self._last_seq(name)))
+
+    def _open_segment(self, name, seq):  # open segment for appending
+        path = os.path.join(self._path(name),
+                            '{:06d}'.format(seq) + SEGMENTSUFFIX)
+        size = 0
+        if os.path.isfile(path):
+            size = os.path.getsize(path)
+        if size // DTYPE.itemsize >= SEGMENTRECORDS:
+            # segment is full, start new one:
+            return self._open_segment(name, seq + 1)
+        f = open(path, 'ab')
+        # incomplete record at the end of file is skipped by readers, new
+        # records must start at record boundary:
+        if size % DTYPE.itemsize:
+            f.truncate(size - size % DTYPE.itemsize)
+        count = size // DTYPE.itemsize
+        last = 0
+        if count:
+            last = int(self.read_segment(path)['t'][-1])
+        return (f, count, last)
+
+    def _segment_bounds(self, path, final):  # return first and last time
+        if path in self._bounds:
+            return self._bounds[path]
+        data = self.read_segment(path)
+        if not len(data):
+            return None
+        bounds = (int(data['t'][0]), int(data['t'][-1]))
+        if final:
+            self._bounds[path] = bounds
+        return bounds
+
+    def _rollup_path(self, name, period):  # return path of rollup file
+        return os.path.join(self._path(name), str(period) + ROLLUPSUFFIX)
+
+    def _rollup_state(self, name, period, rebuild=True):  # return rollup state
+        key = (name, period)
+        state = self._rollups.get(key)
+        if state is not None and (not state['Stale'] or not rebuild):
+            return state
+        path = self._rollup_path(name, period)
+        if state is not None and os.path.isfile(path):
+            # some bucket before the open one changed, build again all buckets
+            # which still have records (older records could be trimmed):
+            span = self.span(name)
+            tmp = self._rollup_read(path)
+            if span is not None:
+                tmp = tmp[tmp['t'] < span[0] // period * period]
+            self._write_file(path, np.array(tmp))
+        if not os.path.isdir(self._path(name)):
+            os.makedirs(self._path(name))
+        size = 0
+        if os.path.isfile(path):
+            size = os.path.getsize(path)
+        since = 0
+        with open(path, 'ab') as f:
+            # remove incomplete bucket (interrupted write):
+            if size % ROLLUPDTYPE.itemsize:
+                f.truncate(size - size % ROLLUPDTYPE.itemsize)
+            tmp = self._rollup_read(path)
+            if len(tmp):
+                since = int(tmp['t'][-1]) + period
+            # buckets after the last closed one, the last of them is open:
+            buckets = rollup(self.read_range(name, since, MAXTIME), period)
+            f.write(buckets[:-1].tobytes())
+        state = {'Open': None, 'Stale': False}
+        if len(buckets):
+            state['Open'] = buckets[-1:].copy()
+        self._rollups[key] = state
+        return state
+
+    def _rollup_read(self, path):  # return closed buckets of rollup file
+        count = 0
+        if os.path.isfile(path):
+            count = os.path.getsize(path) // ROLLUPDTYPE.itemsize
+        if not count:
+            return np.zeros(0, dtype=ROLLUPDTYPE)
+        return np.memmap(path, dtype=ROLLUPDTYPE, mode='r', shape=(count,))
+
+    def _rollup_add(self, name, period, state, t, value, kind):  # add record
+        if state['Stale']:
+            # rollup will be rebuilt from records when read:
+            return
+        bucket = state['Open']
+        start = t // period * period
+        if bucket is not None and start < bucket['t'][0]:
+            # time goes back, closed bucket would change:
+            state['Stale'] = True
+            return
+        if bucket is None or start > bucket['t'][0]:
+            if bucket is not None:
+                # close bucket:
+                with open(self._rollup_path(name, period), 'ab') as f:
+                    f.write(bucket.tobytes())
+            bucket = np.zeros(1, dtype=ROLLUPDTYPE)
+            bucket['t'] = start
+            bucket['min'] = np.nan
+            bucket['max'] = np.nan
+            state['Open'] = bucket
+        value = float(value)
+        if kind == KINDVALUE:
+            if bucket['n'][0]:
+                bucket['min'] = min(bucket['min'][0], value)
+                bucket['max'] = max(bucket['max'][0], value)
+            else:
+                bucket['min'] = value
+                bucket['max'] = value
+            bucket['sum'] += value
+            bucket['n'] += 1
+        elif kind == KINDFILL:
+            bucket['fill'] += value
+            bucket['nf'] += 1
+
+    def _write_file(self, path, data):  # atomically write array to file
+        # compressed if path ends with COMPRESSEDSUFFIX
+        tmp = path + TMPSUFFIX
+        if path.endswith(COMPRESSEDSUFFIX):
+            f = gzip.open(tmp, 'wb')
+        else:
+            f = open(tmp, 'wb')
+        f.write(data.tobytes())
+        f.close()
+        # data must be on disk before rename:
+        fd = os.open(tmp, os.O_RDONLY)
+        os.fsync(fd)
+        os.close(fd)
+        os.rename(tmp, path)
+
+    def _last_seq(self, name):  # return sequence number of last segment
+        tmp = self.segments(name)
+        if not tmp:
+            return -1
+        return int(os.path.basename(tmp[-1]).split('.')[0])
+
+# vim modeline: vim: shiftwidth=4 tabstop=4
@@ -29,20 +29,58 @@
 # initialization
 
 # standard modules:
-from time import sleep
 import arrow
 import signal
 import sys
 import web
 import thread
-import pickle
 import os
+import re
+import urllib
 import pygal
+from time import time
+from datetime import datetime
 # gv - 'global vars' - an empty module, used for storing vars (as attributes),
 # that need to be 'global' across threads and between functions and classes:
 import gv
 # yawspi hardware control (hardware abstraction layer):
 from hw_control import YawspiHW
+# filling of stations in separate thread:
+from fill_jobs import FillExecutor
+# commands from web thread to main loop:
+from command_bus import CommandBus
+# start times of calendar programs:
+from scheduler import Scheduler
+import prg_times
+# cache of plan of programs:
+from plan_cache import PlanCache
+# forecast of water demand:
+from forecast import WaterForecast
+# binary store of measured data:
+import tsstore
+# reduction of chart points:
+import downsample
+# cache of rendered charts:
+import chart_cache
+# removing of old measured data and compression:
+import retention
+# buffer of log lines:
+from log_buffer import LogBuffer
+# log file limited by number of lines:
+from log_file import RotatingLog
+# structured log of important events:
+import events
+# atomic and background saving of settings:
+import persist
+
+# width of history charts in pixels (and maximal number of shown points):
+CHARTWIDTH = 800
+# minimal number of buckets of a rollup to use it instead of measured data:
+CHARTMINPOINTS = 200
+# number of log lines on one page:
+LOGPAGELINES = 200
+# maximal number of events on events page:
+EVENTSPAGE = 500
 
 
 # ------------------- various functions:
@@ -66,23 +104,26 @@ def get_now_str_web():  # returns current date/time as string for home web page
 def quit(reason):  # performs safe quit
     """ perform safe quit of the YAWSPI
 
-    1. switch water source off,
-    2. switch valves off,
+    1. cancel filling jobs,
+    2. switch water source, valves and sensors off,
     3. release GPIO,
-    4. save configuration, programs, hardware settings
-    5. write quitting to log
-    6. save log
+    4. stop compaction of data, close data files,
+    5. save configuration, programs, hardware settings and wait for writing
+    6. write quitting to log
+    7. save log
     \param string: reason why quitting
     \return Nothing
     """
-    gv.hw.so_switch(0)  # set water source off
-    for i in range(gv.hw.StNo):
-        gv.hw.st_switch(i, 0)  # switch valve off
+    gv.fills.stop(10)  # cancel filling and wait for it
+    gv.hw.all_off()  # set water source, valves and sensors off
     gv.hw.clean_up()  # cleans GPIO
+    gv.compactor.stop(10)  # stop compaction of data
+    gv.ts.close()  # close data files
     gs_save()  # save configuration
     prg_save()  # save programs
     hws_save()  # save hardware settings
-    log_add('quitting, ' + reason)
+    gv.saver.stop(10)  # write all settings now
+    event_add('system', 'quitting, ' + reason)
     log_save()  # save log
 
 
@@ -131,7 +172,7 @@ def check_and_set_time():  # check local and RTC time
     if arrow.utcnow().replace(weeks=-1) > gv.lastRTCupdate:
         lcl = arrow.utcnow()
         if not gv.hw.RTC_get_bat():
-            log_add(' <font color="red">RTC battery not OK!</font>')
+            event_add('system', 'RTC battery not OK!', 'error')
         if lcl < arrow.get(2000, 1, 1):
             # update local time
             gv.hw.RTC_set_local()
@@ -156,8 +197,10 @@ def init_gs():  # initialize dictionary with general settings:
         finished} XXX
     6. Logging: writing to log enabled
     7. LoggingLimit: maximal number of log lines to keep, 0 = no limit
-    8. MLInterval: Main loop interval (s) - how often watering and water levels
-        are checked.
+    8. MLInterval: Main loop interval (s) - how often water levels are
+        measured and water level programs are checked (calendar programs are
+        started by scheduler at their start times).
+    9. PlanHorizonD: number of days shown in plan of programs
     \param Nothing
     \return Nothing
     """
@@ -169,7 +212,8 @@ def init_gs():  # initialize dictionary with general settings:
         'Location': u'Brno',
         'Logging': True,
         'LoggingLimit': 1000,
-        'MLInterval': 60
+        'MLInterval': 60,
+        'PlanHorizonD': 14,
     }
 
 
@@ -190,6 +234,9 @@ def init_hws():  # initialize dictionary with hw settings:
         1. SaveData: boolean whether save measured data
     3. SeData: list of dictionaries containing:
         1. SaveData: ??? XXX
+    4. Retention: dictionary, number of days of kept measured data of every
+    station, source and sensor (by data name, see data_names), 0 means data
+    are kept forever (hourly and daily rollups are kept always)
     \param Nothing
     \return Nothing
     \todo{check if SeData SaveData is not duplicit, and what is the difference
@@ -203,6 +250,7 @@ def init_hws():  # initialize dictionary with hw settings:
         'SeData': {
             'SaveData': [],
         },
+        'Retention': dict([(x, 0) for x in data_names()]),
     }
     for x in range(gv.hw.StNo):
         gv.hws['StData'].append({
@@ -228,9 +276,13 @@ def init_cv():  # initialize dictionary with current values
     8. SePress: pressure weather sensor value
     9. SeIllum: illuminance weather sensor value
     10. CurAct: what is software now doing
-    11. xConstrain: x axis in history chart is constrained to xMin and xMax
-    11. xMin: arrow time last shown x minimal value in history chart
-    12. xMax: arrow time last shown x maximal value in history chart
+    11. SeLatency: dict with reading times of weather sensors (s)
+    12. CmdLatency: tuple with last and maximal delay of commands from web (s)
+    13. Forecast: dict with forecast of water demand for web, see
+    forecast_update
+    14. xConstrain: x axis in history chart is constrained to xMin and xMax
+    15. xMin: arrow time last shown x minimal value in history chart
+    16. xMax: arrow time last shown x maximal value in history chart
     \param Nothing
     \return Nothing
     """
@@ -245,6 +297,9 @@ def init_cv():  # initialize dictionary with current values
         'SePress': -300,
         'SeIllum': -300,
         'CurAct': '',
+        'SeLatency': {},
+        'CmdLatency': (0.0, 0.0),
+        'Forecast': {},
         'xConstrain': False,
         'xMin': arrow.now('local').replace(days=-2),
         'xMax': arrow.now('local'),
@@ -283,6 +338,8 @@ def prg_get_new():  # returns dict with a new program
     17. TimeFoundEmpty: arrow, first time when found all stations of the
     program empty (usefull only for waterlevel mode, is used only if
     'FoundEmpty' is True)
+    18. FillParallel: boolean, fill stations of the program at once (as many
+    as source allows), instead of one by one
     \param Nothing
     \return dict: default program dictionary
     """
@@ -305,7 +362,8 @@ def prg_get_new():  # returns dict with a new program
         'TimeToM': 0,
         'TimeLastRun': arrow.now('local').replace(days=-1),
         'FoundEmpty': False,
-        'TimeFoundEmpty': arrow.now('local')
+        'TimeFoundEmpty': arrow.now('local'),
+        'FillParallel': False,
     }
 
 
@@ -320,6 +378,7 @@ def prg_add():  # add a new program
     """
     # append new program:
     gv.prg.append(prg_get_new())
+    gv.plan.invalidate()
     # increase list with next watering time for web server:
     gv.cv['PrgNR'].append(arrow.now('local'))
 
@@ -333,18 +392,21 @@ def prg_remove(index):  # remove a program
     """
     # remove program:
     gv.prg.pop(index)
+    gv.plan.invalidate()
     # decrease list with next watering time for web server:
     gv.cv['PrgNR'].pop(index)
 
 
-def prg_is_water_time(index):  # return boolean if watering should start
+def prg_is_water_time(index, due=False):  # return boolean if watering should start
     """ finds if watering should start
 
-    Checks if program is enabled, than according program mode asks for watering
-    time later than now. Checks if watering time is_in_time_span. Adds log if
-    watering should start or not and why not
+    Checks if program is enabled, than according program mode checks water
+    levels (water level mode) or if program was found due by scheduler
+    (calendar modes, see prg_schedule). Adds log if watering should start or
+    not and why not
 
     \param int: index of the program
+    \param bool: due is True if scheduler found start time of calendar program
     \return bool: True if watering is due
     """
     prg = gv.prg[index]
@@ -355,10 +417,10 @@ def prg_is_water_time(index):  # return boolean if watering should start
     else:
         # if source empty, no action:
         if gv.cv['SoWL'] == 0:
-            log_add('program "' + prg['Name'] +
-                    '" (' + str(index) + '): ' +
-                    'not ready for watering, source is empty!'
-                    )
+            event_add('program', 'program "' + prg['Name'] +
+                      '" (' + str(index) + '): ' +
+                      'not ready for watering, source is empty!',
+                      'warning', program=index)
             return False
         now = arrow.now('local')
         isreadystr = 'program "' + prg['Name'] + \
@@ -374,32 +436,17 @@ def prg_is_water_time(index):  # return boolean if watering should start
             else:
                 gv.cv['PrgNR'][index] = td_format(tim)
             if tmp[2]:
-                log_add(isreadystr)
-                return True
-            else:
-                log_add(notreadystr + tmp[1])
-                return False
-        elif prg['Mode'] == 'weekly':
-            # weekly calendar mode:
-            tmp = prg_wee_next_water_time(index, now)
-            # generate next run in string for web:
-            gv.cv['PrgNR'][index] = td_format(tmp[0] - arrow.now('local'))
-            if is_in_time_span(index, now, tmp[0]):
-                log_add(isreadystr)
+                event_add('program', isreadystr, program=index)
                 return True
             else:
                 log_add(notreadystr + tmp[1])
                 return False
-        elif prg['Mode'] == 'interval':
-            # interval mode:
-            tmp = prg_int_next_water_time(index, now)
-            # generate next run in string for web:
-            gv.cv['PrgNR'][index] = td_format(tmp[0] - arrow.now('local'))
-            if is_in_time_span(index, now, tmp[0]):
-                log_add(isreadystr)
+        elif prg['Mode'] == 'weekly' or prg['Mode'] == 'interval':
+            # calendar modes, start time is found by scheduler:
+            if due:
+                event_add('program', isreadystr, program=index)
                 return True
             else:
-                log_add(notreadystr + tmp[1])
                 return False
         else:
             raise NameError('unknown program type')
@@ -458,133 +505,171 @@ def prg_lev_is_water_time(index, now):  # checks if is watering time
     return (now, 'ready for watering', True)
 
 
-def is_in_time_span(index, querytime, nextwatertime):  # times are equal?
-    """ Checks if two times are equal within precision given by main loop
-    interval gv.gs['MLInterval'].
-
-    Precision is two times of mail loop interval (MLI).
-    So True is returned if:
-        1, querytime is later than TimeLastRun + 2*MLI
-        1, querytime is later than nextwatertime - 2*MLI
-        1, querytime is earlier than nextwatertime + 2*MLI
-
-    \param int: index of program
-    \param arrow: querytime is time for which should be determined if it is
-    watering time
-    \param arrow: nextwatertime is watering time later than query time
-    \return bool: True if times equal
-    """
-    mli = gv.gs['MLInterval']
-    tlr = gv.prg[index]['TimeLastRun']
-    tmp = (
-        querytime > tlr.replace(seconds=2 * mli)
-        and
-        nextwatertime > querytime.replace(seconds=-2 * mli)
-        and
-        nextwatertime < querytime.replace(seconds=+2 * mli)
-    )
-    return tmp
-
-
 def prg_wee_next_water_time(index, starttime):  # returns next watering time
     """ Returns next watering time for program with weekend mode.
 
     Search for next watering time starts from starttime.
-    \param int: index of program
+    \param int: index of the program
     \param arrow: starttime after which next watering time is found
     \return tuple: (arrow, string), time of next watering, string with
     description why now is not next watering (in the case it is not).
     """
     prg = gv.prg[index]
-    # check variables to prevent infinite while loops:
-    if not bool(set(prg['calwDays']) & set(range(1, 8))):
-        raise NameError('program does not contain any valid weekdays!')
-    if not prg['calwRepeatH'] > 0:
-        raise NameError('program repeat hour is not greater than zero!')
-    reason = 'not valid day of week'
-    # prepare time pointer
-    t = starttime
-    t = t.replace(hour=prg['TimeFromH'], minute=prg['TimeFromM'])
-    t = t.floor('minute')
-    # is t (same day as starttime) the valid week day?
-    if t.isoweekday() in prg['calwDays']:
-        ts = t
-        # starttime is valid week of day,
-        # add repeat interval till bigger than starttime:
-        while not ts >= starttime:
-            ts = ts.replace(hours=prg['calwRepeatH'])
-        # if ts is still the same day as starttime:
-        if ts.day == t.day:
-            # if not later than 'program valid to' time:
-            pvt = ts.replace(hour=prg['TimeToH'], minute=prg['TimeToM'])
-            pvt = pvt.floor('minute')
-            if ts <= pvt:
-                # time of next watering time found, if ts is not the same as
-                # starttime, only reason can be:
-                reason = 'not valid time of a day'
-                return (ts, reason)
-        # date overflow, therefore starttime is later than TimeTo:
-        reason = 'later than TimeTo'
-        # add day and continue looking for valid weekday:
-        t = t.replace(days=+1)
-    # t is not valid weekday, add days till next valid weekday found:
-    while not t.isoweekday() in prg['calwDays']:
-        t = t.replace(days=+1)
-    # set hour and minute to 'program valid from'
-    return (t, reason)
+    tmp = prg_times.weekly_next(starttime.naive,
+                                prg['calwDays'],
+                                prg['calwRepeatH'],
+                                (prg['TimeFromH'], prg['TimeFromM']),
+                                (prg['TimeToH'], prg['TimeToM']))
+    return (arrow.Arrow.fromdatetime(tmp[0], starttime.tzinfo), tmp[1])
 
 
 def prg_int_next_water_time(index, starttime):  # returns next watering time
     """ Returns next watering time for program with interval mode.
 
-    Search for next watering time starts from TimeLastRun, than it search for
-    watering time later than starttime.
+    Valid days are day of TimeLastRun and every caliIntervalD days after it,
+    search for next watering time starts from starttime. After a change of
+    program TimeLastRun must be set to today minus caliIntervalD!
 
     \param int: index of program
     \param arrow: starttime after which next watering time is found
     \return tuple: (arrow, string), time of next watering, string with
     description why now is not next watering (in the case it is not).
     """
-    # searching starts from timelastrun. after a change of program a
-    # timelastrun must be set to now minus caliIntervalD!
-    # XXX not finished description - is it correct description?
+    prg = gv.prg[index]
+    tmp = prg_times.interval_next(prg['TimeLastRun'].naive,
+                                  starttime.naive,
+                                  prg['caliIntervalD'],
+                                  prg['caliRepeatH'],
+                                  (prg['TimeFromH'], prg['TimeFromM']),
+                                  (prg['TimeToH'], prg['TimeToM']))
+    return (arrow.Arrow.fromdatetime(tmp[0], prg['TimeLastRun'].tzinfo),
+            tmp[1])
+
+
+def prg_schedule(index):  # schedule next start of calendar program
+    """ Schedule next start of a calendar (weekly or interval) program.
+
+    Next start time is searched from now, but not sooner than one second after
+    last run of the program, so program is never started twice for the same
+    time. Disabled and water level programs are not scheduled, water level
+    programs are checked after every measuring of sensors.
+    \param int: index of the program
+    \return Nothing
+    """
+    prg = gv.prg[index]
+    if not prg['Enabled'] or not (prg['Mode'] == 'weekly' or
+                                  prg['Mode'] == 'interval'):
+        gv.sched.cancel(index)
+        return
+    now = arrow.now('local')
+    starttime = max(now, prg['TimeLastRun'].replace(seconds=+1))
+    tmp = prg_next_water_time(index, starttime)
+    gv.sched.schedule(index, tmp.float_timestamp)
+    # generate next run in string for web:
+    gv.cv['PrgNR'][index] = td_format(tmp - now)
 
+
+def prg_next_water_time(index, starttime):  # returns next watering time
+    """ Returns next watering time of calendar program (weekly or interval
+    mode) not sooner than starttime.
+
+    \param int: index of program
+    \param arrow: starttime after which next watering time is found
+    \return arrow: time of next watering
+    """
+    if gv.prg[index]['Mode'] == 'weekly':
+        return prg_wee_next_water_time(index, starttime)[0]
+    elif gv.prg[index]['Mode'] == 'interval':
+        return prg_int_next_water_time(index, starttime)[0]
+    raise NameError('program is not in calendar mode')
+
+
+def prg_schedule_all():  # schedule next starts of all programs
+    gv.sched.clear()
+    for i in range(len(gv.prg)):
+        prg_schedule(i)
+
+
+def prg_update_next_runs():  # update strings with next runs for web
+    now = arrow.now('local')
+    for i in range(len(gv.prg)):
+        when = gv.sched.when(i)
+        if when is not None:
+            gv.cv['PrgNR'][i] = td_format(
+                arrow.get(when).to('local') - now)
+
+
+def prg_demand(index):  # returns water and time needed by program
+    """ Returns volume of water and time needed by one run of program, if all
+    stations of the program are filled from empty to full.
+
+    Stations filled at once (FillParallel) take time of the slowest station of
+    every group of stations filled at once.
+    \param int: index of program
+    \return tuple: (float, float), volume in liters and time in seconds
+    """
     prg = gv.prg[index]
-    # check variables to prevent infinite while loops:
-    if not prg['caliIntervalD'] > 0:
-        raise NameError('program repeat day is not greater than zero!')
-    if not prg['caliRepeatH'] > 0:
-        raise NameError('program repeat hour is not greater than zero!')
-    # get a day of last run:
-    t = prg['TimeLastRun']
-    t = t.replace(hour=prg['TimeFromH'], minute=prg['TimeFromM'])
-    t = t.floor('minute')
-    # add days till found day greater or equal to starttime:
-    while t.floor('day') < starttime.floor('day'):
-        t = t.replace(days=prg['caliIntervalD'])
-    # found day is not equal to starttime?
-    if not t.day == starttime.day:
-        # found time is later day than starttime, return it:
-        return (t, 'not valid day')
-    # found day is equal to starttime, add hours till found time equal or
-    # greater than starttime
-    ts = t
-    while ts < starttime:
-        ts = ts.replace(hours=prg['caliRepeatH'])
-    pvt = starttime.replace(hour=prg['TimeToH'], minute=prg['TimeToH'])
-    # found time is greater then 'program valid to' time?
-    if ts > pvt:
-        # add caliIntervalD to previous found day and return it:
-        t = t.replace(days=prg['caliIntervalD'])
-        return(t,  'later than TimeTo')
-    # found time is not grater then 'program valid to' time, return it:
-    return(ts, 'not valid time of a day')
+    volume = 0
+    times = []
+    for st in prg['Stations']:
+        filltime = gv.hw.fill_time(st)
+        volume = volume + gv.hw.filled_volume(filltime)
+        # filling with settling of valve and source:
+        times.append(filltime + gv.hw.hwc['So']['SettleT'] +
+                     2 * gv.hw.hwc['St'][st]['SettleT'])
+    if prg.get('FillParallel', False):
+        group = max(1, gv.hw.hwc['So'].get('MaxParallel', 1))
+        times = [max(times[i:i + group])
+                 for i in range(0, len(times), group)]
+    return (volume, sum(times))
+
+
+def forecast_update():  # update forecast of water demand for web
+    """ Update forecast of water demand of calendar programs and prepare
+    values for web in gv.cv['Forecast'] dictionary:
+    1. Daily: list of tuples (string, float), day and liters drawn in the day
+    2. Total: float, liters drawn from now till end of plan horizon
+    3. Empty: string, time when source gets empty, empty if not during horizon
+    4. Overlaps: list of strings, waterings delayed because pump is used by
+    other program
+    5. OverlapsNo: int, number of all delayed waterings
+
+    \param Nothing
+    \return Nothing
+    """
+    sovolume = gv.hw.hwc['So']['Cap']
+    if sovolume != -1:
+        sovolume = gv.cv['SoWL'] * sovolume
+    res = gv.forecast.update(gv.prg,
+                             [prg_demand(i) for i in range(len(gv.prg))],
+                             arrow.now('local'),
+                             gv.gs['PlanHorizonD'],
+                             sovolume)
+    tmp = {
+        'Daily': [(arrow.get(x[0]).format('ddd YYYY-MM-DD'), x[1])
+                  for x in res['Daily']],
+        'Total': res['Total'],
+        'Empty': '',
+        'Overlaps': [arrow.get(x[0]).to('local').format('YYYY-MM-DD HH:mm') +
+                     ' ' + gv.prg[x[1]]['Name'] + ' delayed by ' +
+                     '{:.1f}'.format(x[2]) + ' s'
+                     for x in res['Overlaps']],
+        'OverlapsNo': res['OverlapsNo'],
+    }
+    if res['Empty'] is not None:
+        tmp['Empty'] = arrow.get(res['Empty']).to('local').format(
+            'YYYY-MM-DD HH:mm')
+    gv.cv['Forecast'] = tmp
 
 
 def prg_water(index):  # starts watering all stations in the program
     # fill stations in program:
-    for st in gv.prg[index]['Stations']:
-        station_fill(st)
+    if gv.prg[index].get('FillParallel', False) and \
+            len(gv.prg[index]['Stations']) > 1:
+        stations_fill_submit(gv.prg[index]['Stations'])
+    else:
+        for st in gv.prg[index]['Stations']:
+            station_fill_submit(st)
     # save time of filling:
     gv.prg[index]['TimeLastRun'] = arrow.now('local')
     # set that station was not yet found empty:
@@ -594,42 +679,53 @@ def prg_water(index):  # starts watering all stations in the program
 
 # ------------------- configurations saving and loading:
 def gs_load():  # load configuration file
-    # general settings:
-    if os.path.isfile(gv.gsfilepath):
-        # if file exist load it:
-        gsfile = open(gv.gsfilepath, 'r')
-        gv.gs = pickle.load(gsfile)
-        gsfile.close()
-        log_add('general settings loaded from file')
+    # general settings (from backup if file is broken):
+    tmp, path = persist.load(gv.gsfilepath)
+    if tmp is not None:
+        # settings missing in older file are set to default values:
+        init_gs()
+        gv.gs.update(tmp)
+        log_add('general settings loaded from file ' + path)
     else:
         # if file do not exist initialize standard settings:
         init_gs()
         log_add('general settings initialized to default values')
 
 
+def save_report(what, error):  # log result of writing of settings
+    """ Write result of writing of settings file to log, called by writing
+    thread of gv.saver.
+
+    \param string: description of saved settings
+    \param string: description of error, empty if written successfully
+    \return Nothing
+    """
+    if error:
+        event_add('system', 'saving of ' + what + ' failed: ' + error,
+                  'error')
+    else:
+        log_add(what + ' saved to file')
+
+
 def gs_save():  # save configuration file
-    # general settings:
-    if not os.path.isdir(gv.configdir):
-        os.mkdir(gv.configdir)
-    gsfile = open(gv.gsfilepath, 'w')
-    pickle.dump(gv.gs, gsfile)
-    gsfile.close()
-    log_add('general settings saved to file')
+    # general settings, written atomically by background thread:
+    gv.saver.save(gv.gsfilepath, gv.gs, lambda x: save_report('general settings', x))
 
 
 def hws_load():  # load hardware settings file
-    # general settings:
-    if os.path.isfile(gv.hwsfilepath):
-        # if file exist load it:
-        hwsfile = open(gv.hwsfilepath, 'r')
-        gv.hws = pickle.load(hwsfile)
-        hwsfile.close()
+    # hardware settings (from backup if file is broken):
+    tmp, path = persist.load(gv.hwsfilepath)
+    if tmp is not None:
+        # settings missing in older file are set to default values:
+        init_hws()
+        gv.hws['Retention'].update(tmp.pop('Retention', {}))
+        gv.hws.update(tmp)
         if len(gv.hws['StData']) != gv.hw.StNo:
             raise NameError('Number of stations in hardware settings file '
                             'do not match hardware configuration file. '
                             'Probably hardware settings pickle file should be '
                             'deleted?')
-        log_add('hardware settings loaded from file')
+        log_add('hardware settings loaded from file ' + path)
     else:
         # if file do not exist initialize standard settings:
         init_hws()
@@ -637,23 +733,16 @@ def hws_load():  # load hardware settings file
 
 
 def hws_save():  # save hardware settings to a file
-    # hardware settings:
-    if not os.path.isdir(gv.configdir):
-        os.mkdir(gv.configdir)
-    hwsfile = open(gv.hwsfilepath, 'w')
-    pickle.dump(gv.hws, hwsfile)
-    hwsfile.close()
-    log_add('hardware settings saved to file')
+    # hardware settings, written atomically by background thread:
+    gv.saver.save(gv.hwsfilepath, gv.hws, lambda x: save_report('hardware settings', x))
 
 
 def prg_load():  # load program file
-    # general settings:
-    if os.path.isfile(gv.prgfilepath):
-        # if file exist load it:
-        prgfile = open(gv.prgfilepath, 'r')
-        gv.prg = pickle.load(prgfile)
-        prgfile.close()
-        log_add('programs loaded from file')
+    # programs (from backup if file is broken):
+    tmp, path = persist.load(gv.prgfilepath)
+    if tmp is not None:
+        gv.prg = tmp
+        log_add('programs loaded from file ' + path)
     else:
         # if file do not exist initialize standard settings:
         gv.prg = []
@@ -661,23 +750,14 @@ def prg_load():  # load program file
 
 
 def prg_save():  # save program file
-    # general settings:
-    if not os.path.isdir(gv.configdir):
-        os.mkdir(gv.configdir)
-    prgfile = open(gv.prgfilepath, 'w')
-    pickle.dump(gv.prg, prgfile)
-    prgfile.close()
-    log_add('programs saved to file')
+    # programs, written atomically by background thread:
+    gv.saver.save(gv.prgfilepath, gv.prg, lambda x: save_report('programs', x))
 
 
 # ------------------- watering data related:
-def check_data_folder():  # check folder with data files (creates it if needed)
-    if not os.path.isdir(gv.datadir):
-        os.mkdir(gv.datadir)
-
-
 def data_filename(dname):  # returns file path and name of measured data
-    """ Return file path and name of file with measured data
+    """ Return file path and name of csv file with measured data (used before
+    binary time series store, see data_migrate)
 
     \param string name containing number of station or source or sensor
     \return string path and name of data file
@@ -694,93 +774,140 @@ def data_filename(dname):  # returns file path and name of measured data
                         + str(dname))
 
 
+def data_names():  # returns names of data of all stations, source, sensors
+    return [str(i) for i in range(gv.hw.StNo)] + ['source'] + \
+        list(gv.hw.Sensors)
+
+
+def data_description(dname):  # returns description of data for user
+    if dname == 'source':
+        return 'water source'
+    if dname in gv.hw.Sensors:
+        return {
+            'temp': 'ambient temperature',
+            'humid': 'ambient humidity',
+            'press': 'ambient pressure',
+            'rain': 'rain',
+            'illum': 'ambient light',
+        }.get(dname, dname)
+    return gv.hws['StData'][int(dname)]['Name'] + ' (' + dname + ')'
+
+
+def data_usage():  # returns disk usage of all data
+    """ Returns disk usage of measured data of all stations, source and
+    sensors together with results of the last compaction.
+
+    \param Nothing
+    \return tuple (list, dictionary), list of dictionaries, see
+    TimeSeriesStore.usage, with added keys Name (data name), Description,
+    Removed (number of records removed by the last compaction) and
+    NewCompressed (number of segments compressed by the last compaction), and
+    dictionary with sums of Bytes and Rollups of all data
+    """
+    res = []
+    total = {'Bytes': 0, 'Rollups': 0}
+    for dname in data_names():
+        tmp = gv.ts.usage(dname)
+        tmp['Name'] = dname
+        tmp['Description'] = data_description(dname)
+        tmp['Removed'] = gv.compactor.Removed.get(dname, 0)
+        tmp['NewCompressed'] = gv.compactor.Compressed.get(dname, 0)
+        res.append(tmp)
+        total['Bytes'] += tmp['Bytes']
+        total['Rollups'] += tmp['Rollups']
+    return (res, total)
+
+
+def data_retention():  # returns retention policies of all data
+    """ Returns number of days of kept measured data of all stations, source
+    and sensors, used by compaction thread.
+
+    \param Nothing
+    \return dictionary with int number of days by data name, 0 means forever
+    """
+    return dict([(x, gv.hws['Retention'].get(x, 0)) for x in data_names()])
+
+
+def data_migrate():  # convert old csv data files into time series store
+    """ Convert csv data files of all stations, source and sensors into binary
+    time series store. Every file is converted only once, converted files are
+    renamed with suffix .migrated.
+
+    \param Nothing
+    \return Nothing
+    """
+    for dname in data_names():
+        count = gv.ts.migrate_csv(dname, data_filename(dname))
+        if count:
+            log_add('data file of ' + dname + ' converted to time series, ' +
+                    str(count) + ' records')
+
+
 def save_station_level(index, value):  # save water level of a station
-    if index in range(gv.hw.StNo):
-        # saving data for this station enabled?:
-        if gv.hws['StData'][index]['SaveData']:
-            save_station_data_line(index, str(value) + '; water level (a. u.)')
+    save_station_data(index, value, tsstore.KINDVALUE)
 
 
 def save_station_fill(index, value):  # save filled volume of a station
     # value is filled volume in liters
-    if index in range(gv.hw.StNo):
-        # saving data for this station enabled?:
-        if gv.hws['StData'][index]['SaveData']:
-            save_station_data_line(index, str(value) + '; fill volume (l)')
+    save_station_data(index, value, tsstore.KINDFILL)
 
 
-def save_station_data_line(index, string):  # save w. level/filling of station
-    """ Save measured water level or filling amount of a station to a file
-    together with time stamp, only if enabled by settings.
+def save_station_data(index, value, kind):  # save w. level/filling of station
+    """ Save measured water level or filling amount of a station to a time
+    series together with time stamp, only if enabled by settings.
 
     \param int index with number of station
-    \param str string with value and water level or filling information and
-    unit
+    \param float value of water level or filled volume
+    \param int kind of value, tsstore.KINDVALUE for water level or
+    tsstore.KINDFILL for filled volume
     \return Nothing
     """
-    check_data_folder()
     if index in range(gv.hw.StNo):
         # saving data for this station enabled?:
         if gv.hws['StData'][index]['SaveData']:
-            datafile = open(data_filename(str(index)), 'a')
-            tmp = arrow.now('local').isoformat() + '; ' + string + '\n'
-            datafile.writelines(tmp)
-            datafile.close()
+            gv.ts.append(str(index), time(), value, kind)
 
 
 def save_source_level(value):  # save source water level
-    """ Save measured water level of a source to a file together with
+    """ Save measured water level of a source to a time series together with
     time stamp, only if enabled by settings.
 
     \param float value of source water level
     \return Nothing
     """
-    check_data_folder()
     # saving data for source enabled?:
     if gv.hws['SoData']['SaveData']:
-        datafile = open(data_filename('source'), 'a')
-        tmp = arrow.now('local').isoformat() + '; ' + str(value) + '\n'
-        datafile.writelines(tmp)
-        datafile.close()
+        gv.ts.append('source', time(), value)
 
 
 def save_sensor_value(dname, value):  # save measured sensor value
-    """ Save measured value of a sensor to a file together with time stamp,
-    only if enabled by settings.
+    """ Save measured value of a sensor to a time series together with time
+    stamp, only if enabled by settings.
 
     \param str name of sensor
     \param float value of sensor
     \return Nothing
     """
-    check_data_folder()
     if dname in gv.hw.Sensors:
         # save data for this sensor enabled?:
         if dname in gv.hws['SeData']['SaveData']:
-            datafile = open(data_filename(dname), 'a')
-            tmp = arrow.now('local').isoformat() + '; ' + str(value) + '\n'
-            datafile.writelines(tmp)
-            datafile.close()
+            gv.ts.append(dname, time(), value)
 
 
-def load_data_file(dname):  # loads data from data file
-    """ Loads data from saved data file with history of station, sensor or
-    source.
+def load_data_file(dname, tmin=None, tmax=None):  # loads data of station etc.
+    """ Loads data from time series with history of station, sensor or
+    source. If tmin and tmax are given, only data in this time range are
+    loaded.
 
     \param str name of station, sensor or source
-    \return list of lists: [arrow time, value, whole data line]
+    \param arrow tmin start of time range
+    \param arrow tmax end of time range
+    \return numpy structured array with fields t (int time in seconds since
+    epoch), v (float value) and k (int kind of value, see tsstore)
     """
-    data = []
-    if os.path.isfile(data_filename(dname)):
-        # file should be closed automatically when using with statement
-        with open(data_filename(dname)) as f:
-            for line in f:
-                # parse and convert data:
-                line = line.split(';')
-                line[0] = arrow.get(line[0])
-                line[1] = float(line[1])
-                # parse possible other data
-                data.append(line)
-    return data
+    if tmin is None or tmax is None:
+        return gv.ts.read(dname)
+    return gv.ts.read_range(dname, tmin.timestamp, tmax.timestamp)
 
 
 def check_data_name(dname):  # checks string is station or sensor or source
@@ -823,10 +950,8 @@ def make_chart(name, constrain, xmin, xmax):  # generate history chart
     # check input:
     if not check_data_name(name):
         return 'Unknown station or sensor'
-    # measured data:
-    data = load_data_file(name)
-    ax1 = []
-    ax2 = []
+    # measured data or rollups, apply constrains:
+    ax1, ax2, axmin, axmax = chart_series(name, constrain, xmin, xmax)
     # secondary axis will be used?
     secondY = False
     # set values according what to plot
@@ -835,18 +960,6 @@ def make_chart(name, constrain, xmin, xmax):  # generate history chart
         gtitle = gv.hws['StData'][int(name)]['Name'] + \
             ' (' + str(name) + ')'
         y1title = 'water level (a. u.)'
-        # parse station data:
-        for tmp in data:
-            if tmp[2].find('level') > -1:
-                # found water level data, apply constrains:
-                if (constrain and tmp[0] >= xmin and tmp[0] <= xmax) \
-                        or (not constrain):
-                    ax1.append((tmp[0].datetime, tmp[1]))
-            elif tmp[2].find('fill') > -1:
-                # found water filling data, apply constrains:
-                if (constrain and tmp[0] >= xmin and tmp[0] <= xmax) \
-                        or (not constrain):
-                    ax2.append((tmp[0].datetime, tmp[1]))
         if len(ax2) > 0:
             y2title = 'fill volume (l)'
             secondY = True
@@ -873,14 +986,9 @@ def make_chart(name, constrain, xmin, xmax):  # generate history chart
         else:
             # not identified what to plot (shouldn't happen, just for sure):
             raise NameError('Error - unknown string in name in make_chart')
-        # change arrow datatype to datetime:
-        for tmp in data:
-            # apply constrains:
-            if (constrain and tmp[0] >= xmin and tmp[0] <= xmax) or \
-                    (not constrain):
-                ax1.append((tmp[0].datetime, tmp[1]))
     # initialize chart:
     chart = pygal.DateTimeLine(style=pygal.style.CleanStyle,
+                               width=CHARTWIDTH,
                                legend_at_bottom=True,
                                print_values=False,
                                show_x_guides=True,
@@ -896,6 +1004,10 @@ def make_chart(name, constrain, xmin, xmax):  # generate history chart
                                )
     # create line:
     chart.add('water level', ax1, fill=True)
+    if axmin:
+        # range of values in buckets of rollup:
+        chart.add('minimum', axmin, show_dots=False)
+        chart.add('maximum', axmax, show_dots=False)
     if secondY:
         # add sedondary line and setup axes:
         chart.add('filling',
@@ -912,100 +1024,391 @@ def make_chart(name, constrain, xmin, xmax):  # generate history chart
     return chart.render()
 
 
+def chart_key(name, constrain, xmin, xmax):  # return key of history chart
+    """ Returns key describing everything the history chart depends on, for
+    the cache of charts and entity tag of the history chart page.
+
+    \param string name - number of station or source or sensors
+    \param bool constrain if true use xmin and xmax as time range
+    \param arrow xmin start of time range
+    \param arrow xmax end of time range
+    \return tuple
+    """
+    title = ''
+    if name in [str(i) for i in range(gv.hw.StNo)]:
+        title = gv.hws['StData'][int(name)]['Name']
+    if not constrain:
+        xmin = xmax = None
+    else:
+        xmin = xmin.isoformat()
+        xmax = xmax.isoformat()
+    return (name, title, constrain, xmin, xmax, gv.ts.position(name))
+
+
+def cached_chart(name, constrain, xmin, xmax):  # return history chart
+    """ Returns history chart from cache, chart is generated only if data
+    or time range changed since the chart was generated last time.
+
+    \param string name - number of station or source or sensors
+    \param bool constrain if true use xmin and xmax as time range
+    \param arrow xmin start of time range
+    \param arrow xmax end of time range
+    \return string xml/svg chart for embedding into webpage
+    """
+    key = chart_key(name, constrain, xmin, xmax)
+    chart = gv.charts.get(key)
+    if chart is None:
+        chart = make_chart(name, constrain, xmin, xmax)
+        gv.charts.put(key, chart)
+    return chart
+
+
+def chart_series(name, constrain, xmin, xmax):  # return lines of chart
+    """ Returns lines of history chart of station or sensor or source.
+    Coarsest rollup (daily, hourly) which still gives at least CHARTMINPOINTS
+    points for the time range is used, so long time ranges do not read all
+    measured data. Measured data are used for short time ranges. Fillings
+    are shown as they were measured if there are at most CHARTWIDTH of them,
+    otherwise as volumes filled in buckets of the rollup.
+
+    \param string name - number of station or source or sensors
+    \param bool constrain if true use xmin and xmax as time range
+    \param arrow xmin start of time range
+    \param arrow xmax end of time range
+    \return tuple of lists of points (values, fills, minimums, maximums),
+    minimums and maximums are empty if measured data are shown
+    """
+    span = gv.ts.span(name)
+    if span is None:
+        return ([], [], [], [])
+    tmin, tmax = span
+    if constrain:
+        tmin = max(tmin, xmin.timestamp)
+        tmax = min(tmax, xmax.timestamp)
+    # choose rollup:
+    period = 0
+    for tmp in sorted(tsstore.ROLLUPS, reverse=True):
+        if (tmax - tmin) // tmp >= CHARTMINPOINTS:
+            period = tmp
+            break
+    if not period:
+        # measured data, fillings are rare and all of them are shown:
+        if constrain:
+            data = load_data_file(name, xmin, xmax)
+        else:
+            data = load_data_file(name)
+        return (chart_points(data[data['k'] == tsstore.KINDVALUE], True),
+                chart_points(data[data['k'] == tsstore.KINDFILL]),
+                [], [])
+    data = gv.ts.read_rollup(name, period, tmin, tmax)
+    # points are in the middle of buckets:
+    values = data[data['n'] > 0]
+    t = values['t'] + period // 2
+    fills = data[data['nf'] > 0]
+    if fills['nf'].sum() <= CHARTWIDTH:
+        fills = chart_fills(name, fills['t'].tolist(), period, tmin, tmax)
+    else:
+        fills = chart_xy(fills['t'] + period // 2, fills['fill'])
+    return (chart_xy(t, values['sum'] / values['n']),
+            fills,
+            chart_xy(t, values['min']),
+            chart_xy(t, values['max']))
+
+
+def chart_fills(name, starts, period, tmin, tmax):  # return fills of chart
+    """ Returns points of fillings in buckets of rollup. Only records of
+    buckets with fillings are read, neighbouring buckets at once.
+
+    \param string name - number of station or source or sensors
+    \param list of int starts of buckets with fillings sorted by time
+    \param int period length of bucket in seconds
+    \param int tmin start of time range
+    \param int tmax end of time range
+    \return list of tuples (datetime, float)
+    """
+    res = []
+    i = 0
+    while i < len(starts):
+        j = i + 1
+        while j < len(starts) and starts[j] == starts[j - 1] + period:
+            j += 1
+        data = gv.ts.read_range(name, max(starts[i], tmin),
+                                min(starts[j - 1] + period - 1, tmax))
+        res.extend(chart_points(data[data['k'] == tsstore.KINDFILL]))
+        i = j
+    return res
+
+
+def chart_xy(t, v):  # convert arrays of times and values to points of chart
+    return [(datetime.fromtimestamp(x), y)
+            for x, y in zip(t.tolist(), v.tolist())]
+
+
+def chart_points(data, reduce=False):  # convert data to points of chart
+    """ Convert time series data to list of points for pygal chart.
+    If reduce is True, number of points is reduced to width of chart by
+    Largest-Triangle-Three-Buckets algorithm.
+
+    \param numpy structured array with fields t and v, see load_data_file
+    \param bool reduce number of points
+    \return list of tuples (datetime, float)
+    """
+    if reduce and len(data) > CHARTWIDTH:
+        data = data[downsample.lttb(data['t'], data['v'], CHARTWIDTH)]
+    return chart_xy(data['t'], data['v'])
+
+
 # ------------------- log related:
 def log_add(line):  # add string to a log buffer
     if gv.gs['Logging']:
-        # add time to the log line:
-        tmp = '<br>' + arrow.now('local').isoformat() + '; ' + line + '\n'
-        # hopefully this is atomic operation so no collisions between threads
-        # can occur:
-        gv.logbuffer = gv.logbuffer + [tmp]
+        # time is added to the line when the line is written:
+        gv.logbuffer.add(line)
 
 
 def log_save():  # saves log to a file
     # this function should be called only from main thread (not webserver
-    # thread) to prevent thread collisions
+    # thread), so the log file is written by one thread only
     # write only if buffer is not empty:
     if gv.gs['Logging'] and len(gv.logbuffer) > 0:
         if not os.path.isdir(gv.configdir):
             os.mkdir(gv.configdir)
-        if os.path.isfile(gv.prgfilepath):
-            logfile = open(gv.logfilepath, 'a')
-        else:
-            logfile = open(gv.logfilepath, 'w')
-        # this is not atomic XXX! :
-        tmp = gv.logbuffer
-        gv.logbuffer = []
-        # write buffer to a file:
-        logfile.writelines(tmp)
-        logfile.close()
-        # XXX how to limit lines in log file?
-
-
-def log_get():  # returns full log (load file and add buffer)
-    tmp = ['']
-    if gv.gs['Logging'] and os.path.isfile(gv.logfilepath):
-        logfile = open(gv.logfilepath, 'r')
-        # read file and append actual buffer:
-        tmp = logfile.readlines() + gv.logbuffer
-        logfile.close()
-    return tmp
+        # take lines out of buffer, lines added meanwhile stay in buffer:
+        tmp = gv.logbuffer.drain()
+        # write buffer to a file, old lines over the limit are removed:
+        gv.log.write(tmp, gv.gs['LoggingLimit'])
+
+
+def log_page(count, cursor=None, kind='', index=''):  # returns log lines
+    """ Returns newest lines of log (actual buffer and log files) older than
+    cursor, log files are read from the end, so only needed part of log is
+    read.
+
+    \param int count maximal number of lines
+    \param tuple cursor of older lines returned by previous call, None for
+    the newest lines
+    \param string kind 'station' or 'program' to show only lines of one
+    station or program, empty string for all lines
+    \param string index of station or program
+    \return tuple (list of strings, cursor), lines from the newest and cursor
+    of older lines, None if there are no older lines
+    """
+    if not gv.gs['Logging']:
+        return ([], None)
+    match = None
+    if kind:
+        # e.g. 'station "name" (2)' or 'program 2', names are removed first,
+        # so number in name (e.g. 'station "station 1" (3)') does not match:
+        regex = re.compile(r'\b' + kind + r' (?:"" \(' + index + r'\)|' +
+                           index + r'\b)')
+        match = lambda x: regex.search(re.sub(r'"[^"]*"', '""', x)) is not None
+    res = []
+    if cursor is None:
+        # lines not written to file yet:
+        res = [x for x in reversed(gv.logbuffer.lines())
+               if match is None or match(x)]
+        if len(res) >= count:
+            # older lines of buffer are shown after they are written:
+            return (res[:count], gv.log.end())
+    tmp, cursor = gv.log.tail(count - len(res), cursor, match)
+    return (res + tmp, cursor)
+
+
+def event_time(event):  # returns time of event for web
+    return arrow.get(event['t']).to('local').format('DD. MM. YYYY HH:mm:ss')
+
+
+def event_add(kind, text, severity='info', program=None, station=None,
+              **values):  # add event to event log and log
+    """ Adds event to structured event log (see events.EventLog) and line to
+    log, warnings and errors are highlighted in log.
+
+    \param string kind of event, e.g. fill, program, system, user
+    \param string text description of event (plain text)
+    \param string severity, one of events.SEVERITIES
+    \param int program index or None
+    \param int or list of int station index(es) or None
+    \param values other values of event, e.g. volume
+    \return Nothing
+    """
+    gv.events.add(kind, text, severity, program, station, **values)
+    if severity == 'info':
+        log_add(text)
+    else:
+        log_add('<font color="red">' + text + '</font>')
 
 
 # ------------------- hardware related functions:
-# (can be called only from main thread)
+# (can be called only from main thread or from filling thread)
 def sensors_get_all():  # measures water levels of barrel and all stations
     gv.cv['CurAct'] = 'reading sensors'
     if __name__ != "__main__":
         raise NameError('sensors_get_all() called outside main thread!')
+    # read all water level sensors at once:
+    levels = gv.hw.se_level_all()
     # get source water level:
-    gv.cv['SoWL'] = gv.hw.so_level()
+    gv.cv['SoWL'] = levels[-1]
     save_source_level(gv.cv['SoWL'])
     log_add('water source is ' + str(gv.cv['SoWL'] * 100) + '% full')
     # stations water level:
     for i in range(gv.hw.StNo):
         # XXX tady dat threshold (nebo nekam jinam)?
-        gv.cv['StWL'][i] = gv.hw.se_level(i)
+        gv.cv['StWL'][i] = levels[i]
         save_station_level(i, gv.cv['StWL'][i])
         log_add('station "' + gv.hws['StData'][i]['Name'] + '" (' + str(i) +
                 ') is ' + str(gv.cv['StWL'][i] * 100) + '% full')
-    # weather sensors:
-    gv.cv['SeTemp'] = gv.hw.se_temp()
+    # weather sensors, all read concurrently:
+    se = gv.hw.se_ambient_all()
+    gv.cv['SeTemp'] = se['temp']
     save_sensor_value('temp', gv.cv['SeTemp'])
-    gv.cv['SeHumid'] = gv.hw.se_humid()
+    gv.cv['SeHumid'] = se['humid']
     save_sensor_value('humid', gv.cv['SeHumid'])
-    gv.cv['SeRain'] = gv.hw.se_rain()
+    gv.cv['SeRain'] = se['rain']
     save_sensor_value('rain', gv.cv['SeRain'])
-    gv.cv['SePress'] = gv.hw.se_press()
+    gv.cv['SePress'] = se['press']
     save_sensor_value('press', gv.cv['SePress'])
-    gv.cv['SeIllum'] = gv.hw.se_illum()
+    gv.cv['SeIllum'] = se['illum']
     save_sensor_value('illum', gv.cv['SeIllum'])
+    gv.cv['SeLatency'] = dict(gv.hw.SeLatency)
 
 
-def station_fill(index):  # fill water into one station
-    gv.cv['CurAct'] = 'filling station ' + str(index)
+def station_fill_submit(index):  # add filling of a station to fill jobs
+    """ Add filling of a station to the queue of filling jobs, if the station
+    is not already waiting for filling.
+
+    \param int index of station
+    \return Nothing
+    """
+    name = 'filling station "' + gv.hws['StData'][index]['Name'] + \
+        '" (' + str(index) + ')'
+    if gv.fills.pending(name):
+        log_add(name + ' already waiting')
+        return
+    expected = gv.hw.fill_time(index)
+    # hard limit: safety bound of st_fill, settle times and some reserve:
+    timeout = expected * 1.1 + gv.hw.hwc['So']['SettleT'] + \
+        2 * gv.hw.hwc['St'][index]['SettleT'] + 10
+    gv.fills.submit(name, lambda job: station_fill(index, job['Cancel']),
+                    expected, timeout)
+
+
+def station_fill(index, cancel=None):  # fill water into one station
     # XXX st_fill by mel vracet i odhadnuty objem, a ten pak ukladat do dat
     if __name__ != "__main__":
-        raise NameError('station_fill() called outside main thread!')
-    log_add('preparing to fill station "' + gv.hws['StData'][i]['Name'] +
+        raise NameError('station_fill() called outside main program!')
+    log_add('preparing to fill station "' + gv.hws['StData'][index]['Name'] +
             '" (' + str(index) + ')')
     # get filling time in seconds according to station capacity:
     filltime = gv.hw.fill_time(index)
     # set sssafety bound to 10 %:
     filltime = filltime * 1.1
     try:
-        realfilltime = gv.hw.st_fill(index, gv.hws['StData'][index]['HighThr'])
+        realfilltime = gv.hw.st_fill(index,
+                                     gv.hws['StData'][index]['HighThr'],
+                                     cancel=cancel)
     except:   # XXX tohle je mozna blbost, try mozna uvnitr station fill?
-        gv.hw.so_switch(0)
+        gv.hw.all_off()
+        event_add('fill', 'error when filling station ' + str(index) + '!',
+                  'error', station=index)
         raise NameError('Error when filling station!')
-    tmp = 'station "' + gv.hws['StData'][i]['Name'] + '" (' + str(index) + \
-          ') was filled, filled volume (calculated from time) was ' + \
-          str(gv.hw.filled_volume(realfilltime)) + ' l, filling time was ' + \
-          str(realfilltime) + ' s, time limit was ' + str(filltime) + ' s'
-    if realfilltime > filltime:
+    station_fill_report(index, gv.hw.filled_volume(realfilltime),
+                        realfilltime, filltime, gv.hw.LastFill)
+
+
+def stations_fill_submit(indexes):  # add filling of stations at once
+    """ Add filling of several stations at once to the queue of filling jobs,
+    if the stations are not already waiting for filling.
+
+    \param list of int indexes of stations
+    \return Nothing
+    """
+    name = 'filling stations ' + ', '.join(
+        ['"' + gv.hws['StData'][i]['Name'] + '" (' + str(i) + ')'
+         for i in indexes])
+    if gv.fills.pending(name):
+        log_add(name + ' already waiting')
+        return
+    # stations can be filled by groups, every group takes as long as the
+    # slowest station of the group:
+    maxparallel = max(1, gv.hw.hwc['So'].get('MaxParallel', 1))
+    expected = 0
+    timeout = 0
+    for i in range(0, len(indexes), maxparallel):
+        group = indexes[i:i + maxparallel]
+        tmp = max([gv.hw.fill_time(x) for x in group]) * len(group)
+        expected = expected + tmp
+        # hard limit: safety bound, settle times and some reserve:
+        timeout = timeout + tmp * 1.1 + gv.hw.hwc['So']['SettleT'] + \
+            2 * max([gv.hw.hwc['St'][x]['SettleT'] for x in group]) + 10
+    gv.fills.submit(name, lambda job: stations_fill(indexes, job['Cancel']),
+                    expected, timeout)
+
+
+def stations_fill(indexes, cancel=None):  # fill water into stations at once
+    if __name__ != "__main__":
+        raise NameError('stations_fill() called outside main program!')
+    log_add('preparing to fill stations ' + ', '.join(
+        ['"' + gv.hws['StData'][i]['Name'] + '" (' + str(i) + ')'
+         for i in indexes]) + ' at once')
+    try:
+        fills = gv.hw.st_fill_multi(
+            indexes,
+            [gv.hws['StData'][i]['HighThr'] for i in indexes],
+            cancel=cancel)
+    except:
+        gv.hw.all_off()
+        event_add('fill', 'error when filling stations ' + str(indexes) +
+                  '!', 'error', station=list(indexes))
+        raise NameError('Error when filling stations!')
+    for fill in fills:
+        # flow is split between valves, so limit is volume, not time:
+        station_fill_report(fill['Index'], fill['Volume'], fill['FillTime'],
+                            None, fill)
+
+
+def station_fill_report(index, volume, realfilltime, filltime, fill):
+    """ Save filled volume of a station and log the result of filling.
+
+    \param int index of station
+    \param float filled volume in liters, calculated from filling time or
+    estimated from flow rate when filled together with other stations
+    \param float real filling time in seconds
+    \param float time limit of filling in seconds, None if filling was
+    limited by estimated volume
+    \param dict result of filling, see YawspiHW.LastFill
+    \return Nothing
+    """
+    if filltime is None:
+        # volume of filling together was integrated from flow rate:
+        tmp = 'estimated from flow rate'
+    else:
+        tmp = 'calculated from time'
+    tmp = 'station "' + gv.hws['StData'][index]['Name'] + '" (' + \
+          str(index) + ') was filled, filled volume (' + tmp + ') ' + \
+          'was ' + str(volume) + \
+          ' l, filling time was ' + str(realfilltime) + ' s'
+    if filltime is None:
+        tmp = tmp + ', filled together with other stations'
+    else:
+        tmp = tmp + ', time limit was ' + str(filltime) + ' s'
+    severity = 'info'
+    if fill['Reason'] == 'full':
+        tmp = tmp + ', full detected within ' + \
+            '{:.0f}'.format(fill['Latency'] * 1000) + ' ms'
+    elif fill['Reason'] == 'source empty':
+        tmp = tmp + ', source is empty!'
+        severity = 'warning'
+    elif fill['Reason'] == 'cancelled':
+        tmp = tmp + ', filling was cancelled'
+    elif fill['Reason'] == 'time' and filltime is None:
+        tmp = tmp + ', volume limit reached'
+    exceeded = filltime is not None and realfilltime > filltime
+    if exceeded:
         tmp = tmp + ', time limit EXCEEDED!'
-    save_station_fill(i, gv.hw.filled_volume(realfilltime))
-    log_add(tmp)
+        severity = 'warning'
+    save_station_fill(index, volume)
+    event_add('fill', tmp, severity, station=index, volume=volume,
+              filltime=realfilltime, limit=filltime, reason=fill['Reason'],
+              exceeded=exceeded)
 
 
 # ------------------- web pages definitions:
@@ -1024,16 +1427,21 @@ class WebHome:  # home page with status informations
             'programs': '/programs',
             'history': '/history',
             'log': '/log',
+            'events': '/events',
             'reboot': '/reboot',
         }
         if response.keys()[0] in simpleredirect:
             raise web.seeother(simpleredirect[response.keys()[0]])
         elif 'breakmainloop' in response:
-            # user required for main loop break, add flag:
-            if not 'askforbreak' in gv.flags:
-                gv.flags = gv.flags + ['askforbreak']
+            # user required for main loop break, send command:
+            gv.cmd.post('break')
             # reload this page
             raise web.seeother('/')
+        elif 'cancelfill' in response:
+            # stop filling and remove waiting fillings:
+            gv.fills.cancel()
+            event_add('user', 'filling cancelled by user')
+            raise web.seeother('/')
         elif 'start' in response:
             gv.gs['Enabled'] = 1
             raise web.seeother('/')
@@ -1074,11 +1482,11 @@ class WebOptions:  # options page to change settings
             ),
             web.form.Textbox(
                 'LoggingLimit',
-                web.form.Validator('(integer greater than 0)',
-                                   lambda x: int(x) > 0),
+                web.form.Validator('(integer 0 and greater)',
+                                   lambda x: int(x) >= 0),
                 description='Limit logs to number of lines:',
                 title='Maximal number of lines in the log, usefull ' +
-                'to prevent large files.'
+                'to prevent large files. 0 means no limit.'
             ),
             web.form.Textbox(
                 'MLInterval',
@@ -1088,6 +1496,13 @@ class WebOptions:  # options page to change settings
                 title='How often YAWSPI checks for water levels and ' +
                 'if watering is due',
             ),
+            web.form.Textbox(
+                'PlanHorizonD',
+                web.form.Validator('(integer greater than 0)',
+                                   lambda x: int(x) > 0),
+                description='Plan of programs for days:',
+                title='Number of days shown in plan of programs.',
+            ),
             web.form.Checkbox(
                 'SourceData',
                 description='Save source water level data:',
@@ -1129,6 +1544,7 @@ class WebOptions:  # options page to change settings
         frm.Logging.checked = gv.gs['Logging']
         frm.LoggingLimit.value = gv.gs['LoggingLimit']
         frm.MLInterval.value = gv.gs['MLInterval']
+        frm.PlanHorizonD.value = gv.gs['PlanHorizonD']
         frm.SourceData.checked = gv.hws['SoData']['SaveData']
         frm.TempData.checked = 'temp' in gv.hws['SeData']['SaveData']
         frm.HumidData.checked = 'humid' in gv.hws['SeData']['SaveData']
@@ -1149,6 +1565,8 @@ class WebOptions:  # options page to change settings
                 frm.Location.value = response['Location']
                 frm.Logging.checked = 'Logging' in response
                 frm.LoggingLimit.value = response['LoggingLimit']
+                frm.MLInterval.value = response['MLInterval']
+                frm.PlanHorizonD.value = response['PlanHorizonD']
                 return render.options(gv, frm)
             else:
                 # write new values to global variables:
@@ -1158,6 +1576,7 @@ class WebOptions:  # options page to change settings
                 gv.gs['Logging'] = 'Logging' in response
                 gv.gs['LoggingLimit'] = int(response['LoggingLimit'])
                 gv.gs['MLInterval'] = int(response['MLInterval'])
+                gv.gs['PlanHorizonD'] = int(response['PlanHorizonD'])
                 gv.hws['SeData']['SaveData'] = []
                 gv.hws['SoData']['SaveData'] = 'SourceData' in response
                 if 'TempData' in response:
@@ -1199,21 +1618,80 @@ class WebReboot:  # show reboot question
 
 class WebLog:  # show log
     def GET(self):
-        tmp = log_get()
-        #reverse list and serialize it:
-        # XXX zkusit pres [8:0:-1]
-        tmp.reverse()
-        tmp = ''.join(tmp)
-        return render.log(tmp)
+        response = web.input(older='', kind='', index='')
+        # cursor of page and filter of lines:
+        cursor = None
+        kind = ''
+        index = ''
+        try:
+            if response['older']:
+                cursor = tuple([int(x) for x in response['older'].split(':')])
+            if response['kind'] in ('station', 'program') and \
+                    response['index'].isdigit():
+                kind = response['kind']
+                index = response['index']
+        except ValueError:
+            raise web.seeother('/log')
+        if cursor is not None and len(cursor) != 2:
+            raise web.seeother('/log')
+        lines, cursor = log_page(LOGPAGELINES, cursor, kind, index)
+        older = ''
+        if cursor is not None:
+            older = 'log?' + urllib.urlencode({
+                'older': str(cursor[0]) + ':' + str(cursor[1]),
+                'kind': kind,
+                'index': index,
+            })
+        web.header('Content-Type', 'text/html; charset=UTF-8')
+        # page is sent by parts, not joined into one string:
+        return self.stream(render.log(kind, index), lines,
+                           render.logend(older))
+
+    def stream(self, head, lines, end):  # yield parts of page
+        yield unicode(head)
+        for i in range(0, len(lines), 50):
+            yield ''.join(lines[i:i + 50])
+        yield unicode(end)
 
     def POST(self):
         response = web.input()  # get user response
         if 'reload' in response:  # if reload pressed, reload page
             raise web.seeother('/log')
+        if 'filter' in response:  # show lines of station or program
+            raise web.seeother('/log?' + urllib.urlencode({
+                'kind': response.get('kind', ''),
+                'index': response.get('index', ''),
+            }))
         # if cancel or any unknown response, go to home page:
         raise web.seeother('/')
 
 
+class WebEvents:  # query of events
+    def GET(self):
+        response = web.input(kind='', station='', program='', severity='',
+                             days='', exceeded='')
+        # filters, invalid values are ignored:
+        query = {}
+        if response['kind']:
+            query['kind'] = response['kind']
+        if response['station'].isdigit():
+            query['station'] = int(response['station'])
+        if response['program'].isdigit():
+            query['program'] = int(response['program'])
+        if response['severity'] in events.SEVERITIES:
+            query['severity'] = response['severity']
+        if response['days'].isdigit():
+            query['tmin'] = time() - int(response['days']) * 86400
+        if response['exceeded']:
+            query['where'] = {'exceeded': True}
+        found = gv.events.query(limit=EVENTSPAGE, **query)
+        return render.events(gv, response, found, event_time)
+
+    def POST(self):
+        # if back or any unknown response, go to home page:
+        raise web.seeother('/')
+
+
 class WebStations:  # shows list of stations
     def GET(self):
         return render.stations(gv)
@@ -1223,10 +1701,8 @@ class WebStations:  # shows list of stations
         for i in range(gv.hw.StNo):
             if str(i) in response:
                 return web.seeother('changestation' + str(i))
-            flag = 'askforrun' + str(i)
-            if flag in response:
-                if not flag in gv.flags:
-                    gv.flags = gv.flags + [flag]
+            if 'askforrun' + str(i) in response:
+                gv.cmd.post('run', Index=i)
                 raise web.seeother('/')
         # if cancel or any unknown response, go to home page:
         raise web.seeother('/')
@@ -1336,6 +1812,8 @@ class WebPrograms:  # shows list of programs
         if response.keys()[0] in ['r' + str(i) for i in range(len(gv.prg))]:
             # remove program and reload page:
             prg_remove(int(response.keys()[0][1:]))
+            # indexes of programs changed, schedule all again:
+            gv.cmd.post('reschedule', Index=None)
             return web.seeother('programs')
         # if cancel or any unknown response, go to home page:
         raise web.seeother('/')
@@ -1435,6 +1913,9 @@ class WebChangeProgram:  # change program settings
                                    lambda x: int(x) <= 59),
                 size="3",
             ),
+            web.form.Checkbox(
+                'FillParallel',
+            ),
         )
 
     def GET(self, indexstr):
@@ -1460,6 +1941,8 @@ class WebChangeProgram:  # change program settings
             frm.TimeFromM.value = gv.prg[index]['TimeFromM']
             frm.TimeToH.value = gv.prg[index]['TimeToH']
             frm.TimeToM.value = gv.prg[index]['TimeToM']
+            frm.FillParallel.checked = gv.prg[index].get('FillParallel',
+                                                         False)
         else:
             # incorrect program, set to -1, web template will report error:
             index = -1
@@ -1491,6 +1974,7 @@ class WebChangeProgram:  # change program settings
                     frm.TimeFromM.value = response['TimeFromM']
                     frm.TimeToH.value = response['TimeToH']
                     frm.TimeToM.value = response['TimeToM']
+                    frm.FillParallel.checked = 'FillParallel' in response
                     return render.changeprogram(gv, frm, index, indexstr)
                 else:
                 # write new values to global variables:
@@ -1542,6 +2026,7 @@ class WebChangeProgram:  # change program settings
                                 pass
                     # sort and remove duplicates:
                     p['Stations'] = list(set(sorted(tmp)))
+                    p['FillParallel'] = 'FillParallel' in response
                     gv.prg[index] = p
                     # log change:
                     log_add('settings of program ' + str(index)
@@ -1549,6 +2034,9 @@ class WebChangeProgram:  # change program settings
                             + ' was changed by user')
                     # save configuration
                     prg_save()
+                    gv.plan.invalidate()
+                    # main loop should find new start time of program:
+                    gv.cmd.post('reschedule', Index=index)
                     raise web.seeother('/programs')
             else:
                 index = -1
@@ -1558,49 +2046,13 @@ class WebChangeProgram:  # change program settings
         raise web.seeother('/programs')
 
 
-class WebCheckPrograms:  # shows plan of programs for next 2 weeks
+class WebCheckPrograms:  # shows plan of programs
     def GET(self):
         # plan from now:
         tstart = arrow.now('local')
-        # till next two weeks:
-        tmax = tstart.replace(weeks=2)
-        lst = []
-        for i in range(len(gv.prg)):
-            if gv.prg[i]['Enabled'] and gv.prg[i]['Mode'] != 'waterlevel':
-                # generate next waterings
-                t = tstart
-                # to prevent infinite loop:
-                cnt = 0
-                while t < tmax:
-                    # to prevent infinite loop:
-                    cnt = cnt + 1
-                    if cnt > 1400:
-                        raise NameError('Too many waterings in two weeks,' +
-                                        ' probably internal error')
-                    # get next watering according program mode:
-                    if gv.prg[i]['Mode'] == 'weekly':
-                        tmp = prg_wee_next_water_time(i, t)
-                    elif gv.prg[i]['Mode'] == 'interval':
-                        tmp = prg_int_next_water_time(i, t)
-                    # create a line of the resulting web table:
-                    s = tmp[0].format('YYYY-MM-DD HH:mm:ss ddd') + \
-                        ':&nbsp&nbsp&nbsp&nbsp&nbsp&nbsp </td><td>' + \
-                        gv.prg[i]['Name']
-                    lst.append(s)
-                    # add second to move in programs:
-                    t = tmp[0].replace(seconds=+1)
-        # sort the list (it is year-month-date-time, so sorting of strings
-        # gives required result)
-        lst.sort()
-        # string to embed in web page:
-        s = ''
-        for i in range(len(lst)):
-            # create full html table:
-            s = s + '<tr><td>' + lst[i] + '</td></tr>'
-        if len(s) == 0:
-            s = 'No programs exists, or only water level programs enabled ' + \
-                '(these are not shown), or all programs are disabled.'
-        return render.checkprograms(s)
+        # till horizon of plan:
+        tmax = tstart.replace(days=gv.gs['PlanHorizonD'])
+        return render.checkprograms(gv, gv.plan.get(gv.prg, tstart, tmax))
 
     def POST(self):
         raise web.seeother('/programs')
@@ -1612,10 +2064,52 @@ class WebHistory:  # to select history of what
 
     def POST(self):
         response = web.input()  # get user response
+        if 'data' in response:
+            raise web.seeother('data')
         # XXX check here correct web? not needed really
         return web.seeother('historychart' + response.keys()[0])
 
 
+class WebData:  # disk usage and retention of measured data
+    def frm(self):
+        # one field for every station, source and sensor:
+        fields = []
+        for dname in data_names():
+            fields.append(web.form.Textbox(
+                dname,
+                web.form.Validator('(integer 0 and greater)',
+                                   lambda x: int(x) >= 0),
+                description=data_description(dname) + ':',
+                title='Number of days of kept measured data, 0 means ' +
+                'data are kept forever. Hourly and daily averages are ' +
+                'kept always.',
+                size="5",
+            ))
+        return web.form.Form(*fields)()
+
+    def GET(self):
+        frm = self.frm()
+        for dname in data_names():
+            frm[dname].value = gv.hws['Retention'].get(dname, 0)
+        return render.data(gv, frm, *data_usage())
+
+    def POST(self):
+        frm = self.frm()
+        response = web.input()  # get user response
+        if 'submit' in response:
+            if not frm.validates():  # if not validated
+                for dname in data_names():
+                    frm[dname].value = response[dname]
+                return render.data(gv, frm, *data_usage())
+            for dname in data_names():
+                gv.hws['Retention'][dname] = int(response[dname])
+            log_add('retention of data changed by user')
+            hws_save()
+            raise web.seeother('data')
+        # if cancel or any unknown response, go to history page:
+        raise web.seeother('history')
+
+
 class WebHistoryChart:  # chart with history and xaxis change
     def __init__(self):
         self.frm = web.form.Form(  # definitions of all input fields
@@ -1700,9 +2194,16 @@ class WebHistoryChart:  # chart with history and xaxis change
         frm.xmaxD.value = gv.cv['xMax'].day
         frm.xmaxH.value = gv.cv['xMax'].hour + gv.cv['xMax'].minute / 60 + \
             gv.cv['xMax'].second / 3600
+        # browser always asks if page changed, page not changed if chart and
+        # form values are the same (raises 304 Not Modified). form shows
+        # xMin and xMax also if chart is not constrained to them:
+        web.header('Cache-Control', 'no-cache')
+        web.modified(etag=chart_cache.etag(chart_key(
+            dname, gv.cv['xConstrain'], gv.cv['xMin'], gv.cv['xMax']) +
+            tuple((i.name, str(i.value)) for i in frm.inputs)))
         # get chart:
-        chartstr = make_chart(dname, gv.cv['xConstrain'],
-                              gv.cv['xMin'], gv.cv['xMax'])
+        chartstr = cached_chart(dname, gv.cv['xConstrain'],
+                                gv.cv['xMin'], gv.cv['xMax'])
         # render web page:
         return render.historychart(frm, chartstr)
 
@@ -1773,8 +2274,8 @@ class WebHistoryChart:  # chart with history and xaxis change
                 gv.cv['xMax'].minute / 60 + \
                 gv.cv['xMax'].second / 3600
         # get chart:
-        chartstr = make_chart(dname, gv.cv['xConstrain'],
-                              gv.cv['xMin'], gv.cv['xMax'])
+        chartstr = cached_chart(dname, gv.cv['xConstrain'],
+                                gv.cv['xMin'], gv.cv['xMax'])
         # render web page:
         return render.historychart(frm, chartstr)
 
@@ -1786,8 +2287,10 @@ urls = (
     '/options', 'WebOptions',
     '/reboot', 'WebReboot',
     '/log', 'WebLog',
+    '/events', 'WebEvents',
     '/history', 'WebHistory',
     '/historychart(.*)', 'WebHistoryChart',
+    '/data', 'WebData',
     '/stations', 'WebStations',
     '/changestation(.*)', 'WebChangeStation',
     '/programs', 'WebPrograms',
@@ -1806,8 +2309,19 @@ if __name__ == "__main__":
     gv.hwsfilepath = gv.configdir + "/hws.pkl"
     gv.prgfilepath = gv.configdir + "/prg.pkl"
     gv.logfilepath = gv.configdir + "/log.txt"
-    gv.logbuffer = []
-    gv.flags = []
+    gv.logbuffer = LogBuffer()
+    gv.log = RotatingLog(gv.logfilepath)
+    gv.events = events.EventLog(gv.configdir + '/events')
+    # settings are saved by background thread:
+    gv.saver = persist.Saver()
+    # commands from web thread to main loop:
+    gv.cmd = CommandBus()
+    # start times of calendar programs:
+    gv.sched = Scheduler()
+    # plan of calendar programs for web:
+    gv.plan = PlanCache(prg_next_water_time)
+    # forecast of water demand:
+    gv.forecast = WaterForecast()
     # set last update of RTC to history, so update will be run after every
     # start of yawspi:
     gv.lastRTCupdate = arrow.get(2001, 1, 1)
@@ -1815,11 +2329,13 @@ if __name__ == "__main__":
     gs_load()
     # cannot add log line before knowing logging is enabled, and this settings
     # was loaded by gs_load():
-    log_add('<b>starting</b>')
+    event_add('system', 'starting')
     # initialize hw:
     # maybe do not put hw to gv.hw and ensure web server cannot touch
     # hardware... # XXX
     gv.hw = YawspiHW()
+    # start thread for filling of stations:
+    gv.fills = FillExecutor()
     # check time
     check_and_set_time()
     if gv.hw.WithHW != 1:
@@ -1829,6 +2345,12 @@ if __name__ == "__main__":
             log_add(tmp)
     # load hardware settings:
     hws_load()
+    # open store of measured data, convert old data files:
+    gv.ts = tsstore.TimeSeriesStore(gv.datadir)
+    data_migrate()
+    gv.charts = chart_cache.ChartCache()
+    # remove old data and compress cold data in background:
+    gv.compactor = retention.Compactor(gv.ts, data_retention, gv.fills.busy)
     # load programs:
     prg_load()
 
@@ -1845,61 +2367,73 @@ if __name__ == "__main__":
 
     # -------------------------------- main program loop
     try:
-        # generate time of next loop iteration
-        loopendtime = arrow.now('local')
-        loopendtime = loopendtime.replace(seconds=+gv.gs['MLInterval'])
-        loopendtime = loopendtime.floor('second')
+        # find start times of calendar programs:
+        prg_schedule_all()
+        # generate time of next measuring of sensors:
+        polltime = arrow.now('local')
         while True:
-            # generate values for web:
-            # measure water levels:
-            sensors_get_all()
-            # if web thread asked for break, do it:
-
-            # watering
-            if gv.gs['Enabled']:
-                # check progs if watering should start:
-                for i in range(len(gv.prg)):
-                    if prg_is_water_time(i):
-                        # if program should water now, do it:
+            if arrow.now('local') >= polltime:
+                # generate values for web:
+                # measure water levels:
+                sensors_get_all()
+                # watering
+                if gv.gs['Enabled']:
+                    # check water level progs if watering should start:
+                    for i in range(len(gv.prg)):
+                        if gv.prg[i]['Mode'] == 'waterlevel' and \
+                                prg_is_water_time(i):
+                            # if program should water now, do it:
+                            prg_water(i)
+                # forecast water demand with new source water level:
+                forecast_update()
+                # check RTC time
+                check_and_set_time()
+                # dump log buffer into a file
+                log_save()
+                # generate next measuring time, and it will be multiple of
+                # MLInterval from last time. This prevents that a loop takes
+                # MLInterval + time of measuring
+                polltime = polltime.replace(seconds=+gv.gs['MLInterval'])
+                polltime = polltime.floor('second')
+                # ensure polltime is not in the past:
+                while polltime <= arrow.now('local'):
+                    polltime = polltime.replace(seconds=+gv.gs['MLInterval'])
+            # start calendar programs which are due (every start time is
+            # returned once, even if main loop woke up late):
+            for i in gv.sched.pop_due(time()):
+                if i < len(gv.prg):
+                    if gv.gs['Enabled'] and prg_is_water_time(i, True):
                         prg_water(i)
-            # check RTC time
-            check_and_set_time()
-            # dump log buffer into a file
-            log_save()
-
-            # wait for next loop iteration
-            # (time.sleep(60) is not good because catching KeyboardInterrupt
-            # exception (end from web thread) would take up to 60 seconds)
-            while arrow.now('local') < loopendtime:
-                gv.cv['CurAct'] = 'waiting for next main loop iteration in ' \
-                                  + loopendtime.isoformat()
-                # if some flag from webserver:
-                # if web thread asked for break, do it:
-                if 'askforbreak' in gv.flags:
-                    gv.flags.remove('askforbreak')
-                    break
-                # if web thread asked for watering of station:
-                for i in range(gv.hw.StNo):
-                    flag = 'askforrun' + str(i)
-                    if flag in gv.flags:
-                        # water now!
-                        station_fill(i)
-                        gv.flags.remove(flag)
-                sleep(1)
-            # generate next loopend time, and it will be multiple of MLInterval
-            # from last time. This prevents that a loop takes MLInterval +
-            # watering time (which can take loooong)
-            if arrow.now('local') >= loopendtime:
-                # this happens only if waiting for next iteration was not
-                # broken by web:
-                loopendtime = loopendtime.replace(seconds=+gv.gs['MLInterval'])
-                loopendtime = loopendtime.floor('second')
-                # ensure loopendtime is not in the past, some watering can take
-                # loooong time:
-                while loopendtime < arrow.now('local'):
-                    loopendtime = loopendtime.replace(
-                        seconds=+gv.gs['MLInterval']
-                    )
+                    prg_schedule(i)
+            prg_update_next_runs()
+
+            # wait for next measuring, next start of a program or for commands
+            # from web thread (waiting is done in steps of at most 1 s,
+            # because catching KeyboardInterrupt exception (end from web
+            # thread) would be delayed for whole waiting time)
+            wakeup = polltime.float_timestamp
+            if gv.sched.next_time() is not None:
+                wakeup = min(wakeup, gv.sched.next_time())
+            gv.cv['CurAct'] = 'waiting for next main loop iteration in ' \
+                              + arrow.get(wakeup).to('local').isoformat()
+            while time() < wakeup:
+                for cmd in gv.cmd.wait(min(wakeup - time(), 1)):
+                    if cmd['Kind'] == 'break':
+                        # web thread asked for break, measure now:
+                        polltime = arrow.now('local')
+                        wakeup = time()
+                    elif cmd['Kind'] == 'run':
+                        # web thread asked for watering of station:
+                        station_fill_submit(cmd['Index'])
+                    elif cmd['Kind'] == 'reschedule':
+                        # web thread changed programs:
+                        if cmd['Index'] is None:
+                            prg_schedule_all()
+                        else:
+                            prg_schedule(cmd['Index'])
+                        if gv.sched.next_time() is not None:
+                            wakeup = min(wakeup, gv.sched.next_time())
+                gv.cv['CmdLatency'] = (gv.cmd.LastLatency, gv.cmd.MaxLatency)
     except KeyboardInterrupt:
         # keyboard interrupt or reboot pressed in webserver
         # (system is rebooted when called from web page, but not when python is